@@ -0,0 +1,35 @@
+"""Add job queue columns
+
+Revision ID: 5c1e8f0b7d2a
+Revises: a2a791f91c40
+Create Date: 2026-10-18 09:12:40.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e8f0b7d2a'
+down_revision: Union[str, Sequence[str], None] = 'a2a791f91c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('claimed_by', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+    op.add_column('jobs', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    # Worker claim theo thứ tự created_at trong các job PENDING
+    op.create_index('ix_jobs_queue', 'jobs', ['status', 'created_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_queue', table_name='jobs')
+    op.drop_column('jobs', 'attempts')
+    op.drop_column('jobs', 'heartbeat_at')
+    op.drop_column('jobs', 'claimed_by')
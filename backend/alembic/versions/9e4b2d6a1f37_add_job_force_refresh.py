@@ -0,0 +1,28 @@
+"""Add force_refresh to jobs
+
+Revision ID: 9e4b2d6a1f37
+Revises: 5c1e8f0b7d2a
+Create Date: 2026-10-18 10:03:27.541862
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b2d6a1f37'
+down_revision: Union[str, Sequence[str], None] = '5c1e8f0b7d2a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('force_refresh', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('jobs', 'force_refresh')
@@ -0,0 +1,32 @@
+"""Add content key columns to jobs for the shared result cache
+
+Revision ID: b4e6a2d8c1f5
+Revises: f2c8d4b6a7e1
+Create Date: 2026-10-18 21:42:06.318254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e6a2d8c1f5'
+down_revision: Union[str, Sequence[str], None] = 'f2c8d4b6a7e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('content_key', sa.String(length=64), nullable=True))
+    op.add_column('jobs', sa.Column('html_digest', sa.String(length=64), nullable=True))
+    op.create_index('ix_jobs_content_key_completed_at', 'jobs', ['content_key', 'completed_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_content_key_completed_at', table_name='jobs')
+    op.drop_column('jobs', 'html_digest')
+    op.drop_column('jobs', 'content_key')
@@ -0,0 +1,33 @@
+"""Add stage to jobs
+
+Revision ID: c3f7a9e2b841
+Revises: 9e4b2d6a1f37
+Create Date: 2026-10-18 13:41:09.286415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f7a9e2b841'
+down_revision: Union[str, Sequence[str], None] = '9e4b2d6a1f37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('stage', sa.String(), nullable=True))
+    op.execute(
+        "UPDATE jobs SET stage = CASE status "
+        "WHEN 'PENDING' THEN 'queued' WHEN 'COMPLETED' THEN 'done' "
+        "WHEN 'FAILED' THEN 'failed' ELSE 'collecting' END"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('jobs', 'stage')
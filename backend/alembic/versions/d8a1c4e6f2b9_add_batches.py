@@ -0,0 +1,41 @@
+"""Add batches table and jobs.batch_id
+
+Revision ID: d8a1c4e6f2b9
+Revises: c3f7a9e2b841
+Create Date: 2026-10-18 15:02:37.510284
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8a1c4e6f2b9'
+down_revision: Union[str, Sequence[str], None] = 'c3f7a9e2b841'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'batches',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.add_column('jobs', sa.Column('batch_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_foreign_key('fk_jobs_batch_id', 'jobs', 'batches', ['batch_id'], ['id'])
+    op.create_index('ix_jobs_batch_id', 'jobs', ['batch_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_batch_id', table_name='jobs')
+    op.drop_constraint('fk_jobs_batch_id', 'jobs', type_='foreignkey')
+    op.drop_column('jobs', 'batch_id')
+    op.drop_table('batches')
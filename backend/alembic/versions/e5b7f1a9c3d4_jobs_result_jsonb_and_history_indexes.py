@@ -0,0 +1,54 @@
+"""Move jobs.result to JSONB and add job history indexes
+
+Revision ID: e5b7f1a9c3d4
+Revises: d8a1c4e6f2b9
+Create Date: 2026-10-18 16:20:54.803117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b7f1a9c3d4'
+down_revision: Union[str, Sequence[str], None] = 'd8a1c4e6f2b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Index biểu thức trên result.overall_score ở revision này; f2c8d4b6a7e1 thay bằng cột overall_score
+OVERALL_SCORE_SQL = (
+    "(CASE WHEN jsonb_typeof(result -> 'overall_score') = 'number' "
+    "THEN (result ->> 'overall_score')::double precision END)"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column(
+        'jobs', 'result',
+        type_=postgresql.JSONB(),
+        existing_type=sa.JSON(),
+        existing_nullable=True,
+        postgresql_using='result::jsonb',
+    )
+    # (status, created_at) đã có từ ix_jobs_queue
+    op.create_index('ix_jobs_created_at_id', 'jobs', ['created_at', 'id'])
+    op.create_index('ix_jobs_target_url_created_at', 'jobs', ['target_url', 'created_at'])
+    op.create_index('ix_jobs_overall_score', 'jobs', [sa.text(OVERALL_SCORE_SQL)])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_overall_score', table_name='jobs')
+    op.drop_index('ix_jobs_target_url_created_at', table_name='jobs')
+    op.drop_index('ix_jobs_created_at_id', table_name='jobs')
+    op.alter_column(
+        'jobs', 'result',
+        type_=sa.JSON(),
+        existing_type=postgresql.JSONB(),
+        existing_nullable=True,
+        postgresql_using='result::json',
+    )
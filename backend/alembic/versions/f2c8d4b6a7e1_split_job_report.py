@@ -0,0 +1,153 @@
+"""Split job report into compressed column and typed summary columns
+
+Revision ID: f2c8d4b6a7e1
+Revises: e5b7f1a9c3d4
+Create Date: 2026-10-18 17:05:12.442019
+
+"""
+import json
+import zlib
+from typing import Any, Dict, Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c8d4b6a7e1'
+down_revision: Union[str, Sequence[str], None] = 'e5b7f1a9c3d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+SUMMARY_COLUMNS = (
+    'overall_score', 'performance_score', 'accessibility_score', 'design_score',
+    'code_issue_count', 'ui_issue_count',
+)
+
+jobs = sa.table(
+    'jobs',
+    sa.column('id', postgresql.UUID(as_uuid=True)),
+    sa.column('status', sa.String()),
+    sa.column('result', postgresql.JSONB(none_as_null=True)),
+    sa.column('report', sa.LargeBinary()),
+    sa.column('screenshots', postgresql.JSONB(none_as_null=True)),
+    *(sa.column(name) for name in SUMMARY_COLUMNS),
+)
+
+
+# Bản sao cố định của app.models.types / app.models.job tại revision này: migration không
+# được đổi hành vi khi code của app thay đổi về sau. Định dạng nén (byte đầu là codec) phải
+# đọc được bởi CompressedJSON.
+def compress_json(value: Any) -> bytes:
+    raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if zstandard is not None:
+        return b"Z" + zstandard.ZstdCompressor(level=6).compress(raw)
+    return b"G" + zlib.compress(raw, 6)
+
+
+def decompress_json(data: bytes) -> Any:
+    data = bytes(data)
+    codec, payload = data[:1], data[1:]
+    if codec == b"Z":
+        if zstandard is None:
+            raise RuntimeError("Reading zstd-compressed reports requires zstandard (pip install zstandard)")
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == b"G":
+        raw = zlib.decompress(payload)
+    else:
+        raise ValueError(f"Unknown compression header: {codec!r}")
+    return json.loads(raw)
+
+
+def _score(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def completed_job_values(result: Dict) -> Dict[str, Any]:
+    issues = result.get('issues') or {}
+    return {
+        'result': None,
+        'report': result,
+        'screenshots': result.get('screenshots'),
+        'overall_score': _score(result.get('overall_score')),
+        'performance_score': _score((result.get('performance') or {}).get('score')),
+        'accessibility_score': _score((result.get('accessibility') or {}).get('score')),
+        'design_score': _score((result.get('design') or {}).get('score')),
+        'code_issue_count': len(issues.get('code') or []),
+        'ui_issue_count': len(issues.get('ui') or []),
+    }
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('report', sa.LargeBinary(), nullable=True))
+    op.add_column('jobs', sa.Column('screenshots', postgresql.JSONB(), nullable=True))
+    op.add_column('jobs', sa.Column('overall_score', sa.Float(), nullable=True))
+    op.add_column('jobs', sa.Column('performance_score', sa.Float(), nullable=True))
+    op.add_column('jobs', sa.Column('accessibility_score', sa.Float(), nullable=True))
+    op.add_column('jobs', sa.Column('design_score', sa.Float(), nullable=True))
+    op.add_column('jobs', sa.Column('code_issue_count', sa.Integer(), nullable=True))
+    op.add_column('jobs', sa.Column('ui_issue_count', sa.Integer(), nullable=True))
+
+    # Chuyển report của job đã xong sang cột nén theo từng lô (nén ở Python nên không làm bằng SQL)
+    bind = op.get_bind()
+    last_id = None
+    while True:
+        query = (
+            sa.select(jobs.c.id, jobs.c.result)
+            .where(jobs.c.status == 'COMPLETED', jobs.c.result.isnot(None))
+            .order_by(jobs.c.id)
+            .limit(BATCH_SIZE)
+        )
+        if last_id is not None:
+            query = query.where(jobs.c.id > last_id)
+        rows = bind.execute(query).all()
+        if not rows:
+            break
+        for job_id, result in rows:
+            values = completed_job_values(result)
+            values['report'] = compress_json(values['report'])
+            bind.execute(jobs.update().where(jobs.c.id == job_id).values(**values))
+        last_id = rows[-1][0]
+
+    op.drop_index('ix_jobs_overall_score', table_name='jobs')
+    op.create_index('ix_jobs_overall_score', 'jobs', ['overall_score'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    last_id = None
+    while True:
+        query = sa.select(jobs.c.id, jobs.c.report).where(jobs.c.report.isnot(None)).order_by(jobs.c.id).limit(BATCH_SIZE)
+        if last_id is not None:
+            query = query.where(jobs.c.id > last_id)
+        rows = bind.execute(query).all()
+        if not rows:
+            break
+        for job_id, report in rows:
+            bind.execute(jobs.update().where(jobs.c.id == job_id).values(result=decompress_json(report)))
+        last_id = rows[-1][0]
+
+    op.drop_index('ix_jobs_overall_score', table_name='jobs')
+    op.create_index(
+        'ix_jobs_overall_score', 'jobs',
+        [sa.text(
+            "(CASE WHEN jsonb_typeof(result -> 'overall_score') = 'number' "
+            "THEN (result ->> 'overall_score')::double precision END)"
+        )],
+    )
+    for name in reversed(SUMMARY_COLUMNS):
+        op.drop_column('jobs', name)
+    op.drop_column('jobs', 'screenshots')
+    op.drop_column('jobs', 'report')
@@ -1,80 +1,534 @@
-from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, get_async_db
 from app import schemas
-from app.models.job import Job
-from app.services.analyzer import run_analysis_task_bg
+from app.models.job import Batch, Job, JobStatus, completed_job_values
+from app.services.blob_store import BlobNotFoundError, get_blob_store, is_blob_ref
+from app.services.image_processing import VARIANT_MEDIA_TYPES
+from app.services.progress import broker as progress_broker
+from app.services.data_collector import DEVICE_PRESETS
+from app.utils.config import get_fresh_settings
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import base64
+import json
 import os
+import uuid
 from pathlib import Path
 
 router = APIRouter()
 
+
+async def _find_recent_result(db: AsyncSession, url: str):
+    """
+    Kết quả của job COMPLETED gần nhất cho đúng URL này trong URL_RESULT_REUSE_SECONDS.
+
+    Chỉ so URL, không so nội dung trang: trang đổi trong khoảng này vẫn nhận kết quả cũ.
+    Cache theo nội dung (HTML + screenshot) nằm ở worker.
+    """
+    reuse_seconds = get_fresh_settings().URL_RESULT_REUSE_SECONDS
+    if reuse_seconds <= 0:
+        return None
+    cutoff = datetime.utcnow() - timedelta(seconds=reuse_seconds)
+    result = await db.scalar(
+        select(Job.report)
+        .where(Job.target_url == url, Job.status == JobStatus.COMPLETED, Job.completed_at >= cutoff)
+        .order_by(Job.completed_at.desc())
+        .limit(1)
+    )
+    if not result:
+        return None
+    return dict(result)
+
 @router.post("/analyze", response_model=schemas.AnalyzeResponse, status_code=202)
-def analyze_url(
-    request: schemas.AnalyzeRequest, 
-    background_tasks: BackgroundTasks, 
-    db: Session = Depends(get_db)
+async def analyze_url(request: schemas.AnalyzeRequest, db: AsyncSession = Depends(get_async_db)):
+    # Bật URL_RESULT_REUSE_SECONDS: URL vừa được phân tích thì trả luôn kết quả đó, không cần worker
+    cached = None if request.force_refresh else await _find_recent_result(db, request.url)
+    if cached is not None:
+        job_id = uuid.uuid4()
+        cached.update({"job_id": str(job_id), "cached_from": cached["job_id"]})
+        db.add(Job(
+            id=job_id, target_url=request.url, status=JobStatus.COMPLETED, stage="done",
+            completed_at=datetime.utcnow(), **completed_job_values(cached),
+        ))
+        await db.commit()
+        return {"job_id": job_id}
+
+    # Tạo job PENDING; worker (python -m app.worker) sẽ claim và xử lý
+    job_id = uuid.uuid4()
+    db.add(Job(id=job_id, target_url=request.url, force_refresh=request.force_refresh))
+    await db.commit()
+
+    return {"job_id": job_id}
+
+
+async def _find_recent_results(db: AsyncSession, urls: List[str]) -> Dict[str, Dict]:
+    """Bản batch của _find_recent_result: số query không phụ thuộc số URL."""
+    reuse_seconds = get_fresh_settings().URL_RESULT_REUSE_SECONDS
+    if reuse_seconds <= 0:
+        return {}
+    found: Dict[str, Dict] = {}
+
+    # Chỉ đọc cột nhẹ để chọn job mới nhất cho mỗi URL, sau đó mới tải result
+    cutoff = datetime.utcnow() - timedelta(seconds=reuse_seconds)
+    latest: Dict[str, uuid.UUID] = {}
+    rows = await db.execute(
+        select(Job.id, Job.target_url)
+        .where(Job.target_url.in_(urls), Job.status == JobStatus.COMPLETED, Job.completed_at >= cutoff)
+        .order_by(Job.completed_at.desc())
+    )
+    for row in rows:
+        latest.setdefault(row.target_url, row.id)
+    if latest:
+        results = dict((await db.execute(select(Job.id, Job.report).where(Job.id.in_(list(latest.values()))))).all())
+        for url, job_id in latest.items():
+            if results.get(job_id):
+                found[url] = dict(results[job_id])
+    return found
+
+
+@router.post("/analyze/batch", response_model=schemas.BatchAnalyzeResponse, status_code=202)
+async def analyze_batch(request: schemas.BatchAnalyzeRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Submit many URLs at once: one batch row plus one bulk INSERT for all jobs.
+
+    With URL_RESULT_REUSE_SECONDS set, URLs analyzed within that window are created
+    as COMPLETED right away; the rest are queued and claimed by workers fairly
+    alongside other batches.
+    """
+    urls = list(dict.fromkeys(url.strip() for url in request.urls if url.strip()))
+    max_urls = get_fresh_settings().BATCH_MAX_URLS
+    if not urls:
+        raise HTTPException(status_code=400, detail="No URLs provided")
+    if len(urls) > max_urls:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {max_urls} URLs")
+
+    cached = {} if request.force_refresh else await _find_recent_results(db, urls)
+
+    batch_id = uuid.uuid4()
+    now = datetime.utcnow()
+    # executemany cần mọi dict có cùng tập key
+    no_report = dict.fromkeys(completed_job_values({}))
+    rows = []
+    for url in urls:
+        job_id = uuid.uuid4()
+        result = cached.get(url)
+        if result is not None:
+            result = {**result, "job_id": str(job_id), "cached_from": result["job_id"]}
+        rows.append({
+            "id": job_id,
+            "batch_id": batch_id,
+            "target_url": url,
+            "force_refresh": request.force_refresh,
+            "status": JobStatus.COMPLETED if result is not None else JobStatus.PENDING,
+            "stage": "done" if result is not None else "queued",
+            "completed_at": now if result is not None else None,
+            **(completed_job_values(result) if result is not None else no_report),
+        })
+
+    await db.execute(insert(Batch).values(id=batch_id, total=len(rows)))
+    await db.execute(insert(Job), rows)
+    await db.commit()
+
+    return {"batch_id": batch_id, "job_ids": [row["id"] for row in rows]}
+
+
+def _batch_status(counts: Dict[str, int]) -> str:
+    """PENDING khi chưa job nào chạy, PROCESSING khi còn job chưa xong, sau đó COMPLETED (FAILED nếu mọi job lỗi)."""
+    pending = counts.get(JobStatus.PENDING.value, 0)
+    if pending == sum(counts.values()):
+        return JobStatus.PENDING.value
+    if pending or counts.get(JobStatus.PROCESSING.value, 0):
+        return JobStatus.PROCESSING.value
+    if counts.get(JobStatus.COMPLETED.value, 0):
+        return JobStatus.COMPLETED.value
+    return JobStatus.FAILED.value
+
+
+@router.get("/batch/{batch_id}", response_model=schemas.BatchStatusResponse)
+async def get_batch_status(batch_id: uuid.UUID, include_results: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """
+    Aggregate status of a batch plus per-URL status and overall score.
+
+    The full result of each completed job is only loaded with `include_results=true`.
+    """
+    columns = [Job.id, Job.target_url, Job.status, Job.stage, Job.error_message, Job.overall_score]
+    if include_results:
+        columns.append(Job.report)
+    rows = (await db.execute(select(*columns).where(Job.batch_id == batch_id).order_by(Job.created_at))).all()
+    if not rows and await db.scalar(select(Batch.id).where(Batch.id == batch_id)) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    counts: Dict[str, int] = {status.value: 0 for status in JobStatus}
+    jobs = []
+    for row in rows:
+        counts[row.status.value] += 1
+        jobs.append({
+            "job_id": row.id,
+            "url": row.target_url,
+            "status": row.status.value,
+            "stage": row.stage,
+            "overall_score": row.overall_score,
+            "error_message": row.error_message,
+            "result": row.report if include_results else None,
+        })
+
+    return {
+        "batch_id": batch_id,
+        "status": _batch_status(counts) if rows else JobStatus.PENDING.value,
+        "total": len(rows),
+        "counts": counts,
+        "jobs": jobs,
+    }
+
+
+def _encode_cursor(created_at: datetime, job_id: uuid.UUID) -> str:
+    raw = json.dumps([created_at.isoformat(), str(job_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, job_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(job_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Cột created_at là timestamp không timezone (UTC)
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@router.get("/jobs", response_model=schemas.JobListResponse)
+async def list_jobs(
+    url: Optional[str] = None,
+    status: Optional[JobStatus] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    # Tạo job mới trong database
-    new_job = Job(target_url=request.url)
-    db.add(new_job)
-    db.commit()
-    db.refresh(new_job)
+    """
+    Job history, newest first, with keyset pagination.
 
-    # Thêm tác vụ phân tích vào nền (DB session sẽ được quản lý bên trong task)
-    background_tasks.add_task(run_analysis_task_bg, str(new_job.id), new_job.target_url)
+    Only summary columns are read; pass `next_cursor` back as `cursor` for the next
+    page. Cost per page does not grow with how deep the client has paged.
+    """
+    query = select(
+        Job.id,
+        Job.target_url,
+        Job.status,
+        Job.stage,
+        Job.overall_score,
+        Job.performance_score,
+        Job.accessibility_score,
+        Job.design_score,
+        Job.code_issue_count,
+        Job.ui_issue_count,
+        Job.batch_id,
+        Job.created_at,
+        Job.completed_at,
+        Job.error_message,
+    )
+    if url is not None:
+        query = query.where(Job.target_url == url)
+    if status is not None:
+        query = query.where(Job.status == status)
+    if created_after is not None:
+        query = query.where(Job.created_at >= _naive_utc(created_after))
+    if created_before is not None:
+        query = query.where(Job.created_at < _naive_utc(created_before))
+    if min_score is not None:
+        query = query.where(Job.overall_score >= min_score)
+    if max_score is not None:
+        query = query.where(Job.overall_score <= max_score)
+    if cursor:
+        cursor_created_at, cursor_id = _decode_cursor(cursor)
+        query = query.where(tuple_(Job.created_at, Job.id) < tuple_(cursor_created_at, cursor_id))
 
-    return {"job_id": new_job.id}
+    # Lấy dư một dòng để biết còn trang sau hay không
+    rows = (await db.execute(query.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return {
+        "items": [
+            {
+                "job_id": row.id,
+                "url": row.target_url,
+                "status": row.status.value,
+                "stage": row.stage,
+                "overall_score": row.overall_score,
+                "performance_score": row.performance_score,
+                "accessibility_score": row.accessibility_score,
+                "design_score": row.design_score,
+                "code_issue_count": row.code_issue_count,
+                "ui_issue_count": row.ui_issue_count,
+                "batch_id": row.batch_id,
+                "created_at": row.created_at,
+                "completed_at": row.completed_at,
+                "error_message": row.error_message,
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 @router.get("/status/{job_id}", response_model=schemas.StatusResponse)
-def get_status(job_id: str, db: Session = Depends(get_db)):
-    job = db.query(Job).filter(Job.id == job_id).first()
+async def get_status(job_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    # report chỉ có khi job đã xong; trong lúc chạy result là kết quả tạm
+    job = (
+        await db.execute(select(Job.status, Job.error_message, Job.result, Job.report).where(Job.id == job_id))
+    ).first()
     if not job:
         # Xử lý trường hợp không tìm thấy job
         return {"job_id": job_id, "status": "NOT_FOUND", "result": None, "error_message": None}
 
     return {
-        "job_id": job.id,
+        "job_id": job_id,
         "status": job.status.value,
-        "result": job.result,
+        "result": job.report if job.report is not None else job.result,
         "error_message": job.error_message
     }
 
 
+TERMINAL_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED)
+
+
+async def _load_progress(db: AsyncSession, job_id: uuid.UUID) -> Optional[Dict]:
+    # Chỉ đọc các cột nhẹ; result chỉ tải khi job đã xong
+    row = (await db.execute(select(Job.status, Job.stage, Job.error_message).where(Job.id == job_id))).first()
+    # Kết thúc transaction: trả connection về pool trong lúc chờ và lần đọc sau thấy dữ liệu mới
+    await db.commit()
+    if row is None:
+        return None
+    return {"job_id": job_id, "status": row.status.value, "stage": row.stage, "error_message": row.error_message}
+
+
+@router.get("/status/{job_id}/progress", response_model=schemas.ProgressResponse)
+async def get_progress(
+    job_id: uuid.UUID,
+    wait: float = Query(0, ge=0, le=60),
+    since: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Lightweight status: only status/stage until the job completes.
+
+    With `wait`, long-polls until the stage differs from `since` (or from the
+    current stage when `since` is omitted) or `wait` seconds pass.
+    """
+    with progress_broker.subscribe(str(job_id)) as events:
+        progress = await _load_progress(db, job_id)
+        if progress is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        baseline = since or progress["stage"]
+        if wait and progress["stage"] == baseline and JobStatus(progress["status"]) not in TERMINAL_STATUSES:
+            try:
+                await asyncio.wait_for(_wait_for_stage_change(events, baseline), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            progress = await _load_progress(db, job_id)
+
+    if progress["status"] == JobStatus.COMPLETED.value:
+        progress["result"] = await db.scalar(select(Job.report).where(Job.id == job_id))
+    return progress
+
+
+async def _wait_for_stage_change(events: asyncio.Queue, baseline: str) -> None:
+    while True:
+        event = await events.get()
+        if event.get("stage") != baseline:
+            return
+
+
+@router.get("/status/{job_id}/events")
+async def stream_progress(job_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    """
+    Server-Sent Events stream of stage transitions until the job completes or fails
+    """
+    progress = await _load_progress(db, job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        with progress_broker.subscribe(str(job_id)) as events:
+            # Đọc lại sau khi subscribe để không lỡ sự kiện xảy ra giữa hai bước.
+            # Session riêng, ngắn: stream có thể mở nhiều phút
+            async with AsyncSessionLocal() as stream_db:
+                current = await _load_progress(stream_db, job_id) or progress
+            current = {**current, "job_id": str(job_id)}
+            yield f"event: progress\ndata: {json.dumps(current)}\n\n"
+            last_stage = current["stage"]
+            while JobStatus(current["status"]) not in TERMINAL_STATUSES:
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment SSE giữ kết nối qua proxy
+                    yield ": keep-alive\n\n"
+                    continue
+                current = {**current, **{k: event[k] for k in ("status", "stage") if k in event}}
+                if current["stage"] == last_stage and JobStatus(current["status"]) not in TERMINAL_STATUSES:
+                    continue
+                last_stage = current["stage"]
+                yield f"event: progress\ndata: {json.dumps(current)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _accepted_types(accept: str) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for part in accept.split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if not fields[0]:
+            continue
+        quality = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[fields[0].lower()] = quality
+    return accepted
+
+
+def _negotiate_variant(accept: str, variants: Dict[str, str]) -> str:
+    """Chọn định dạng nhỏ nhất mà client chấp nhận: AVIF > WebP > PNG."""
+    accepted = _accepted_types(accept or "")
+    for name in ("avif", "webp"):
+        if name not in variants:
+            continue
+        media_type = VARIANT_MEDIA_TYPES[name]
+        quality = accepted.get(media_type)
+        # Chỉ chọn định dạng mới khi client nêu rõ, không dựa vào */* hay image/*
+        if quality is not None and quality > 0:
+            return name
+    return "png"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _byte_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse một khoảng `bytes=start-end`; trả về (start, end) inclusive hoặc None nếu không hợp lệ."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # bytes=-N: N byte cuối
+            start = max(0, size - int(end_text))
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
 @router.get("/screenshot/{job_id}/{device}")
-async def get_screenshot(job_id: str, device: str, db: Session = Depends(get_db)):
+async def get_screenshot(
+    job_id: uuid.UUID,
+    device: str,
+    request: Request,
+    variant: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
     """
     Serve screenshot images for completed analysis jobs
+
+    Format is negotiated from `Accept` (AVIF/WebP when generated, PNG otherwise);
+    `?variant=thumb` returns the thumbnail.
     """
     # Validate device parameter
-    if device not in ["desktop", "tablet", "mobile"]:
+    if device not in DEVICE_PRESETS:
         raise HTTPException(status_code=400, detail="Invalid device type")
 
-    # Check if job exists and is completed
-    job = db.query(Job).filter(Job.id == job_id).first()
-    if not job:
+    # Chỉ lấy status và reference của thiết bị cần, không tải cả cột result
+    row = (
+        await db.execute(select(Job.status, Job.screenshots[device]).where(Job.id == job_id))
+    ).first()
+    # Trả connection về pool trước khi đọc blob (có thể là S3)
+    await db.close()
+    if not row:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    if job.status.value != "COMPLETED":
+    status, screenshot_ref = row
+    if status != JobStatus.COMPLETED:
         raise HTTPException(status_code=400, detail="Job not completed yet")
 
-    if not job.result or not job.result.get("screenshots"):
-        raise HTTPException(status_code=404, detail="No screenshots found")
-
-    # Get screenshot path
-    screenshot_path = job.result["screenshots"].get(device)
-    if not screenshot_path:
+    if not screenshot_ref:
         raise HTTPException(status_code=404, detail=f"No {device} screenshot found")
 
-    # Check if file exists
-    if not os.path.exists(screenshot_path):
+    # Job cũ lưu đường dẫn file tạm thay vì digest
+    if isinstance(screenshot_ref, str) and not is_blob_ref(screenshot_ref):
+        if not os.path.exists(screenshot_ref):
+            raise HTTPException(status_code=404, detail="Screenshot file not found")
+        return FileResponse(path=screenshot_ref, media_type="image/png", filename=f"{device}.png")
+
+    variants = screenshot_ref if isinstance(screenshot_ref, dict) else {"png": screenshot_ref}
+    if variant == "thumb" and "thumb" in variants:
+        name = "thumb"
+    elif variant not in (None, "thumb"):
+        raise HTTPException(status_code=400, detail="Invalid variant")
+    else:
+        name = _negotiate_variant(request.headers.get("accept", ""), variants)
+    digest = variants[name]
+
+    # Nội dung bất biến theo digest nên digest chính là strong ETag
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept",
+        "Accept-Ranges": "bytes",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = await asyncio.to_thread(get_blob_store().get, digest)
+    except BlobNotFoundError:
         raise HTTPException(status_code=404, detail="Screenshot file not found")
 
-    # Return file
-    from fastapi.responses import FileResponse
-    return FileResponse(
-        path=screenshot_path,
-        media_type="image/png",
-        filename=f"{device}.png"
-    )
\ No newline at end of file
+    media_type = VARIANT_MEDIA_TYPES[name]
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        byte_range = _byte_range(range_header, len(data))
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{len(data)}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(content=data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+    return Response(content=data, media_type=media_type, headers=headers)
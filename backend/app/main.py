@@ -6,13 +6,57 @@ from dotenv import load_dotenv
 ENV_FILE = Path(__file__).parent.parent / ".env"
 load_dotenv(ENV_FILE, override=True)
 
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from app.api import endpoints
+from app.database import async_engine
+from app.services.browser_pool import close_browser_pool, warm_up_browser_pool
+from app.services.http_client import close_http_session
+from app.services.image_processing import shutdown_image_executor
+from app.services.progress import PgProgressListener
+from app.services.telemetry import METRICS_CONTENT_TYPE, metrics_payload
+from app.utils.config import get_fresh_settings
+from app.worker import Worker
 
-app = FastAPI(title="AI UI/UX Analyzer")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nhận NOTIFY tiến độ job từ các worker để đẩy cho client long-poll/SSE
+    progress_listener = PgProgressListener()
+    progress_listener.start()
+
+    worker = None
+    worker_task = None
+    concurrency = get_fresh_settings().EMBEDDED_WORKER_CONCURRENCY
+    if concurrency > 0:
+        worker = Worker.from_settings(concurrency)
+        await warm_up_browser_pool()
+        worker_task = asyncio.create_task(worker.run())
+
+    yield
+
+    if worker is not None:
+        worker.stop()
+        await worker_task
+    progress_listener.stop()
+    # Đóng các Chromium trong pool (chỉ có khi bật worker nhúng) và connection pool HTTP khi tắt server
+    await close_browser_pool()
+    await close_http_session()
+    shutdown_image_executor()
+    await async_engine.dispose()
+
+
+app = FastAPI(title="AI UI/UX Analyzer", lifespan=lifespan)
 
 app.include_router(endpoints.router, prefix="/api/v1")
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the AI UI/UX Analyzer API"}
\ No newline at end of file
+    return {"message": "Welcome to the AI UI/UX Analyzer API"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus metrics of this process (and the embedded worker, if enabled)."""
+    return Response(content=metrics_payload(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,84 @@
+"""
+Các tác vụ bảo trì chạy định kỳ (cron) hoặc thủ công.
+
+    python -m app.maintenance gc-blobs
+    python -m app.maintenance sweep [--gc-blobs]
+"""
+import argparse
+import logging
+from pathlib import Path
+from typing import Iterator
+
+from dotenv import load_dotenv
+
+ENV_FILE = Path(__file__).parent.parent / ".env"
+load_dotenv(ENV_FILE, override=True)
+
+from app.database import SessionLocal
+from app.models.job import Job
+from app.services.blob_store import collect_garbage, get_blob_store, is_blob_ref
+from app.services.retention import RetentionSweeper
+from app.utils.config import get_fresh_settings
+
+logger = logging.getLogger(__name__)
+
+
+def _iter_refs(value) -> Iterator[str]:
+    if isinstance(value, str):
+        if is_blob_ref(value):
+            yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_refs(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_refs(item)
+
+
+def referenced_blob_digests() -> Iterator[str]:
+    """Mọi digest screenshot còn được job nào đó tham chiếu."""
+    db = SessionLocal()
+    try:
+        rows = db.query(Job.screenshots).filter(Job.screenshots.isnot(None)).yield_per(1000)
+        for (screenshots,) in rows:
+            yield from _iter_refs(screenshots)
+    finally:
+        db.close()
+
+
+def gc_blobs() -> int:
+    settings = get_fresh_settings()
+    removed = collect_garbage(get_blob_store(), referenced_blob_digests(), settings.BLOB_GC_GRACE_SECONDS)
+    logger.info("Removed %d unreferenced blobs", removed)
+    return removed
+
+
+def sweep(with_gc: bool = False) -> dict:
+    """Áp dụng chính sách retention; `with_gc` xoá luôn blob không còn được tham chiếu."""
+    reclaimed = RetentionSweeper.from_settings().sweep()
+    if reclaimed is None:
+        logger.info("Another retention sweep is running, skipped")
+        return {}
+    if with_gc:
+        reclaimed["blobs_removed"] = gc_blobs()
+        logger.info("Retention sweep reclaimed %s", reclaimed)
+    return reclaimed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintenance tasks")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("gc-blobs", help="Delete screenshot blobs no job references")
+    sweep_parser = subcommands.add_parser("sweep", help="Apply the job retention policy")
+    sweep_parser.add_argument("--gc-blobs", action="store_true", help="Also delete unreferenced blobs afterwards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    if args.command == "gc-blobs":
+        gc_blobs()
+    elif args.command == "sweep":
+        print(sweep(with_gc=args.gc_blobs))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 import uuid
-from sqlalchemy import Column, String, DateTime, JSON, Enum as SQLAlchemyEnum
-from sqlalchemy.dialects.postgresql import UUID
+from typing import Any, Dict, Optional
+from sqlalchemy import Column, String, DateTime, Integer, Boolean, Float, JSON, ForeignKey, Index, Enum as SQLAlchemyEnum
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 import enum
 
+from app.models.types import CompressedJSON
+
 Base = declarative_base()
 
 class JobStatus(enum.Enum):
@@ -13,13 +17,84 @@ class JobStatus(enum.Enum):
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
 
+class Batch(Base):
+    """Một lần gửi nhiều URL qua POST /analyze/batch"""
+    __tablename__ = "batches"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    total = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
 class Job(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_queue", "status", "created_at"),
+        # Lịch sử: sắp xếp/phân trang theo (created_at, id), lọc theo URL
+        Index("ix_jobs_created_at_id", "created_at", "id"),
+        Index("ix_jobs_target_url_created_at", "target_url", "created_at"),
+        Index("ix_jobs_overall_score", "overall_score"),
+        # Result cache dùng chung giữa các worker: job xong gần nhất có cùng nội dung trang
+        Index("ix_jobs_content_key_completed_at", "content_key", "completed_at"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     status = Column(SQLAlchemyEnum(JobStatus), default=JobStatus.PENDING, nullable=False)
     target_url = Column(String, nullable=False)
-    result = Column(JSON, nullable=True)
+    # Kết quả tạm (issue đã stream xong) trong lúc job chạy; job cũ chưa tách report cũng nằm ở đây
+    result = Column(JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql"), nullable=True)
+    # Báo cáo đầy đủ khi job xong: nén và deferred, chỉ tải khi client cần
+    report = deferred(Column(CompressedJSON, nullable=True))
+    # Reference blob screenshot theo thiết bị: {device: {"png": digest, ...}}
+    screenshots = Column(JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql"), nullable=True)
+
+    # Tóm tắt của report dưới dạng cột để list/lọc không cần đọc report
+    overall_score = Column(Float, nullable=True)
+    performance_score = Column(Float, nullable=True)
+    accessibility_score = Column(Float, nullable=True)
+    design_score = Column(Float, nullable=True)
+    code_issue_count = Column(Integer, nullable=True)
+    ui_issue_count = Column(Integer, nullable=True)
     error_message = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
-    completed_at = Column(DateTime, nullable=True)
\ No newline at end of file
+    completed_at = Column(DateTime, nullable=True)
+    # Stage hiện tại của pipeline (xem app.services.progress.STAGES)
+    stage = Column(String, default="queued", nullable=True)
+    # Bỏ qua result cache và phân tích lại từ đầu
+    force_refresh = Column(Boolean, default=False, nullable=False)
+    # Batch chứa job (None với job gửi lẻ qua /analyze)
+    batch_id = Column(UUID(as_uuid=True), ForeignKey("batches.id"), nullable=True, index=True)
+
+    # Hàng đợi: worker nào đang giữ job và lần cuối nó báo còn sống
+    claimed_by = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+
+    # Result cache: SHA-256 của URL chuẩn hoá + HTML + screenshot (content_key) và của riêng HTML
+    content_key = Column(String(64), nullable=True)
+    html_digest = Column(String(64), nullable=True)
+
+
+def _score(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def completed_job_values(result: Dict) -> Dict[str, Any]:
+    """
+    Giá trị các cột khi lưu một report hoàn chỉnh: report nén, screenshots và tóm tắt.
+
+    `result` được xoá vì report đã thay thế kết quả tạm.
+    """
+    issues = result.get("issues") or {}
+    return {
+        "result": None,
+        "report": result,
+        "screenshots": result.get("screenshots"),
+        "overall_score": _score(result.get("overall_score")),
+        "performance_score": _score((result.get("performance") or {}).get("score")),
+        "accessibility_score": _score((result.get("accessibility") or {}).get("score")),
+        "design_score": _score((result.get("design") or {}).get("score")),
+        "code_issue_count": len(issues.get("code") or []),
+        "ui_issue_count": len(issues.get("ui") or []),
+    }
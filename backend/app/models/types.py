@@ -0,0 +1,53 @@
+import json
+import zlib
+from typing import Any, Optional
+
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import zstandard
+except ImportError:  # zstd là tuỳ chọn, không có thì dùng zlib
+    zstandard = None
+
+# Byte đầu cho biết codec để đọc được dữ liệu ghi bởi cả hai cách
+_ZSTD = b"Z"
+_ZLIB = b"G"
+
+
+def compress_json(value: Any) -> bytes:
+    raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if zstandard is not None:
+        return _ZSTD + zstandard.ZstdCompressor(level=6).compress(raw)
+    return _ZLIB + zlib.compress(raw, 6)
+
+
+def decompress_json(data: bytes) -> Any:
+    data = bytes(data)
+    codec, payload = data[:1], data[1:]
+    if codec == _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Reading zstd-compressed reports requires zstandard (pip install zstandard)")
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == _ZLIB:
+        raw = zlib.decompress(payload)
+    else:
+        raise ValueError(f"Unknown compression header: {codec!r}")
+    return json.loads(raw)
+
+
+class CompressedJSON(TypeDecorator):
+    """JSON lưu dạng nén (zstd nếu có, ngược lại zlib); model làm việc với dict như cột JSON."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value: Any, dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        return compress_json(value)
+
+    def process_result_value(self, value: Optional[bytes], dialect) -> Any:
+        if value is None:
+            return None
+        return decompress_json(value)
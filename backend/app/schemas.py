@@ -1,8 +1,10 @@
-from pydantic import BaseModel, UUID4
-from typing import Optional, Any
+from pydantic import BaseModel, Field, UUID4
+from datetime import datetime
+from typing import Optional, Any, Dict, List
 
 class AnalyzeRequest(BaseModel):
     url: str
+    force_refresh: bool = False
 
 class AnalyzeResponse(BaseModel):
     job_id: UUID4
@@ -11,4 +13,59 @@ class StatusResponse(BaseModel):
     job_id: UUID4
     status: str
     result: Optional[Any] = None
-    error_message: Optional[str] = None
\ No newline at end of file
+    error_message: Optional[str] = None
+
+class ProgressResponse(BaseModel):
+    job_id: UUID4
+    status: str
+    stage: Optional[str] = None
+    error_message: Optional[str] = None
+    # Chỉ có khi job đã COMPLETED
+    result: Optional[Any] = None
+
+class BatchAnalyzeRequest(BaseModel):
+    urls: List[str] = Field(min_length=1)
+    force_refresh: bool = False
+
+class BatchAnalyzeResponse(BaseModel):
+    batch_id: UUID4
+    # Cùng thứ tự với danh sách URL (sau khi bỏ trùng)
+    job_ids: List[UUID4]
+
+class BatchJobStatus(BaseModel):
+    job_id: UUID4
+    url: str
+    status: str
+    stage: Optional[str] = None
+    overall_score: Optional[float] = None
+    error_message: Optional[str] = None
+    # Chỉ có khi gọi với include_results=true và job đã COMPLETED
+    result: Optional[Any] = None
+
+class BatchStatusResponse(BaseModel):
+    batch_id: UUID4
+    status: str
+    total: int
+    counts: Dict[str, int]
+    jobs: List[BatchJobStatus]
+
+class JobSummary(BaseModel):
+    job_id: UUID4
+    url: str
+    status: str
+    stage: Optional[str] = None
+    overall_score: Optional[float] = None
+    performance_score: Optional[float] = None
+    accessibility_score: Optional[float] = None
+    design_score: Optional[float] = None
+    code_issue_count: Optional[int] = None
+    ui_issue_count: Optional[int] = None
+    batch_id: Optional[UUID4] = None
+    created_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    error_message: Optional[str] = None
+
+class JobListResponse(BaseModel):
+    items: List[JobSummary]
+    # Truyền lại qua ?cursor= để lấy trang tiếp theo; None khi hết
+    next_cursor: Optional[str] = None
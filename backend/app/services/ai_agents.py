@@ -1,22 +1,71 @@
+import asyncio
+import itertools
 import json
-import base64
+import logging
 import os
-from typing import Dict
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 
 import aiohttp
 
 from app.utils.config import get_fresh_settings
+from app.services.llm_memo import MemoStore, get_memo_store, memo_key
+from app.services.http_client import get_http_session
+from app.services.llm_governor import get_llm_governor
+from app.services.prompt_distill import (
+    compact_json,
+    distill_analyses,
+    distill_lighthouse,
+    estimate_tokens,
+    fit_to_budget,
+    summarize_html,
+    token_budget,
+)
+from app.services.json_extract import parse_model_output
+from app.services.json_stream import StreamingArrayExtractor
+from app.services.llm_schemas import CodeAnalysis, Synthesis, TileAnalysis, VisionAnalysis
+from app.services.telemetry import record_usage, record_vision_payload, span
+from app.services.vision_encoding import VisionImage, estimate_image_tokens, payload_report, vision_encoding
+from app.services.vision_tiles import (
+    ImageRef,
+    TileBatch,
+    TileKey,
+    dedupe_issues,
+    image_label,
+    plan_tiles,
+    remap_issue,
+    tile_source,
+)
 
 # Load .env at module level for background tasks
 ENV_FILE = Path(__file__).parent.parent.parent / ".env"
 load_dotenv(ENV_FILE, override=True)
 
+class StreamedItem(NamedTuple):
+    """Một phần tử của mảng `key` vừa stream xong trong lần gọi `call_id`."""
+
+    call_id: str
+    key: str
+    # Vị trí trong mảng; governor retry cả request nên lần thử mới phát lại từ 0 và
+    # người nhận phải ghi đè theo (call_id, key, index) thay vì nối thêm
+    index: int
+    item: Dict
+
+
+# Callback nhận từng issue ngay khi nó được stream xong
+ItemCallback = Callable[[StreamedItem], Awaitable[None]]
+
 
 class AIAgentService:
-    def __init__(self):
-        pass
+    def __init__(self, memo: Optional[MemoStore] = None):
+        self.memo = memo if memo is not None else get_memo_store()
+        # Token đã dùng theo agent (từ `usage` của OpenRouter), lưu cùng kết quả job
+        self.usage: Dict[str, Dict[str, int]] = {}
+        # Kích thước, token ước lượng và độ phủ tile của phần ảnh đã gửi trong bước vision
+        self.vision_payload: Optional[Dict] = None
+        self._call_ids = itertools.count()
 
     def _get_headers(self):
         """Get fresh headers with current API key"""
@@ -34,36 +83,157 @@ class AIAgentService:
             }
         }
 
-    async def _post_chat(self, payload: Dict, timeout_seconds: int):
+    async def _post_chat(
+        self,
+        agent: str,
+        payload: Dict,
+        timeout_seconds: int,
+        on_item: Optional[ItemCallback] = None,
+        stream_keys: Sequence[str] = (),
+    ):
+        model = payload.get("model", "")
+        with span(f"llm.{agent}", model=model):
+            # temperature 0 => cùng payload cho cùng kết quả, có thể dùng lại response
+            key = None
+            if self.memo is not None and payload.get("temperature") == 0:
+                key = memo_key(payload)
+                cached = await self.memo.get(key)
+                if cached is not None:
+                    # Memo hit không tốn token nên không ghi usage
+                    self.usage.setdefault(agent, {})
+                    return cached
+
+            if on_item is not None and get_fresh_settings().LLM_STREAMING:
+                call_id = f"{agent}:{next(self._call_ids)}"
+                request = lambda: self._stream_chat(payload, timeout_seconds, on_item, stream_keys, call_id)
+            else:
+                request = lambda: self._request_chat(payload, timeout_seconds)
+            result = await get_llm_governor().call(model, request)
+            if isinstance(result, dict):
+                # Agent có thể gọi nhiều lần (batch tile vision) nên cộng dồn
+                totals = self.usage.setdefault(agent, {})
+                for field, value in record_usage(agent, result.get("usage")).items():
+                    totals[field] = totals.get(field, 0) + value
+            if key is not None and isinstance(result, dict) and "choices" in result:
+                await self.memo.set(key, result)
+            return result
+
+    async def _request_chat(self, payload: Dict, timeout_seconds: int):
         config = self._get_headers()
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
+        session = get_http_session()
+        async with session.post(
             f"{config['base_url']}/chat/completions",
             headers=config["headers"],
             json=payload,
             timeout=aiohttp.ClientTimeout(total=timeout_seconds),
-            ) as response:
-                response.raise_for_status()
+        ) as response:
+            response.raise_for_status()
+            try:
+                return await response.json()
+            except Exception:
+                # If JSON parsing fails, return the raw text response
+                text = await response.text()
+                return text
+
+    async def _stream_chat(
+        self,
+        payload: Dict,
+        timeout_seconds: int,
+        on_item: ItemCallback,
+        stream_keys: Sequence[str],
+        call_id: str,
+    ) -> Dict:
+        """
+        Gọi API với `stream: true` (SSE) và báo từng phần tử của `stream_keys` ngay khi
+        nó hoàn chỉnh. Trả về response cùng dạng với chế độ không stream.
+        """
+        config = self._get_headers()
+        session = get_http_session()
+        extractor = StreamingArrayExtractor(stream_keys)
+        counts = dict.fromkeys(stream_keys, 0)
+        usage = None
+
+        async with session.post(
+            f"{config['base_url']}/chat/completions",
+            headers=config["headers"],
+            # include_usage: chunk cuối mang `usage` như response không stream
+            json={**payload, "stream": True, "stream_options": {"include_usage": True}},
+            timeout=aiohttp.ClientTimeout(total=timeout_seconds),
+        ) as response:
+            response.raise_for_status()
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8", errors="replace").strip()
+                # Bỏ qua dòng trống và comment SSE (vd. ": OPENROUTER PROCESSING")
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
                 try:
-                    return await response.json()
-                except Exception:
-                    # If JSON parsing fails, return the raw text response
-                    text = await response.text()
-                    return text
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                if chunk.get("error"):
+                    raise ValueError(f"OpenRouter stream error: {chunk['error']}")
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices", []):
+                    text = (choice.get("delta") or {}).get("content")
+                    if not text:
+                        continue
+                    for key, item in extractor.feed(text):
+                        await on_item(StreamedItem(call_id, key, counts[key], item))
+                        counts[key] += 1
+
+        return {
+            "choices": [{"message": {"role": "assistant", "content": extractor.text}}],
+            "usage": usage,
+        }
 
-    async def run_code_analyst(self, lighthouse_data: Dict, html: str) -> Dict:
-        prompt = f"""You are a senior web performance and code quality analyst.
+    async def run_code_analyst(
+        self, lighthouse_data: Dict, html: str, on_issue: Optional[ItemCallback] = None
+    ) -> Dict:
+        settings = get_fresh_settings()
+        # Chỉ đưa audit chưa đạt/metric và tóm tắt DOM, cắt thêm nếu vượt ngân sách của model
+        data = {"performance": distill_lighthouse(lighthouse_data), "page": summarize_html(html)}
+        budget = token_budget(settings.CODE_ANALYST_MODEL) - estimate_tokens(self._code_prompt({}, {}))
+        data, _ = fit_to_budget(data, budget)
+        prompt = self._code_prompt(data.get("performance", {}), data.get("page", {}))
+
+        payload = {
+            "model": settings.CODE_ANALYST_MODEL,
+            "messages": [
+                {"role": "system", "content": "Return ONLY valid JSON. No prose, no markdown."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.0,
+            "max_tokens": 20000,
+        }
+
+        result = await self._post_chat(
+            "code_analyst", payload, timeout_seconds=120, on_item=on_issue, stream_keys=("issues",)
+        )
+        if not isinstance(result, dict):
+            raise ValueError(f"OpenRouter API returned non-JSON response: {result}")
+        if "choices" not in result:
+            raise ValueError(f"OpenRouter API returned unexpected JSON structure: {result}")
+        content = result["choices"][0]["message"]["content"]
+        return parse_model_output(content, CodeAnalysis)
+
+    @staticmethod
+    def _code_prompt(performance: Dict, page: Dict) -> str:
+        return f"""You are a senior web performance and code quality analyst.
 
 Analyze this website's technical data and provide a structured report.
 
-**Lighthouse Data:**
+**Performance Audit (key metrics and failing audits only; times in ms, sizes in bytes):**
 ```json
-{json.dumps(lighthouse_data, indent=2)}
+{compact_json(performance)}
 ```
 
-**HTML Structure (first 5000 chars):**
-```html
-{html[:5000]}
+**Page Structure Summary (landmarks, headings, forms, images, script/style weight):**
+```json
+{compact_json(page)}
 ```
 
 Provide your analysis in this EXACT JSON format:
@@ -90,81 +260,198 @@ Provide your analysis in this EXACT JSON format:
 
 Return ONLY valid JSON, no markdown formatting."""
 
+    async def run_vision_analyst(
+        self, screenshots: Dict[str, List[VisionImage]], on_issue: Optional[ItemCallback] = None
+    ) -> Dict:
+        """
+        Lần gọi chính nhận màn hình đầu của mọi thiết bị (điểm + đánh giá chung); các tile
+        còn lại (ảnh full-page) được gửi theo batch song song có giới hạn, trong ngân sách
+        token/thời gian của job. Batch vượt ngân sách hoặc lỗi thì bỏ, không làm hỏng job.
+        """
         settings = get_fresh_settings()
+        model = settings.VISION_ANALYST_MODEL
+        policy = vision_encoding(model)
+        overview, batches = plan_tiles(screenshots, model, settings.VISION_TILE_BATCH_SIZE)
+        started = time.monotonic()
+
+        # Chọn batch theo thứ tự ưu tiên (phần trên trang trước) tới khi hết ngân sách token
+        spent = sum(estimate_image_tokens(model, ref.image.width, ref.image.height) for ref in overview)
+        selected: List[TileBatch] = []
+        for batch in batches:
+            if settings.VISION_TOKEN_BUDGET and spent + batch.estimated_tokens > settings.VISION_TOKEN_BUDGET:
+                break
+            selected.append(batch)
+            spent += batch.estimated_tokens
+
+        sent: Dict[str, List[VisionImage]] = {}
+        for ref in overview + [ref for batch in selected for ref in batch.images]:
+            sent.setdefault(ref.device, []).append(ref.image)
+        self.vision_payload = payload_report(model, sent)
+        record_vision_payload(self.vision_payload)
+
+        semaphore = asyncio.Semaphore(max(1, settings.VISION_TILE_CONCURRENCY))
+        deadline = started + settings.VISION_TIME_BUDGET_SECONDS
+
+        async def run_batch(batch: TileBatch) -> List[Tuple[Optional[TileKey], Dict]]:
+            async with semaphore:
+                if time.monotonic() >= deadline:
+                    raise asyncio.TimeoutError()
+                _, tagged = await self._vision_request(
+                    "vision_tiles", model, batch.images, self._tile_prompt(policy.grayscale), TileAnalysis, on_issue
+                )
+                return tagged
+
+        tile_tasks = [asyncio.create_task(run_batch(batch)) for batch in selected]
+        try:
+            analysis, tagged = await self._vision_request(
+                "vision_analyst", model, overview, self._vision_prompt(list(screenshots), policy.grayscale),
+                VisionAnalysis, on_issue,
+            )
+            done, pending = set(), set(tile_tasks)
+            if tile_tasks:
+                done, pending = await asyncio.wait(tile_tasks, timeout=max(0.0, deadline - time.monotonic()))
+        finally:
+            for task in tile_tasks:
+                task.cancel()
+            await asyncio.gather(*tile_tasks, return_exceptions=True)
+
+        coverage = {
+            "tiles_total": len(overview) + sum(len(batch.images) for batch in batches),
+            "tiles_analyzed": len(overview),
+            "tile_batches": len(selected),
+            "skipped_for_budget": sum(len(batch.images) for batch in batches[len(selected):]),
+            "failed_batches": 0,
+            "timed_out_batches": len(pending),
+        }
+        for batch, task in zip(selected, tile_tasks):
+            if task not in done:
+                continue
+            error = task.exception()
+            if isinstance(error, asyncio.TimeoutError):
+                coverage["timed_out_batches"] += 1
+            elif error is not None:
+                coverage["failed_batches"] += 1
+                logging.getLogger(__name__).warning(f"Vision tile batch failed: {error!r}")
+            else:
+                tagged.extend(task.result())
+                coverage["tiles_analyzed"] += len(batch.images)
+        # Chỉ có trùng lặp khi tile chồng nhau được phân tích; không có tile thì giữ nguyên output
+        if coverage["tiles_analyzed"] > len(overview):
+            analysis["ui_issues"] = dedupe_issues(tagged)
+        self.vision_payload["coverage"] = coverage
+        return analysis
+
+    async def _vision_request(
+        self,
+        agent: str,
+        model: str,
+        refs: List[ImageRef],
+        instructions: str,
+        schema,
+        on_issue: Optional[ItemCallback],
+    ) -> Tuple[Dict, List[Tuple[Optional[TileKey], Dict]]]:
+        """Trả về (kết quả đã đổi toạ độ, các issue kèm tile nguồn để gộp trùng)."""
+        content = [{"type": "text", "text": instructions}]
+        for number, ref in enumerate(refs, 1):
+            content.append({"type": "text", "text": image_label(number, ref)})
+            content.append({"type": "image_url", "image_url": {"url": ref.image.data_url()}})
+
         payload = {
-            "model": settings.CODE_ANALYST_MODEL,
+            "model": model,
             "messages": [
                 {"role": "system", "content": "Return ONLY valid JSON. No prose, no markdown."},
-                {"role": "user", "content": prompt}
+                {"role": "user", "content": content}
             ],
             "temperature": 0.0,
-            "max_tokens": 20000,
+            "max_tokens": 5000,
         }
 
-        result = await self._post_chat(payload, timeout_seconds=120)
+        # Issue stream ra ngoài đã mang toạ độ trang, giống kết quả cuối
+        async def remap_and_forward(streamed: StreamedItem) -> None:
+            await on_issue(streamed._replace(item=remap_issue(streamed.item, refs)))
+
+        result = await self._post_chat(
+            agent,
+            payload,
+            timeout_seconds=180,
+            on_item=remap_and_forward if on_issue is not None else None,
+            stream_keys=("ui_issues",),
+        )
         if not isinstance(result, dict):
             raise ValueError(f"OpenRouter API returned non-JSON response: {result}")
         if "choices" not in result:
             raise ValueError(f"OpenRouter API returned unexpected JSON structure: {result}")
-        content = result["choices"][0]["message"]["content"]
-        return self._parse_json_content(content)
-
-    async def run_vision_analyst(self, screenshot_paths: Dict[str, str]) -> Dict:
-        images_data: Dict[str, str] = {}
-        for device, path in screenshot_paths.items():
-            with open(path, "rb") as f:
-                images_data[device] = base64.b64encode(f.read()).decode("utf-8")
-
-        content = [
-            {
-                "type": "text",
-                "text": (
-                    "You are a UI/UX design expert. Analyze these screenshots (desktop, tablet, mobile) and provide detailed feedback.\n\n"
-                    "Evaluate:\n1. Visual hierarchy & layout\n2. Typography & readability\n3. Color scheme & contrast\n4. Responsive design quality\n5. UI elements (buttons, forms, navigation)\n6. Accessibility issues\n\n"
-                    "For EACH issue found, provide bounding box coordinates: {\"x\": <px>, \"y\": <px>, \"width\": <px>, \"height\": <px>}\n\n"
-                    "Return ONLY this JSON structure:\n{\n  \"overall_design_score\": <0-100>,\n  \"responsive_quality\": \"excellent|good|fair|poor\",\n  \"ui_issues\": [\n    {\n      \"device\": \"desktop|tablet|mobile\",\n      \"category\": \"layout|typography|color|accessibility|spacing|imagery\",\n      \"severity\": \"critical|high|medium|low\",\n      \"title\": \"Issue title\",\n      \"description\": \"Detailed description\",\n      \"location\": {\"x\": 0, \"y\": 0, \"width\": 100, \"height\": 50},\n      \"recommendation\": \"How to fix\"\n    }\n  ],\n  \"positive_aspects\": [\"list\", \"of\", \"good\", \"things\"]\n}"
-                ),
-            }
-        ]
-
-        for device in ["desktop", "tablet", "mobile"]:
-            content.append(
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{images_data[device]}"},
-                }
-            )
+        content_text = result["choices"][0]["message"]["content"]
+        analysis = parse_model_output(content_text, schema)
+        tagged = [(tile_source(issue, refs), remap_issue(issue, refs)) for issue in analysis["ui_issues"]]
+        analysis["ui_issues"] = [issue for _, issue in tagged]
+        return analysis, tagged
+
+    @staticmethod
+    def _vision_prompt(devices: List[str], grayscale: bool) -> str:
+        grayscale_note = (
+            "The screenshots are grayscale: judge layout, hierarchy and spacing, not colors.\n\n" if grayscale else ""
+        )
+        return (
+            f"You are a UI/UX design expert. Analyze these screenshots ({', '.join(devices)}) and provide detailed feedback.\n\n"
+            f"{grayscale_note}"
+            "Evaluate:\n1. Visual hierarchy & layout\n2. Typography & readability\n3. Color scheme & contrast\n4. Responsive design quality\n5. UI elements (buttons, forms, navigation)\n6. Accessibility issues\n\n"
+            "Images are numbered. For EACH issue found, give the number of the image it appears in and bounding box coordinates in pixels of that image: {\"x\": <px>, \"y\": <px>, \"width\": <px>, \"height\": <px>}\n\n"
+            "Return ONLY this JSON structure:\n{\n  \"overall_design_score\": <0-100>,\n  \"responsive_quality\": \"excellent|good|fair|poor\",\n  \"ui_issues\": [\n    {\n      \"device\": \"desktop|tablet|mobile\",\n      \"category\": \"layout|typography|color|accessibility|spacing|imagery\",\n      \"severity\": \"critical|high|medium|low\",\n      \"title\": \"Issue title\",\n      \"description\": \"Detailed description\",\n      \"image\": 1,\n      \"location\": {\"x\": 0, \"y\": 0, \"width\": 100, \"height\": 50},\n      \"recommendation\": \"How to fix\"\n    }\n  ],\n  \"positive_aspects\": [\"list\", \"of\", \"good\", \"things\"]\n}"
+        )
 
+    @staticmethod
+    def _tile_prompt(grayscale: bool) -> str:
+        grayscale_note = (
+            "The screenshots are grayscale: judge layout, hierarchy and spacing, not colors.\n\n" if grayscale else ""
+        )
+        return (
+            "You are a UI/UX design expert. These numbered images are consecutive, slightly overlapping slices "
+            "of a web page below the first screen (the first screen was reviewed separately).\n\n"
+            f"{grayscale_note}"
+            "Report only UI/UX issues visible in these slices: layout, typography, color & contrast, spacing, "
+            "imagery, UI elements and accessibility. For EACH issue, give the number of the image it appears in "
+            "and bounding box coordinates in pixels of that image.\n\n"
+            "Return ONLY this JSON structure:\n{\n  \"ui_issues\": [\n    {\n      \"device\": \"desktop|tablet|mobile\",\n      \"category\": \"layout|typography|color|accessibility|spacing|imagery\",\n      \"severity\": \"critical|high|medium|low\",\n      \"title\": \"Issue title\",\n      \"description\": \"Detailed description\",\n      \"image\": 1,\n      \"location\": {\"x\": 0, \"y\": 0, \"width\": 100, \"height\": 50},\n      \"recommendation\": \"How to fix\"\n    }\n  ]\n}"
+        )
+
+    async def run_report_synthesizer(self, code_analysis: Dict, vision_analysis: Dict, metadata: Dict) -> Dict:
         settings = get_fresh_settings()
+        analyses = distill_analyses(code_analysis, vision_analysis)
+        budget = token_budget(settings.SYNTHESIZER_MODEL) - estimate_tokens(self._synthesis_prompt({}, {}))
+        analyses, _ = fit_to_budget(analyses, budget)
+        prompt = self._synthesis_prompt(analyses.get("code", {}), analyses.get("vision", {}))
+
         payload = {
-            "model": settings.VISION_ANALYST_MODEL,
+            "model": settings.SYNTHESIZER_MODEL,
             "messages": [
                 {"role": "system", "content": "Return ONLY valid JSON. No prose, no markdown."},
-                {"role": "user", "content": content}
+                {"role": "user", "content": prompt}
             ],
             "temperature": 0.0,
-            "max_tokens": 5000,
+            "max_tokens": 2000,
         }
 
-        result = await self._post_chat(payload, timeout_seconds=180)
+        result = await self._post_chat("synthesizer", payload, timeout_seconds=120)
         if not isinstance(result, dict):
             raise ValueError(f"OpenRouter API returned non-JSON response: {result}")
         if "choices" not in result:
             raise ValueError(f"OpenRouter API returned unexpected JSON structure: {result}")
-        content_text = result["choices"][0]["message"]["content"]
-        return self._parse_json_content(content_text)
+        content = result["choices"][0]["message"]["content"]
+        return parse_model_output(content, Synthesis)
 
-    async def run_report_synthesizer(self, code_analysis: Dict, vision_analysis: Dict, metadata: Dict) -> Dict:
-        prompt = f"""You are a technical report writer. Synthesize these analyses into an executive summary.
+    @staticmethod
+    def _synthesis_prompt(code_analysis: Dict, vision_analysis: Dict) -> str:
+        return f"""You are a technical report writer. Synthesize these analyses into an executive summary.
 
-**Code Analysis:**
+**Code Analysis (issues ordered by severity):**
 ```json
-{json.dumps(code_analysis, indent=2)}
+{compact_json(code_analysis)}
 ```
 
-**Vision Analysis:**
+**Vision Analysis (issues ordered by severity):**
 ```json
-{json.dumps(vision_analysis, indent=2)}
+{compact_json(vision_analysis)}
 ```
 
 Create a concise executive summary (200-300 words) that:
@@ -181,69 +468,3 @@ Return JSON:
   ],
   "overall_score": <0-100>
 }}"""
-
-        settings = get_fresh_settings()
-        payload = {
-            "model": settings.SYNTHESIZER_MODEL,
-            "messages": [
-                {"role": "system", "content": "Return ONLY valid JSON. No prose, no markdown."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.0,
-            "max_tokens": 2000,
-        }
-
-        result = await self._post_chat(payload, timeout_seconds=120)
-        if not isinstance(result, dict):
-            raise ValueError(f"OpenRouter API returned non-JSON response: {result}")
-        if "choices" not in result:
-            raise ValueError(f"OpenRouter API returned unexpected JSON structure: {result}")
-        content = result["choices"][0]["message"]["content"]
-        return self._parse_json_content(content)
-
-    @staticmethod
-    def _parse_json_content(content: str) -> Dict:
-        import re
-
-        def try_load(s: str):
-            s = s.strip()
-            return json.loads(s)
-
-        # 1) Direct JSON
-        try:
-            return try_load(content)
-        except Exception:
-            pass
-
-        # 2) Any fenced block: ```json ...``` or ``` ...```
-        fence_blocks = re.findall(r"```(?:json|JSON)?\n([\s\S]*?)\n```", content)
-        for block in fence_blocks:
-            try:
-                return try_load(block)
-            except Exception:
-                continue
-
-        # 3) First top-level JSON object via brace balancing
-        start = content.find("{")
-        end = content.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            depth = 0
-            last = None
-            for i, ch in enumerate(content[start:end+1], start):
-                if ch == "{":
-                    depth += 1
-                elif ch == "}":
-                    depth -= 1
-                    if depth == 0:
-                        last = i + 1
-                        break
-            if last:
-                candidate = content[start:last]
-                try:
-                    return try_load(candidate)
-                except Exception:
-                    pass
-
-        raise ValueError("Cannot parse AI response as JSON")
-
-
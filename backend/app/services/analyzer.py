@@ -1,40 +1,202 @@
 import asyncio
+import logging
 import os
+import uuid
 from datetime import datetime
 from pathlib import Path
-from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+from sqlalchemy import select, update
 from dotenv import load_dotenv
 
-from app.database import SessionLocal
-from app.models.job import Job, JobStatus
+from app.database import AsyncSessionLocal
+from app.models.job import Job, JobStatus, completed_job_values
 from app.services.data_collector import DataCollector
-from app.services.ai_agents import AIAgentService
+from app.services.ai_agents import AIAgentService, StreamedItem
+from app.services.progress import notify_progress_async
+from app.services.result_cache import (
+    content_key,
+    find_completed_result,
+    get_result_cache,
+    html_digest,
+    latest_html_digest,
+    normalize_url,
+)
+from app.services.telemetry import JOB_SECONDS, QUEUE_WAIT_SECONDS, span
+from app.services.timing import StageTimer
 
 # Load .env file explicitly for background tasks
 ENV_FILE = Path(__file__).parent.parent.parent / ".env"
 load_dotenv(ENV_FILE, override=True)
 
+logger = logging.getLogger(__name__)
+
+
+class JobLostError(Exception):
+    """Job không còn thuộc worker này (bị reclaim sau khi lỡ heartbeat)."""
+
+
+async def _update_job(
+    job_id: uuid.UUID,
+    worker_id: str,
+    stage: Optional[str] = None,
+    status: Optional[JobStatus] = None,
+    **values,
+) -> None:
+    """
+    Ghi job trong một session ngắn, chỉ giữ connection trong lúc ghi.
+
+    Chỉ ghi khi job vẫn do `worker_id` giữ: job đã bị reclaim (và có thể worker khác
+    đang chạy) thì raise JobLostError để dừng job, không đè kết quả của worker kia.
+    Khi có `stage` thì phát sự kiện tiến độ trong cùng transaction.
+    """
+    if status is not None:
+        values["status"] = status
+    if stage is not None:
+        values["stage"] = stage
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Job).where(Job.id == job_id, Job.claimed_by == worker_id).values(**values)
+        )
+        if result.rowcount == 0:
+            await db.rollback()
+            raise JobLostError(f"Job {job_id} is no longer claimed by worker {worker_id}")
+        if stage is not None:
+            await notify_progress_async(db, str(job_id), (status or JobStatus.PROCESSING).value, stage)
+        await db.commit()
+
+
+async def run_analysis_task(job_id: str, target_url: str, worker_id: str, batch_id: Optional[str] = None) -> None:
+    # Span gốc của job: stage trong collector/analyzer và các lần gọi LLM là span con
+    with span("analysis.job", job_id=str(job_id), url=target_url, batch_id=batch_id):
+        try:
+            await _run_analysis(job_id, target_url, worker_id, batch_id)
+        except JobLostError:
+            logger.warning("Job %s was reclaimed from worker %s, abandoning this run", job_id, worker_id)
+
+
+async def _run_analysis(job_id: str, target_url: str, worker_id: str, batch_id: Optional[str]) -> None:
+    # Không giữ session suốt job: job chạy nhiều phút chủ yếu là chờ browser/LLM
+    job_uuid = uuid.UUID(str(job_id))
+    async with AsyncSessionLocal() as db:
+        job = (
+            await db.execute(select(Job.force_refresh, Job.created_at, Job.attempts).where(Job.id == job_uuid))
+        ).one_or_none()
+    if job is None:
+        return
+    force_refresh = job.force_refresh
+
+    timer = StageTimer()
+    queue_wait = max(0.0, (datetime.utcnow() - job.created_at).total_seconds())
+    # Lần chạy lại sau khi worker chết không phải thời gian chờ hàng đợi thực sự
+    if (job.attempts or 0) <= 1:
+        QUEUE_WAIT_SECONDS.observe(queue_wait)
+
+    def timings() -> dict:
+        return {**timer.as_dict(), "queue_wait": round(queue_wait, 3)}
 
-async def run_analysis_task(job_id: str, target_url: str) -> None:
-    db: Session = SessionLocal()
     try:
-        job = db.query(Job).filter(Job.id == job_id).first()
-        if not job:
-            return
+        await _update_job(job_uuid, worker_id, "collecting", JobStatus.PROCESSING)
+
+        collector = DataCollector(job_id, batch_id)
+        pipeline = collector.start(target_url, timer)
+        pending: List[asyncio.Task] = []
+        try:
+            page_data = await pipeline.page_data
+
+            # Lưu các issue đã stream xong vào job để frontend hiển thị trước khi có kết quả cuối.
+            # Theo từng lần gọi LLM: request bị retry phát lại từ đầu thì ghi đè, không nhân đôi
+            partial_streams: Dict[str, List[dict]] = {}
+            # Code và vision stream song song: ghi tuần tự để bản cũ không đè bản mới
+            partial_lock = asyncio.Lock()
+
+            async def save_partial_issue(streamed: StreamedItem) -> None:
+                items = partial_streams.setdefault(f"{streamed.call_id}/{streamed.key}", [])
+                del items[streamed.index:]
+                items.append(streamed.item)
+                partial_issues = {"code": [], "ui": []}
+                for stream, stream_items in partial_streams.items():
+                    partial_issues["code" if stream.endswith("/issues") else "ui"].extend(stream_items)
+                async with partial_lock:
+                    await _update_job(job_uuid, worker_id, result={"partial": True, "issues": partial_issues})
+
+            ai_service = AIAgentService()
 
-        job.status = JobStatus.PROCESSING
-        db.commit()
+            async def code_stage():
+                await _update_job(job_uuid, worker_id, "code_analysis")
+                with timer.stage("code_analysis"):
+                    return await ai_service.run_code_analyst(
+                        page_data["lighthouse"], page_data["html"], on_issue=save_partial_issue
+                    )
 
-        collector = DataCollector(job_id)
-        raw_data = await collector.collect_all_data(target_url)
+            async def vision_stage(screenshots):
+                await _update_job(job_uuid, worker_id, "vision_analysis")
+                with timer.stage("vision_analysis"):
+                    return await ai_service.run_vision_analyst(
+                        {device: shot.vision for device, shot in screenshots.items()}, on_issue=save_partial_issue
+                    )
 
-        ai_service = AIAgentService()
-        code_task = ai_service.run_code_analyst(raw_data["lighthouse"], raw_data["html"])
-        vision_task = ai_service.run_vision_analyst(raw_data["screenshots"])
-        code_analysis, vision_analysis = await asyncio.gather(code_task, vision_task)
+            # Code analyst chạy ngay khi có HTML + metrics, song song với việc chụp màn hình.
+            # Nếu HTML giống lần trước (nhiều khả năng cache hit) thì chờ screenshot để khỏi gọi LLM thừa.
+            cache = get_result_cache()
+            normalized_url = normalize_url(target_url)
+            page_digest = html_digest(page_data["html"])
+            code_task = None
+            may_hit = not force_refresh and (
+                cache.may_hit(normalized_url, page_digest)
+                or await latest_html_digest(target_url, cache.ttl_seconds) == page_digest
+            )
+            if not may_hit:
+                code_task = asyncio.create_task(code_stage())
+                pending.append(code_task)
+
+            screenshots = await pipeline.screenshots
+
+            # Trang không đổi (cùng HTML + screenshot) thì dùng lại kết quả cũ, bỏ qua LLM
+            screenshot_refs = {device: shot.variants for device, shot in screenshots.items()}
+            cache_key = content_key(normalized_url, page_data["html"], [shot.digest for shot in screenshots.values()])
+            cached = None
+            if not force_refresh:
+                # Cache trong process trước, sau đó tới job cùng nội dung do worker khác chạy
+                cached = cache.get(cache_key)
+                if cached is None:
+                    cached = await find_completed_result(cache_key, cache.ttl_seconds)
+                    if cached is not None:
+                        cache.put(cache_key, normalized_url, cached, html_digest=page_digest)
+            cache_columns = {"content_key": cache_key, "html_digest": page_digest}
+            if cached is not None:
+                cached.update(
+                    {
+                        "job_id": job_id,
+                        "cached_from": cached["job_id"],
+                        "screenshots": screenshot_refs,
+                        "timings": timings(),
+                        "usage": ai_service.usage,
+                        "vision_payload": ai_service.vision_payload,
+                    }
+                )
+                await _update_job(
+                    job_uuid, worker_id, "done", JobStatus.COMPLETED, completed_at=datetime.utcnow(),
+                    **cache_columns, **completed_job_values(cached),
+                )
+                JOB_SECONDS.labels("cached").observe(timer.elapsed())
+                return
+
+            if code_task is None:
+                code_task = asyncio.create_task(code_stage())
+                pending.append(code_task)
+            vision_task = asyncio.create_task(vision_stage(screenshots))
+            pending.append(vision_task)
+            code_analysis, vision_analysis = await asyncio.gather(code_task, vision_task)
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+            await pipeline.close()
 
         metadata = {"url": target_url, "analyzed_at": datetime.utcnow().isoformat()}
-        synthesis = await ai_service.run_report_synthesizer(code_analysis, vision_analysis, metadata)
+        await _update_job(job_uuid, worker_id, "synthesis")
+        with timer.stage("synthesis"):
+            synthesis = await ai_service.run_report_synthesizer(code_analysis, vision_analysis, metadata)
 
         final_result = {
             "job_id": job_id,
@@ -53,27 +215,23 @@ async def run_analysis_task(job_id: str, target_url: str) -> None:
             },
             "issues": {"code": code_analysis.get("issues", []), "ui": vision_analysis.get("ui_issues", [])},
             "priority_actions": synthesis.get("priority_actions", []),
-            "screenshots": {
-                "desktop": raw_data["screenshots"].get("desktop"),
-                "tablet": raw_data["screenshots"].get("tablet"),
-                "mobile": raw_data["screenshots"].get("mobile"),
-            },
+            "screenshots": screenshot_refs,
+            "timings": timings(),
+            "usage": ai_service.usage,
+            "vision_payload": ai_service.vision_payload,
         }
 
-        job.result = final_result
-        job.status = JobStatus.COMPLETED
-        job.completed_at = datetime.utcnow()
-        db.commit()
+        cache.put(cache_key, normalized_url, final_result, html_digest=page_digest)
+
+        await _update_job(
+            job_uuid, worker_id, "done", JobStatus.COMPLETED, completed_at=datetime.utcnow(),
+            **cache_columns, **completed_job_values(final_result),
+        )
+        JOB_SECONDS.labels("completed").observe(timer.elapsed())
+    except JobLostError:
+        raise
     except Exception as e:
-        job = db.query(Job).filter(Job.id == job_id).first()
-        if job:
-            job.status = JobStatus.FAILED
-            job.error_message = str(e)
-            job.completed_at = datetime.utcnow()
-            db.commit()
-    finally:
-        db.close()
-
-
-def run_analysis_task_bg(job_id: str, target_url: str) -> None:
-    asyncio.run(run_analysis_task(job_id, target_url))
\ No newline at end of file
+        JOB_SECONDS.labels("failed").observe(timer.elapsed())
+        await _update_job(
+            job_uuid, worker_id, "failed", JobStatus.FAILED, error_message=str(e), completed_at=datetime.utcnow()
+        )
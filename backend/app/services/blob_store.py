@@ -0,0 +1,237 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Set, Tuple
+
+from app.utils.config import get_fresh_settings
+
+
+class BlobNotFoundError(KeyError):
+    """Không có blob với digest này trong store."""
+
+
+def blob_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_blob_ref(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+class BlobStore(ABC):
+    """
+    Lưu blob bất biến theo SHA-256 của nội dung.
+
+    Cùng nội dung luôn có cùng digest nên ảnh trùng nhau chỉ được lưu một lần và
+    digest dùng trực tiếp làm strong ETag.
+    """
+
+    def put(self, data: bytes, content_type: str = "application/octet-stream") -> str:
+        digest = blob_digest(data)
+        # Blob đã có thì cập nhật thời điểm ghi: job đang chạy dùng lại blob cũ chưa lưu
+        # reference vào DB, GC chỉ bỏ qua nó nhờ grace period tính từ thời điểm này
+        if not self._touch(digest, content_type):
+            self._write(digest, data, content_type)
+        return digest
+
+    @abstractmethod
+    def get(self, digest: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, digest: str) -> None:
+        ...
+
+    @abstractmethod
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        """Liệt kê (digest, thời điểm ghi dạng epoch seconds)."""
+
+    @abstractmethod
+    def _write(self, digest: str, data: bytes, content_type: str) -> None:
+        ...
+
+    @abstractmethod
+    def _touch(self, digest: str, content_type: str) -> bool:
+        """Đặt lại thời điểm ghi của blob về hiện tại; False nếu blob không tồn tại."""
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str) -> Path:
+        # Chia thư mục theo 2 ký tự đầu để không dồn hàng triệu file vào một thư mục
+        return self.root / digest[:2] / digest
+
+    def get(self, digest: str) -> bytes:
+        try:
+            return self.path(digest).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFoundError(digest)
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def delete(self, digest: str) -> None:
+        try:
+            self.path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        for shard in self.root.iterdir():
+            if not shard.is_dir():
+                continue
+            for blob in shard.iterdir():
+                if is_blob_ref(blob.name):
+                    yield blob.name, blob.stat().st_mtime
+
+    def _touch(self, digest: str, content_type: str) -> bool:
+        try:
+            os.utime(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _write(self, digest: str, data: bytes, content_type: str) -> None:
+        target = self.path(digest)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Ghi file tạm rồi rename để reader không bao giờ thấy blob ghi dở
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+class S3BlobStore(BlobStore):
+    """
+    Backend S3-compatible (AWS S3, MinIO, ...). `client` là boto3 S3 client hoặc
+    object có cùng các method, tiện khi chạy với một stand-in local.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "blobs/", client=None, endpoint_url: Optional[str] = None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("S3 blob store requires boto3 (pip install boto3)")
+            client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}{digest[:2]}/{digest}"
+
+    def _is_missing(self, error: Exception) -> bool:
+        response = getattr(error, "response", None) or {}
+        code = str(response.get("Error", {}).get("Code", ""))
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def get(self, digest: str) -> bytes:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(digest))
+        except Exception as e:
+            if self._is_missing(e):
+                raise BlobNotFoundError(digest)
+            raise
+        return response["Body"].read()
+
+    def exists(self, digest: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(digest))
+            return True
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def delete(self, digest: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(digest))
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        token = None
+        while True:
+            kwargs = {"Bucket": self.bucket, "Prefix": self.prefix}
+            if token:
+                kwargs["ContinuationToken"] = token
+            response = self.client.list_objects_v2(**kwargs)
+            for item in response.get("Contents", []):
+                digest = item["Key"].rsplit("/", 1)[-1]
+                if is_blob_ref(digest):
+                    yield digest, item["LastModified"].timestamp()
+            if not response.get("IsTruncated"):
+                break
+            token = response.get("NextContinuationToken")
+
+    def _touch(self, digest: str, content_type: str) -> bool:
+        # S3 không có "touch": copy object lên chính nó (đổi metadata) để cập nhật LastModified
+        key = self._key(digest)
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=key,
+                CopySource={"Bucket": self.bucket, "Key": key},
+                MetadataDirective="REPLACE",
+                ContentType=content_type,
+            )
+            return True
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def _write(self, digest: str, data: bytes, content_type: str) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(digest), Body=data, ContentType=content_type)
+
+
+def collect_garbage(store: BlobStore, referenced: Iterable[str], grace_seconds: int = 3600) -> int:
+    """
+    Xoá blob không còn job nào tham chiếu. Blob mới ghi (trong `grace_seconds`)
+    được giữ lại vì job đang chạy có thể chưa lưu reference vào DB.
+    """
+    keep: Set[str] = set(referenced)
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for digest, written_at in list(store.iter_blobs()):
+        if digest not in keep and written_at < cutoff:
+            store.delete(digest)
+            removed += 1
+    return removed
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            settings = get_fresh_settings()
+            backend = settings.BLOB_STORE_BACKEND.lower()
+            if backend == "local":
+                _store = LocalBlobStore(settings.BLOB_STORE_PATH)
+            elif backend == "s3":
+                _store = S3BlobStore(
+                    bucket=settings.BLOB_STORE_S3_BUCKET,
+                    prefix=settings.BLOB_STORE_S3_PREFIX,
+                    endpoint_url=settings.BLOB_STORE_S3_ENDPOINT_URL,
+                )
+            else:
+                raise ValueError(f"Unknown BLOB_STORE_BACKEND: {settings.BLOB_STORE_BACKEND}")
+        return _store
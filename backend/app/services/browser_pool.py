@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple
+
+from playwright.async_api import async_playwright, Browser, BrowserContext, Playwright
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.utils.config import get_fresh_settings
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledBrowser:
+    """Một Chromium đang chạy trong pool cùng bộ đếm sử dụng."""
+
+    def __init__(self, browser: Browser):
+        self.browser = browser
+        self.uses = 0
+        self.active = 0
+        self.retired = False
+
+    @property
+    def alive(self) -> bool:
+        return not self.retired and self.browser.is_connected()
+
+
+class _SharedContext:
+    """BrowserContext dùng chung giữa nhiều job, đếm số job đang dùng."""
+
+    def __init__(self, browser: Browser, context: BrowserContext):
+        self.browser = browser
+        self.context = context
+        self.refs = 0
+        self.idle_handle: Optional[asyncio.TimerHandle] = None
+
+
+class BrowserPool:
+    """
+    Pool các Chromium headless dùng chung cho mọi job trong process.
+
+    Mỗi job nhận một BrowserContext riêng (cookie, storage tách biệt) trên một
+    browser đã khởi động sẵn. Browser bị thay mới sau `max_uses` lần cấp phát
+    hoặc khi bị crash/disconnect.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_concurrency: int = 4,
+        max_uses: int = 50,
+        shared_idle_seconds: float = 30.0,
+        launch_options: Optional[Dict] = None,
+    ):
+        self.size = max(1, size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_uses = max(1, max_uses)
+        self.shared_idle_seconds = shared_idle_seconds
+        self.launch_options = {"headless": True, **(launch_options or {})}
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._lock = asyncio.Lock()
+        self._playwright: Optional[Playwright] = None
+        self._browsers: List[_PooledBrowser] = []
+        self._shared: Dict[Tuple[Browser, Hashable], _SharedContext] = {}
+        self._closed = False
+
+        self._in_use = 0
+        self._launches = 0
+        self._recycles = 0
+        self._crashes = 0
+        self._shared_reuses = 0
+
+    async def _launch(self) -> _PooledBrowser:
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        browser = await self._playwright.chromium.launch(**self.launch_options)
+        entry = _PooledBrowser(browser)
+        browser.on("disconnected", lambda _: self._on_disconnected(entry))
+        self._browsers.append(entry)
+        self._launches += 1
+        return entry
+
+    def _on_disconnected(self, entry: _PooledBrowser) -> None:
+        if not entry.retired and not self._closed:
+            self._crashes += 1
+            logger.warning("Pooled browser disconnected unexpectedly, it will be replaced")
+        entry.retired = True
+        if entry.active == 0 and entry in self._browsers:
+            self._browsers.remove(entry)
+
+    async def warm_up(self) -> None:
+        """Khởi động trước đủ `size` browser."""
+        async with self._lock:
+            while len([b for b in self._browsers if b.alive]) < self.size:
+                await self._launch()
+
+    async def _acquire(self) -> _PooledBrowser:
+        async with self._lock:
+            if self._closed:
+                raise RuntimeError("Browser pool is closed")
+            live = [b for b in self._browsers if b.alive]
+            idle = [b for b in live if b.active == 0]
+            if idle:
+                entry = idle[0]
+            elif len(live) < self.size:
+                entry = await self._launch()
+            else:
+                entry = min(live, key=lambda b: b.active)
+
+            entry.uses += 1
+            entry.active += 1
+            if entry.uses >= self.max_uses:
+                entry.retired = True
+            return entry
+
+    async def _release(self, entry: _PooledBrowser) -> None:
+        entry.active -= 1
+        if entry.retired and entry.active == 0:
+            await self._discard(entry)
+
+    async def _discard(self, entry: _PooledBrowser) -> None:
+        if entry in self._browsers:
+            self._browsers.remove(entry)
+        # Context dùng chung trên browser này đóng theo browser
+        for key, shared in list(self._shared.items()):
+            if shared.browser is entry.browser:
+                self._forget_shared(key, shared)
+        if entry.browser.is_connected():
+            self._recycles += 1
+            try:
+                await entry.browser.close()
+            except Exception:
+                logger.exception("Failed to close recycled browser")
+
+    @asynccontextmanager
+    async def browser(self) -> AsyncIterator[Browser]:
+        """
+        Mượn một browser cho một job (chiếm một slot concurrency).
+
+        Caller tự tạo và đóng các BrowserContext của mình trên browser này, ví dụ
+        mỗi viewport một context.
+        """
+        async with self._semaphore:
+            entry = await self._acquire()
+            self._in_use += 1
+            try:
+                yield entry.browser
+            except Exception:
+                if not entry.browser.is_connected():
+                    entry.retired = True
+                raise
+            finally:
+                self._in_use -= 1
+                await self._release(entry)
+
+    @asynccontextmanager
+    async def shared_context(self, browser: Browser, key: Hashable, **context_options) -> AsyncIterator[BrowserContext]:
+        """
+        Context dùng chung giữa các job cùng `key` trên cùng browser đang mượn.
+
+        Job sau tái dùng HTTP cache, font và kết nối của job trước nên chỉ dùng khi
+        chia sẻ cookie/storage giữa các job là chấp nhận được (ví dụ cùng batch và
+        cùng origin). Caller tự đóng page của mình; context được giữ thêm
+        `shared_idle_seconds` sau khi job cuối trả lại rồi mới đóng.
+        """
+        full_key = (browser, key)
+        shared = self._shared.get(full_key)
+        if shared is None or not browser.is_connected():
+            context = await browser.new_context(**context_options)
+            # Job khác có thể đã tạo context cho key này trong lúc chờ
+            existing = self._shared.get(full_key)
+            if existing is not None and browser.is_connected():
+                await context.close()
+                shared = existing
+                self._shared_reuses += 1
+            else:
+                shared = _SharedContext(browser, context)
+                self._shared[full_key] = shared
+        else:
+            self._shared_reuses += 1
+
+        if shared.idle_handle is not None:
+            shared.idle_handle.cancel()
+            shared.idle_handle = None
+        shared.refs += 1
+        try:
+            yield shared.context
+        finally:
+            shared.refs -= 1
+            if shared.refs == 0:
+                if self._closed or not browser.is_connected() or self.shared_idle_seconds <= 0:
+                    await self._close_shared(full_key, shared)
+                else:
+                    loop = asyncio.get_running_loop()
+                    shared.idle_handle = loop.call_later(
+                        self.shared_idle_seconds,
+                        lambda: asyncio.ensure_future(self._close_shared(full_key, shared)),
+                    )
+
+    def _forget_shared(self, key: Tuple[Browser, Hashable], shared: _SharedContext) -> None:
+        if self._shared.get(key) is shared:
+            del self._shared[key]
+        if shared.idle_handle is not None:
+            shared.idle_handle.cancel()
+            shared.idle_handle = None
+
+    async def _close_shared(self, key: Tuple[Browser, Hashable], shared: _SharedContext) -> None:
+        if shared.refs > 0:
+            return
+        self._forget_shared(key, shared)
+        try:
+            await shared.context.close()
+        except Exception:
+            pass
+
+    def metrics(self) -> Dict[str, int]:
+        live = [b for b in self._browsers if b.alive]
+        return {
+            "browsers": len(live),
+            # Nhiều job có thể dùng chung một browser nên leases có thể lớn hơn in_use
+            "in_use": len([b for b in live if b.active > 0]),
+            "leases": self._in_use,
+            "idle": len([b for b in live if b.active == 0]),
+            "max_concurrency": self.max_concurrency,
+            "launches": self._launches,
+            "recycles": self._recycles,
+            "crashes": self._crashes,
+            "shared_contexts": len(self._shared),
+            "shared_context_reuses": self._shared_reuses,
+        }
+
+    async def close(self) -> None:
+        async with self._lock:
+            self._closed = True
+            for key, shared in list(self._shared.items()):
+                self._forget_shared(key, shared)
+            browsers, self._browsers = self._browsers, []
+            for entry in browsers:
+                entry.retired = True
+                try:
+                    await entry.browser.close()
+                except Exception:
+                    pass
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+
+# Playwright gắn với event loop đã khởi tạo nó nên mỗi loop có pool riêng
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BrowserPool]" = weakref.WeakKeyDictionary()
+
+
+def get_browser_pool() -> BrowserPool:
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        settings = get_fresh_settings()
+        pool = BrowserPool(
+            size=settings.BROWSER_POOL_SIZE,
+            max_concurrency=settings.BROWSER_POOL_MAX_CONCURRENCY,
+            max_uses=settings.BROWSER_POOL_MAX_USES,
+            shared_idle_seconds=settings.BROWSER_POOL_SHARED_IDLE_SECONDS,
+        )
+        _pools[loop] = pool
+    return pool
+
+
+class _PoolMetricsCollector:
+    """
+    Đọc metrics của các pool trong process lúc Prometheus scrape. Pool chỉ có ở process
+    chạy job: worker riêng (cổng WORKER_METRICS_PORT) hoặc API khi bật worker nhúng.
+    """
+
+    GAUGES = {
+        "browsers": "Live pooled Chromium browsers",
+        "in_use": "Live browsers lent to at least one job",
+        "leases": "Jobs currently holding a pooled browser",
+        "idle": "Live browsers with no active job",
+        "max_concurrency": "Maximum jobs using the pool at once",
+        "shared_contexts": "Open browser contexts shared within a batch",
+    }
+    COUNTERS = {
+        "launches": "Chromium launches",
+        "recycles": "Browsers closed after max uses",
+        "crashes": "Browsers that disconnected unexpectedly",
+        "shared_context_reuses": "Jobs that reused a shared browser context",
+    }
+
+    def collect(self):
+        totals: Dict[str, int] = {}
+        for pool in list(_pools.values()):
+            for name, value in pool.metrics().items():
+                totals[name] = totals.get(name, 0) + value
+        for name, documentation in self.GAUGES.items():
+            yield GaugeMetricFamily(f"browser_pool_{name}", documentation, value=totals.get(name, 0))
+        for name, documentation in self.COUNTERS.items():
+            yield CounterMetricFamily(f"browser_pool_{name}", documentation, value=totals.get(name, 0))
+
+
+REGISTRY.register(_PoolMetricsCollector())
+
+
+async def warm_up_browser_pool() -> None:
+    """Khởi động sẵn browser khi process chạy job bắt đầu để job đầu không phải chờ launch."""
+    try:
+        await get_browser_pool().warm_up()
+    except Exception:
+        # Không chặn khởi động: job sẽ tự launch browser khi cần
+        logger.warning("Browser pool warm-up failed", exc_info=True)
+
+
+async def close_browser_pool() -> None:
+    loop = asyncio.get_running_loop()
+    pool = _pools.pop(loop, None)
+    if pool is not None:
+        await pool.close()
@@ -1,130 +1,352 @@
 import asyncio
-import tempfile
 import logging
-from pathlib import Path
-from typing import Dict
-from playwright.async_api import async_playwright
-from PIL import Image
-import io
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
 
+from app.services import web_vitals
+from app.services.blob_store import get_blob_store
+from app.services.browser_pool import get_browser_pool
+from app.services.image_processing import (
+    VARIANT_MEDIA_TYPES,
+    downscale_png,
+    encode_for_vision,
+    encode_variants,
+    run_image_task,
+)
+from app.services.lighthouse_cli import run_lighthouse_cli
+from app.services.telemetry import span
+from app.services.timing import StageTimer
+from app.services.vision_encoding import VisionEncoding, VisionImage, check_tiling, vision_encoding
+from app.utils.config import get_fresh_settings
+
+
+# Mỗi thiết bị được tạo context với viewport/scale/user agent đúng ngay từ đầu
+DEVICE_PRESETS: Dict[str, Dict] = {
+    "desktop": {
+        "viewport": {"width": 1920, "height": 1080},
+        "device_scale_factor": 1,
+    },
+    "tablet": {
+        "viewport": {"width": 768, "height": 1024},
+        "device_scale_factor": 2,
+        "is_mobile": True,
+        "has_touch": True,
+        "user_agent": (
+            "Mozilla/5.0 (iPad; CPU OS 16_0 like Mac OS X) AppleWebKit/605.1.15 "
+            "(KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1"
+        ),
+    },
+    "mobile": {
+        "viewport": {"width": 375, "height": 667},
+        "device_scale_factor": 2,
+        "is_mobile": True,
+        "has_touch": True,
+        "user_agent": (
+            "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 "
+            "(KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1"
+        ),
+    },
+}
+
+# Chờ fonts.ready rồi chờ tới khi không có layout shift trong quietMs (giới hạn bởi timeoutMs)
+SETTLE_SCRIPT = """
+async ({ quietMs, timeoutMs }) => {
+    const deadline = performance.now() + timeoutMs;
+    const timeout = (ms) => new Promise((resolve) => setTimeout(resolve, Math.max(0, ms)));
+    if (document.fonts && document.fonts.ready) {
+        await Promise.race([document.fonts.ready, timeout(timeoutMs)]);
+    }
+    let lastShift = performance.now();
+    let observer = null;
+    try {
+        observer = new PerformanceObserver((list) => {
+            for (const entry of list.getEntries()) {
+                if (!entry.hadRecentInput) lastShift = performance.now();
+            }
+        });
+        observer.observe({ type: 'layout-shift', buffered: false });
+    } catch (e) {}
+    while (performance.now() - lastShift < quietMs && performance.now() < deadline) {
+        await timeout(50);
+    }
+    if (observer) observer.disconnect();
+}
+"""
+
+
+class CollectionPipeline:
+    """
+    Kết quả thu thập theo từng stage, mỗi stage là một future hoàn thành độc lập.
+
+    - `page_data`: {"lighthouse", "html", "url"} - có ngay sau khi trang load xong
+    - `screenshots`: {device: Screenshot} - có sau khi chụp xong mọi viewport
+    """
+
+    def __init__(self):
+        loop = asyncio.get_running_loop()
+        self.page_data: asyncio.Future = loop.create_future()
+        self.screenshots: asyncio.Future = loop.create_future()
+        self._task: Optional[asyncio.Task] = None
+
+    def _fail(self, exc: BaseException) -> None:
+        for future in (self.page_data, self.screenshots):
+            if not future.done():
+                future.set_exception(exc)
+            # Tránh cảnh báo "exception was never retrieved" cho stage không ai chờ
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def close(self) -> None:
+        """Chờ collector trả browser context về pool (huỷ nếu còn đang chạy)."""
+        if self._task is None:
+            return
+        if not self._task.done():
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+class Screenshot(NamedTuple):
+    """
+    Ảnh đã xử lý: digest PNG trong blob store, digest của mọi biến thể
+    ({"png": ..., "webp": ..., "thumb": ...}) và ảnh đã encode sẵn cho vision model
+    (giữ trong bộ nhớ, không đọc lại từ blob store).
+    """
+
+    digest: str
+    variants: Dict[str, str]
+    vision: List[VisionImage]
 
 
 class DataCollector:
-    def __init__(self, job_id: str):
+    def __init__(self, job_id: str, batch_id: Optional[str] = None):
         self.job_id = job_id
-        base_tmp = Path(tempfile.gettempdir()) / "uiux_analyzer" / job_id
-        base_tmp.mkdir(parents=True, exist_ok=True)
-        self.temp_dir = base_tmp
+        self.batch_id = batch_id
+        self.blob_store = get_blob_store()
+
+    def start(self, target_url: str, timer: Optional[StageTimer] = None) -> CollectionPipeline:
+        """Bắt đầu thu thập ở nền; caller chờ từng stage của pipeline trả về."""
+        pipeline = CollectionPipeline()
+        pipeline._task = asyncio.create_task(self._run_pipeline(pipeline, target_url, timer or StageTimer()))
+        return pipeline
 
     async def collect_all_data(self, target_url: str) -> Dict:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(viewport={"width": 1920, "height": 1080})
-            page = await context.new_page()
+        pipeline = self.start(target_url)
+        try:
+            page_data = await pipeline.page_data
+            screenshots = await pipeline.screenshots
+            return {**page_data, "screenshots": screenshots}
+        finally:
+            await pipeline.close()
 
-            try:
-                await page.goto(target_url, wait_until="networkidle", timeout=30000)
+    async def _run_pipeline(self, pipeline: CollectionPipeline, target_url: str, timer: StageTimer) -> None:
+        try:
+            policies = self._screenshot_policies()
+            pool = get_browser_pool()
+            async with pool.browser() as browser:
+                # Ảnh desktop chụp từ chính page đo lighthouse/HTML (đã load xong) để không
+                # tải trang thêm một lần; các thiết bị khác dùng context riêng, chạy song song
+                desktop_capture: asyncio.Future = asyncio.get_running_loop().create_future()
 
-                lighthouse_task = self._run_lighthouse(page, target_url)
-                screenshots_task = self._capture_screenshots(page)
-                html_task = self._extract_html(page)
+                async def capture(device: str) -> Screenshot:
+                    if device == "desktop":
+                        return await self._process_screenshot(device, await desktop_capture, policies[device])
+                    return await self._capture_device(browser, target_url, device, policies[device])
 
-                lighthouse_data, screenshots, html_content = await asyncio.gather(
-                    lighthouse_task, screenshots_task, html_task, return_exceptions=False
-                )
+                async def screenshots_stage():
+                    with timer.stage("screenshots"):
+                        captured = await asyncio.gather(*(capture(device) for device in policies))
+                    pipeline.screenshots.set_result(dict(zip(policies, captured)))
+
+                screenshots_task = asyncio.create_task(screenshots_stage())
+                try:
+                    context = await browser.new_context(**DEVICE_PRESETS["desktop"])
+                    try:
+                        # Observer phải có trước khi trang chạy để bắt paint/LCP/layout shift từ đầu
+                        await context.add_init_script(web_vitals.OBSERVER_SCRIPT)
+                        page = await context.new_page()
+
+                        with timer.stage("navigate"):
+                            await page.goto(target_url, wait_until="networkidle", timeout=30000)
+
+                        with timer.stage("html"):
+                            html_content = await self._extract_html(page)
+
+                        with timer.stage("lighthouse"):
+                            lighthouse_data = await self._run_lighthouse(page, target_url)
+                        pipeline.page_data.set_result(
+                            {"lighthouse": lighthouse_data, "html": html_content, "url": target_url}
+                        )
 
-                return {
-                    "lighthouse": lighthouse_data,
-                    "screenshots": screenshots,
-                    "html": html_content,
-                    "url": target_url,
-                }
-            finally:
-                await browser.close()
+                        if "desktop" in policies:
+                            with span("collector.capture", device="desktop", shared_context=False):
+                                desktop_capture.set_result(await self._settle_and_capture(page, "desktop"))
+                    finally:
+                        await context.close()
+                    await screenshots_task
+                finally:
+                    if not screenshots_task.done():
+                        screenshots_task.cancel()
+                        await asyncio.gather(screenshots_task, return_exceptions=True)
+        except BaseException as e:
+            pipeline._fail(e if isinstance(e, Exception) else RuntimeError("Data collection cancelled"))
+            raise
 
     async def _run_lighthouse(self, page, url: str) -> Dict:
+        """
+        Metrics hiệu năng không cần mạng: Lighthouse CLI nếu cấu hình `LIGHTHOUSE_CLI`,
+        ngược lại (hoặc khi CLI lỗi/quá thời gian) là số đo PerformanceObserver của page.
+        """
+        settings = get_fresh_settings()
+        if settings.LIGHTHOUSE_CLI:
+            try:
+                return await run_lighthouse_cli(
+                    settings.LIGHTHOUSE_CLI,
+                    url,
+                    settings.LIGHTHOUSE_TIMEOUT_SECONDS,
+                    chrome_path=page.context.browser.browser_type.executable_path,
+                )
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Lighthouse CLI failed for {url}, using page metrics: {e}")
+        return await self._get_web_vitals(page)
+
+    async def _get_web_vitals(self, page) -> Dict:
         try:
-            await page.add_script_tag(url="https://unpkg.com/lighthouse@10.0.0/dist/lighthouse.min.js")
-            await asyncio.sleep(2)
-            lighthouse_script = """
-            async () => {
-                try {
-                    const report = await window.lighthouse(location.href, {
-                        onlyCategories: ['performance', 'accessibility', 'best-practices', 'seo']
-                    });
-                    return report;
-                } catch (e) {
-                    return { error: String(e) };
-                }
-            }
-            """
-            result = await page.evaluate(lighthouse_script)
-            if isinstance(result, dict) and result.get("error"):
-                raise RuntimeError(result["error"])  # fallback below
-            return result
-        except Exception:
-            return await self._get_basic_metrics(page)
-
-    async def _get_basic_metrics(self, page) -> Dict:
-        metrics = await page.evaluate(
-            """
-            () => {
-                const nav = performance.getEntriesByType('navigation')[0];
-                const loadEnd = nav ? nav.loadEventEnd : 0;
-                const dclEnd = nav ? nav.domContentLoadedEventEnd : 0;
-                const score = loadEnd && loadEnd < 3000 ? 0.9 : 0.5;
-                return {
-                    categories: { performance: { score } },
-                    audits: { 'first-contentful-paint': { numericValue: dclEnd } }
-                };
-            }
-            """
-        )
-        return metrics
+            raw = await asyncio.wait_for(
+                page.evaluate(web_vitals.COLLECT_SCRIPT), web_vitals.COLLECT_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            # Không có metrics thì code analyst vẫn chạy được với HTML
+            return {"source": "unavailable", "error": str(e)}
+        return web_vitals.to_report(raw)
+
+    def _screenshot_policies(self) -> Dict[str, VisionEncoding]:
+        """Thiết bị cần chụp (theo thứ tự SCREENSHOT_DEVICES) và policy encode vision của từng thiết bị."""
+        settings = get_fresh_settings()
+        devices = [d.strip() for d in settings.SCREENSHOT_DEVICES.split(",") if d.strip()]
+        unknown = [d for d in devices if d not in DEVICE_PRESETS]
+        if unknown:
+            raise ValueError(f"Unknown screenshot devices: {', '.join(unknown)}")
+
+        vision_policy = vision_encoding(settings.VISION_ANALYST_MODEL)
+        policies = {}
+        for device in devices:
+            policy = vision_policy
+            if settings.SCREENSHOT_FULL_PAGE and not policy.tile_height:
+                # Full-page luôn được cắt tile, mặc định mỗi tile cao một màn hình
+                policy = policy._replace(tile_height=DEVICE_PRESETS[device]["viewport"]["height"])
+                check_tiling(policy, settings.VISION_ANALYST_MODEL)
+            policies[device] = policy
+        return policies
+
+    async def _capture_device(
+        self, browser, target_url: str, device: str, vision_policy: VisionEncoding
+    ) -> Screenshot:
+        with span("collector.capture", device=device, shared_context=bool(self.batch_id)):
+            async with self._device_context(browser, target_url, device) as context:
+                page = await context.new_page()
+                try:
+                    await page.goto(target_url, wait_until="networkidle", timeout=30000)
+                    screenshot_bytes = await self._settle_and_capture(page, device)
+                finally:
+                    await page.close()
+        return await self._process_screenshot(device, screenshot_bytes, vision_policy)
+
+    async def _settle_and_capture(self, page, device: str) -> bytes:
+        settings = get_fresh_settings()
+        await self._wait_until_settled(page, settings.SCREENSHOT_SETTLE_QUIET_MS, settings.SCREENSHOT_SETTLE_TIMEOUT_MS)
+        return await self._take_screenshot(page, device)
 
-    async def _capture_screenshots(self, page) -> Dict[str, str]:
-        """Chụp màn hình ở 3 kích thước và RESIZE"""
-        screenshots: Dict[str, str] = {}
+    async def _process_screenshot(
+        self, device: str, screenshot_bytes: bytes, vision_policy: VisionEncoding
+    ) -> Screenshot:
         logger = logging.getLogger(__name__)
 
-        viewports = {
-            'desktop': {'width': 1920, 'height': 1080},
-            'tablet': {'width': 768, 'height': 1024},
-            'mobile': {'width': 375, 'height': 667}
-        }
+        viewport = DEVICE_PRESETS[device]["viewport"]
+        scale_factor = DEVICE_PRESETS[device].get("device_scale_factor", 1)
+        full_page = get_fresh_settings().SCREENSHOT_FULL_PAGE
 
-        for device, viewport in viewports.items():
-            await page.set_viewport_size(viewport)
-            await asyncio.sleep(1)
+        with span("collector.encode", device=device):
+            # Resize + encode PNG là việc nặng CPU nên chạy trong process pool, không chặn event loop.
+            # Aggressive downscale (512px) để đảm bảo dưới 8000px limit
+            # Ảnh lưu để hiển thị chỉ giữ màn hình đầu kể cả khi chụp full-page
+            crop_height = viewport["height"] * scale_factor if full_page else 0
+            png_bytes = await run_image_task(downscale_png, screenshot_bytes, 512, crop_height)
 
-            # Chụp viewport only (không full page để tránh ảnh quá cao)
-            screenshot_bytes = await page.screenshot(full_page=False)
+            # Tạo trước WebP (AVIF nếu bật) và thumbnail để endpoint chỉ việc trả file
+            settings = get_fresh_settings()
+            formats = [f.strip() for f in settings.SCREENSHOT_VARIANT_FORMATS.split(",") if f.strip()]
+            encoded = {"png": png_bytes}
+            encoded.update(
+                await run_image_task(encode_variants, png_bytes, formats, settings.SCREENSHOT_THUMB_SIZE)
+            )
+
+            # Ảnh cho vision encode từ ảnh gốc (không phải bản 512px) theo policy của model
+            vision = await run_image_task(
+                encode_for_vision,
+                screenshot_bytes,
+                vision_policy,
+                scale_factor,
+            )
 
-            # Resize để giảm size
-            img = Image.open(io.BytesIO(screenshot_bytes))
+        with span("collector.store", device=device):
+            # Lưu theo SHA-256: ảnh trùng (trang không đổi) chỉ được lưu một lần
+            variants: Dict[str, str] = {}
+            for name, data in encoded.items():
+                variants[name] = await asyncio.to_thread(self.blob_store.put, data, VARIANT_MEDIA_TYPES[name])
+        logger.info(
+            f"{device} screenshot: {len(png_bytes) / 1024:.1f} KB ({variants['png'][:12]}), "
+            f"vision {len(vision)} image(s) {sum(len(image.data) for image in vision) / 1024:.1f} KB"
+        )
 
-            # Aggressive downscale để đảm bảo dưới 8000px limit
-            max_dimension = 512  # Much smaller to be safe
+        return Screenshot(variants["png"], variants, vision)
+
+    async def _take_screenshot(self, page, device: str) -> bytes:
+        settings = get_fresh_settings()
+        if not settings.SCREENSHOT_FULL_PAGE:
+            # Chụp viewport only (không full page để tránh ảnh quá cao)
+            return await page.screenshot(full_page=False)
 
-            # Resize if any dimension exceeds max_dimension
-            if img.width > max_dimension or img.height > max_dimension:
-                # Calculate ratio to fit within max_dimension x max_dimension
-                ratio = min(max_dimension / img.width, max_dimension / img.height)
-                new_width = int(img.width * ratio)
-                new_height = int(img.height * ratio)
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Trang vô hạn (infinite scroll) có thể rất cao: chỉ chụp tới SCREENSHOT_MAX_PAGE_HEIGHT
+        viewport = DEVICE_PRESETS[device]["viewport"]
+        page_height = await page.evaluate(
+            "() => Math.max(document.documentElement.scrollHeight, document.body ? document.body.scrollHeight : 0)"
+        )
+        height = min(max(int(page_height or 0), viewport["height"]), settings.SCREENSHOT_MAX_PAGE_HEIGHT)
+        return await page.screenshot(
+            full_page=True, clip={"x": 0, "y": 0, "width": viewport["width"], "height": height}
+        )
 
-            # Optimize quality
-            screenshot_path = self.temp_dir / f"{device}.png"
-            img.save(screenshot_path, 'PNG', optimize=True)
+    @asynccontextmanager
+    async def _device_context(self, browser, target_url: str, device: str) -> AsyncIterator:
+        """
+        Context chụp màn hình cho một thiết bị.
 
-            screenshots[device] = str(screenshot_path)
+        Job trong batch dùng chung context theo (batch, origin, thiết bị) để các URL
+        cùng site tái dùng cache asset và font. Không dùng cho desktop: ảnh desktop lấy
+        từ context đo lighthouse, context này luôn mới để metrics không bị cache làm lệch.
+        """
+        if self.batch_id:
+            parts = urlsplit(target_url)
+            origin = f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+            async with get_browser_pool().shared_context(
+                browser, ("batch", self.batch_id, origin, device), **DEVICE_PRESETS[device]
+            ) as context:
+                yield context
+            return
 
-            # Log file size
-            file_size = screenshot_path.stat().st_size / 1024  # KB
-            logger.info(f"{device} screenshot: {file_size:.1f} KB")
+        context = await browser.new_context(**DEVICE_PRESETS[device])
+        try:
+            yield context
+        finally:
+            await context.close()
 
-        return screenshots
+    async def _wait_until_settled(self, page, quiet_ms: int, timeout_ms: int) -> None:
+        """Chờ font load xong và layout không còn dịch chuyển trong `quiet_ms` (tối đa `timeout_ms`)."""
+        try:
+            await page.evaluate(SETTLE_SCRIPT, {"quietMs": quiet_ms, "timeoutMs": timeout_ms})
+        except Exception:
+            # Trang điều hướng lại hoặc chặn script: chụp luôn trạng thái hiện tại
+            pass
 
     async def _extract_html(self, page) -> str:
         return await page.content()
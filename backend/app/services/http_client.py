@@ -0,0 +1,38 @@
+import asyncio
+import weakref
+from typing import Optional
+
+import aiohttp
+
+from app.utils.config import get_fresh_settings
+
+# aiohttp.ClientSession gắn với event loop tạo ra nó nên giữ một session cho mỗi loop
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+def _create_session() -> aiohttp.ClientSession:
+    settings = get_fresh_settings()
+    connector = aiohttp.TCPConnector(
+        limit=settings.HTTP_POOL_LIMIT,
+        limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Session keep-alive dùng chung cho mọi request ra ngoài trên loop hiện tại."""
+    loop = asyncio.get_running_loop()
+    session: Optional[aiohttp.ClientSession] = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _create_session()
+        _sessions[loop] = session
+    return session
+
+
+async def close_http_session() -> None:
+    loop = asyncio.get_running_loop()
+    session = _sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
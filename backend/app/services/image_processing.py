@@ -0,0 +1,152 @@
+import asyncio
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, TypeVar
+
+from PIL import Image
+
+from app.services.vision_encoding import MEDIA_TYPES, VisionEncoding, VisionImage
+from app.utils.config import get_fresh_settings
+
+T = TypeVar("T")
+
+
+def _fit(img: Image.Image, max_dimension: int) -> Image.Image:
+    if img.width <= max_dimension and img.height <= max_dimension:
+        return img
+    ratio = min(max_dimension / img.width, max_dimension / img.height)
+    size = (max(1, int(img.width * ratio)), max(1, int(img.height * ratio)))
+
+    # Bước đầu nhanh: reduce() lấy trung bình theo hệ số nguyên (rẻ hơn nhiều so
+    # với LANCZOS trên ảnh gốc), giữ ảnh >= 1.5 lần kích thước đích để filter cuối
+    # vẫn đủ chất lượng. draft() chỉ áp dụng cho JPEG nên không dùng với PNG.
+    factor = int(min(img.width / size[0], img.height / size[1]) / 1.5)
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def downscale_png(data: bytes, max_dimension: int, crop_height: int = 0) -> bytes:
+    """
+    Thu nhỏ ảnh để cạnh dài nhất không vượt `max_dimension` và encode lại PNG.
+    `crop_height` > 0: chỉ giữ phần trên cao `crop_height` px (vd. màn hình đầu của ảnh full-page).
+
+    Chạy trong process pool nên phải là hàm top-level (pickle được).
+    """
+    img = Image.open(io.BytesIO(data))
+    if crop_height and img.height > crop_height:
+        img = img.crop((0, 0, img.width, crop_height))
+    img = _fit(img, max_dimension)
+
+    # optimize=True chậm hơn ~3-4 lần mà chỉ giảm vài % dung lượng (xem benchmarks/bench_image_resize.py)
+    output = io.BytesIO()
+    img.save(output, "PNG", compress_level=6)
+    return output.getvalue()
+
+
+# Media type của từng biến thể ảnh được lưu cho mỗi screenshot
+VARIANT_MEDIA_TYPES: Dict[str, str] = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+    "thumb": "image/webp",
+}
+
+
+def encode_variants(png_data: bytes, formats: Sequence[str], thumb_size: int) -> Dict[str, bytes]:
+    """
+    Tạo trước các biến thể để phục vụ theo header Accept: WebP/AVIF cùng kích thước
+    và thumbnail WebP. Chạy trong process pool.
+    """
+    img = Image.open(io.BytesIO(png_data))
+    img.load()
+    variants: Dict[str, bytes] = {}
+
+    for fmt in formats:
+        if fmt == "png":
+            continue
+        output = io.BytesIO()
+        if fmt == "webp":
+            img.save(output, "WEBP", quality=82, method=4)
+        elif fmt == "avif":
+            img.save(output, "AVIF", quality=60)
+        else:
+            raise ValueError(f"Unsupported image variant: {fmt}")
+        variants[fmt] = output.getvalue()
+
+    if thumb_size:
+        thumb = img.copy()
+        thumb.thumbnail((thumb_size, thumb_size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        thumb.save(output, "WEBP", quality=75, method=4)
+        variants["thumb"] = output.getvalue()
+
+    return variants
+
+
+def encode_for_vision(data: bytes, policy: VisionEncoding, device_scale_factor: float = 1) -> List[VisionImage]:
+    """
+    Encode ảnh chụp gốc cho vision model theo `policy`: cắt tile nếu ảnh cao hơn
+    `tile_height`, thu nhỏ từng tile về `max_dimension`, đổi định dạng/grayscale.
+    Chạy trong process pool.
+    """
+    img = Image.open(io.BytesIO(data))
+    img = img.convert("L" if policy.grayscale else "RGB")
+
+    tile_px = img.height
+    if policy.tile_height and img.height > policy.tile_height * device_scale_factor:
+        tile_px = int(policy.tile_height * device_scale_factor)
+    step = max(1, tile_px - int(policy.tile_overlap * device_scale_factor))
+    tops = [0]
+    while tops[-1] + tile_px < img.height:
+        # Tile cuối căn theo mép dưới để không có tile quá thấp
+        tops.append(min(tops[-1] + step, img.height - tile_px))
+
+    images: List[VisionImage] = []
+    for top in tops:
+        tile = _fit(img.crop((0, top, img.width, top + tile_px)), policy.max_dimension)
+        output = io.BytesIO()
+        if policy.format == "jpeg":
+            tile.save(output, "JPEG", quality=policy.quality, optimize=False)
+        elif policy.format == "webp":
+            tile.save(output, "WEBP", quality=policy.quality, method=4)
+        else:
+            tile.save(output, "PNG", compress_level=6)
+        images.append(
+            VisionImage(
+                data=output.getvalue(),
+                media_type=MEDIA_TYPES[policy.format],
+                width=tile.width,
+                height=tile.height,
+                css_scale=img.width / device_scale_factor / tile.width,
+                css_top=round(top / device_scale_factor),
+            )
+        )
+    return images
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_image_executor() -> ProcessPoolExecutor:
+    """Process pool dùng chung cho mọi job để xử lý ảnh ngoài event loop."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=get_fresh_settings().IMAGE_POOL_WORKERS)
+        return _executor
+
+
+async def run_image_task(func: Callable[..., T], *args) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_image_executor(), func, *args)
+
+
+def shutdown_image_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
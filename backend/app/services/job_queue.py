@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, or_
+
+from app.database import SessionLocal
+from app.models.job import Job, JobStatus
+from app.services.progress import notify_progress
+
+
+def claim_jobs(worker_id: str, limit: int) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Nhận tối đa `limit` job PENDING cho worker.
+
+    Dùng SELECT ... FOR UPDATE SKIP LOCKED để nhiều worker có thể claim song song
+    mà không nhận trùng job. Chia đều giữa các batch: job thứ k của mọi batch (job
+    gửi lẻ coi như batch một phần tử) được nhận trước job thứ k+1 của bất kỳ batch
+    nào, nên một batch vài trăm URL không chặn các job gửi sau nó.
+    Trả về danh sách (job_id, target_url, batch_id).
+    """
+    if limit <= 0:
+        return []
+
+    db = SessionLocal()
+    try:
+        # Postgres không cho FOR UPDATE cùng window function nên xếp hạng trước,
+        # rồi khoá các ứng viên (dư ra để bù cho những job worker khác đang khoá)
+        batch_rank = func.row_number().over(
+            partition_by=func.coalesce(Job.batch_id, Job.id), order_by=Job.created_at
+        )
+        ranked = (
+            db.query(Job.id.label("id"), batch_rank.label("batch_rank"), Job.created_at.label("created_at"))
+            .filter(Job.status == JobStatus.PENDING)
+            .subquery()
+        )
+        candidates = [
+            row.id
+            for row in db.query(ranked.c.id)
+            .order_by(ranked.c.batch_rank, ranked.c.created_at)
+            .limit(limit * 4)
+            .all()
+        ]
+        if not candidates:
+            db.commit()
+            return []
+
+        locked = {
+            job.id: job
+            for job in (
+                db.query(Job)
+                .filter(Job.id.in_(candidates), Job.status == JobStatus.PENDING)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+        }
+        jobs = [locked[job_id] for job_id in candidates if job_id in locked][:limit]
+
+        now = datetime.utcnow()
+        for job in jobs:
+            job.status = JobStatus.PROCESSING
+            job.claimed_by = worker_id
+            job.heartbeat_at = now
+            job.stage = "collecting"
+            job.attempts = (job.attempts or 0) + 1
+        claimed = [(str(job.id), job.target_url, str(job.batch_id) if job.batch_id else None) for job in jobs]
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def heartbeat(worker_id: str, job_ids: Sequence[str]) -> None:
+    """Cập nhật heartbeat cho các job worker đang chạy."""
+    if not job_ids:
+        return
+
+    db = SessionLocal()
+    try:
+        (
+            db.query(Job)
+            .filter(
+                Job.id.in_(list(job_ids)),
+                Job.claimed_by == worker_id,
+                Job.status == JobStatus.PROCESSING,
+            )
+            .update({Job.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def reclaim_stale_jobs(stale_after_seconds: int, max_attempts: int) -> int:
+    """
+    Trả lại hàng đợi các job PROCESSING không có heartbeat quá lâu (worker đã chết).
+
+    Job không có heartbeat_at (đang chạy từ trước khi có cột này) cũng bị coi là bỏ dở.
+    Worker cũ nếu vẫn sống sẽ không ghi được job nữa vì claimed_by đã bị xoá.
+    Job đã thử đủ `max_attempts` lần thì đánh dấu FAILED. Trả về số job xử lý.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after_seconds)
+
+    db = SessionLocal()
+    try:
+        jobs = (
+            db.query(Job)
+            .filter(Job.status == JobStatus.PROCESSING, or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < cutoff))
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for job in jobs:
+            job.claimed_by = None
+            if (job.attempts or 0) >= max_attempts:
+                job.status = JobStatus.FAILED
+                job.stage = "failed"
+                job.error_message = "Job abandoned by worker too many times"
+                job.completed_at = datetime.utcnow()
+            else:
+                job.status = JobStatus.PENDING
+                job.stage = "queued"
+            notify_progress(db, str(job.id), job.status.value, job.stage)
+        db.commit()
+        return len(jobs)
+    finally:
+        db.close()
@@ -0,0 +1,139 @@
+"""
+Lấy JSON từ output của model: JSON thuần, JSON trong ```fence```, JSON lẫn văn bản,
+dấu phẩy thừa, hoặc bị cắt giữa chừng do hết max_tokens.
+
+Quét bằng một regex tokenizer (nhảy qua cả chuỗi trong một bước của regex engine)
+nên dấu ngoặc trong chuỗi và ký tự escape được xử lý đúng mà không phải lặp từng
+ký tự trong Python. Dùng orjson nếu được cài.
+"""
+import json
+import re
+from typing import Any, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+try:
+    import orjson
+except ImportError:  # orjson là tuỳ chọn, không có thì dùng json chuẩn
+    orjson = None
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# Chuỗi JSON hoàn chỉnh, một ký tự cấu trúc, hoặc dấu " mở một chuỗi không bao giờ đóng
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\],"]', re.DOTALL)
+# Dấu phẩy ngay trước } hoặc ] (chuỗi được match trước nên không bị đụng tới)
+_TRAILING_COMMA = re.compile(r'("(?:[^"\\]|\\.)*")|,(\s*[}\]])', re.DOTALL)
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class JSONExtractionError(ValueError):
+    pass
+
+
+def loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _try_loads(text: str) -> Tuple[bool, Any]:
+    try:
+        return True, loads(text)
+    except ValueError:
+        # orjson.JSONDecodeError và json.JSONDecodeError đều là ValueError
+        return False, None
+
+
+def _strip_trailing_commas(text: str) -> str:
+    # Nhóm không match được thay bằng chuỗi rỗng: giữ chuỗi, bỏ dấu phẩy
+    return _TRAILING_COMMA.sub(r"\1\2", text)
+
+
+def _load_object(candidate: str) -> Optional[dict]:
+    ok, value = _try_loads(candidate)
+    if not ok:
+        ok, value = _try_loads(_strip_trailing_commas(candidate))
+    return value if ok and isinstance(value, dict) else None
+
+
+def _scan(content: str, start: int) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Quét từ dấu `{` tại `start`.
+
+    Trả về (vị trí ngay sau dấu đóng khớp, None) nếu giá trị đóng đủ; nếu hết chuỗi
+    khi vẫn còn mở thì trả về (None, bản sửa: cắt tại dấu phẩy an toàn cuối cùng và đóng lại).
+    """
+    stack: List[str] = []
+    checkpoint: Optional[Tuple[int, str]] = None
+    for match in _TOKEN.finditer(content, start):
+        token = match.group()
+        if token in _CLOSERS:
+            stack.append(token)
+        elif token in "}]":
+            if not stack or _CLOSERS[stack.pop()] != token:
+                # Ngoặc không khớp: coi như đóng tại đây để json báo lỗi và quét tiếp
+                return match.end(), None
+            if not stack:
+                return match.end(), None
+        elif token == '"':
+            # Chuỗi bị cắt: mọi ký tự phía sau đều nằm trong chuỗi
+            break
+        elif token == "," and (stack[-1] == "[" or len(stack) == 1):
+            # Chỉ cắt giữa các phần tử mảng hoặc các key của object gốc để không giữ
+            # lại một issue chỉ có nửa số trường
+            checkpoint = (match.start(), "".join(_CLOSERS[opener] for opener in reversed(stack)))
+
+    if checkpoint is None:
+        return None, None
+    # Bị cắt giữa chừng: bỏ phần tử dang dở sau dấu phẩy cuối cùng rồi đóng các ngoặc còn mở
+    cut, closers = checkpoint
+    return None, content[start:cut] + closers
+
+
+def extract_json(content: str) -> Any:
+    """
+    Trả về toàn bộ `content` nếu là JSON hợp lệ, ngược lại object JSON đầu tiên đọc
+    được trong đó (bỏ qua văn bản, fence và các đoạn `{...}` không phải JSON).
+    """
+    ok, value = _try_loads(content)
+    if ok:
+        return value
+
+    # Trường hợp phổ biến (fence, văn bản trước/sau một object): thử đoạn từ `{` đầu
+    # tới `}` cuối, toàn bộ việc quét nằm trong parser C
+    first, last = content.find("{"), content.rfind("}")
+    if first != -1 and last > first:
+        value = _load_object(content[first:last + 1])
+        if value is not None:
+            return value
+
+    pos = 0
+    while True:
+        start = content.find("{", pos)
+        if start == -1:
+            break
+        end, repaired = _scan(content, start)
+        candidate = content[start:end] if end is not None else repaired
+        if candidate is not None:
+            value = _load_object(candidate)
+            if value is not None:
+                return value
+        if end is None:
+            break
+        # Không parse được (vd. "{placeholder}" trong văn bản): tìm tiếp sau đoạn này
+        pos = end
+
+    raise JSONExtractionError("Cannot parse AI response as JSON")
+
+
+def parse_model_output(content: str, schema: Type[ModelT]) -> dict:
+    """Lấy JSON từ output của model rồi kiểm tra theo `schema`; trả về dict đã chuẩn hoá."""
+    value = extract_json(content)
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], dict):
+        # Một số model bọc object trong mảng
+        value = value[0]
+    try:
+        return schema.model_validate(value).model_dump()
+    except ValidationError as e:
+        raise JSONExtractionError(f"AI response does not match {schema.__name__}: {e}") from e
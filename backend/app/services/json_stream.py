@@ -0,0 +1,90 @@
+import json
+from typing import Dict, Iterable, List, Tuple
+
+
+class StreamingArrayExtractor:
+    """
+    Parse JSON tăng dần khi model stream từng token.
+
+    Theo dõi các mảng có key nằm trong `keys` (vd. "issues", "ui_issues") và trả
+    về từng object phần tử ngay khi dấu `}` đóng của nó tới, không chờ hết response.
+    Xử lý đúng chuỗi và ký tự escape nên dấu ngoặc trong chuỗi không làm lệch.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys = set(keys)
+        self._text = ""
+        self._pos = 0
+
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._current_key = None
+        # Mỗi phần tử: (ký tự mở, key nếu là mảng đang theo dõi)
+        self._stack: List[Tuple[str, str]] = []
+        self._item_start = None
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def feed(self, chunk: str) -> List[Tuple[str, Dict]]:
+        """Thêm đoạn text mới, trả về các cặp (key, item) vừa hoàn chỉnh."""
+        self._text += chunk
+        completed: List[Tuple[str, Dict]] = []
+        text = self._text
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":":
+                if self._stack and self._stack[-1][0] == "{":
+                    self._current_key = self._last_string
+            elif ch == ",":
+                self._current_key = None
+            elif ch == "[":
+                key = None
+                if self._stack and self._stack[-1][0] == "{" and self._current_key in self.keys:
+                    key = self._current_key
+                self._stack.append(("[", key))
+                self._current_key = None
+            elif ch == "{":
+                if self._stack and self._stack[-1][0] == "[" and self._stack[-1][1] is not None:
+                    self._item_start = i
+                self._stack.append(("{", None))
+                self._current_key = None
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if (
+                    ch == "}"
+                    and self._item_start is not None
+                    and self._stack
+                    and self._stack[-1][0] == "["
+                    and self._stack[-1][1] is not None
+                ):
+                    try:
+                        item = json.loads(text[self._item_start:i + 1])
+                        if isinstance(item, dict):
+                            completed.append((self._stack[-1][1], item))
+                    except ValueError:
+                        pass
+                    self._item_start = None
+
+        self._pos = len(text)
+        return completed
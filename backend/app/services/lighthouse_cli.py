@@ -0,0 +1,98 @@
+"""
+Chạy Lighthouse CLI cài sẵn (vd. `npm install lighthouse` trong image) với Chromium của Playwright.
+
+Lighthouse tự điều khiển Chromium qua CDP nên không cần tải script nào vào trang.
+Report đầy đủ rất lớn; chỉ giữ điểm các category, các metric chính và những audit
+chưa đạt để đưa vào prompt.
+"""
+import asyncio
+import json
+import os
+import shlex
+from typing import Dict, Optional
+
+CATEGORIES = ("performance", "accessibility", "best-practices", "seo")
+
+KEY_AUDITS = (
+    "first-contentful-paint",
+    "largest-contentful-paint",
+    "total-blocking-time",
+    "cumulative-layout-shift",
+    "speed-index",
+    "interactive",
+    "server-response-time",
+)
+
+# Số audit chưa đạt tối đa giữ lại trong report rút gọn
+MAX_FAILED_AUDITS = 30
+
+
+async def run_lighthouse_cli(
+    command: str, url: str, timeout_seconds: float, chrome_path: Optional[str] = None
+) -> Dict:
+    args = shlex.split(command) + [
+        url,
+        "--output=json",
+        "--output-path=stdout",
+        "--quiet",
+        "--preset=desktop",
+        f"--only-categories={','.join(CATEGORIES)}",
+        # Giống cờ Playwright dùng khi launch (chạy được trong container)
+        "--chrome-flags=--headless=new --no-sandbox",
+    ]
+    env = dict(os.environ)
+    if chrome_path:
+        env["CHROME_PATH"] = chrome_path
+
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout_seconds)
+    except BaseException:
+        # Hết thời gian hoặc job bị huỷ: không để lại Chromium/Node mồ côi
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"Lighthouse exited with {process.returncode}: {stderr.decode(errors='replace')[-500:]}"
+        )
+    return summarize_report(json.loads(stdout))
+
+
+def summarize_report(lhr: Dict) -> Dict:
+    audits = lhr.get("audits") or {}
+
+    def compact(audit: Dict) -> Dict:
+        return {
+            key: audit[key]
+            for key in ("title", "score", "numericValue", "displayValue")
+            if audit.get(key) is not None
+        }
+
+    summary = {audit_id: compact(audits[audit_id]) for audit_id in KEY_AUDITS if audit_id in audits}
+    failed = sorted(
+        (
+            (audit_id, audit)
+            for audit_id, audit in audits.items()
+            if audit_id not in summary
+            and audit.get("scoreDisplayMode") in ("binary", "numeric", "metricSavings")
+            and audit.get("score") is not None
+            and audit["score"] < 0.9
+        ),
+        key=lambda item: item[1]["score"],
+    )
+    for audit_id, audit in failed[:MAX_FAILED_AUDITS]:
+        summary[audit_id] = compact(audit)
+
+    return {
+        "source": "lighthouse",
+        "lighthouseVersion": lhr.get("lighthouseVersion"),
+        "categories": {
+            category_id: {"score": category.get("score")}
+            for category_id, category in (lhr.get("categories") or {}).items()
+        },
+        "audits": summary,
+    }
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import random
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import aiohttp
+
+from app.utils.config import get_fresh_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(RuntimeError):
+    """Model đang bị ngắt (circuit open) do lỗi liên tiếp."""
+
+
+class TokenBucket:
+    """Giới hạn số request mỗi phút, cho phép burst tới `capacity`."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, rate_per_minute / 6.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Mở mạch sau `failure_threshold` lỗi liên tiếp, thử lại một request sau `reset_timeout` giây."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def check(self, model: str) -> bool:
+        """Ném CircuitOpenError nếu mạch mở; trả về True nếu request này là request thử (half-open)."""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probing):
+            raise CircuitOpenError(f"Circuit open for model {model}")
+        if state == "half-open":
+            self._probing = True
+            return True
+        return False
+
+    def end_probe(self) -> None:
+        # Request thử kết thúc mà không ghi nhận được (bị huỷ, lỗi 4xx, lỗi stream):
+        # không tính là thành công hay thất bại, chỉ cho phép request sau thử lại
+        self._probing = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+def _retry_after_seconds(headers) -> Optional[float]:
+    if not headers:
+        return None
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGovernor:
+    """
+    Điều phối mọi request LLM trong process: giới hạn đồng thời toàn cục,
+    token bucket theo model, retry với exponential backoff + jitter (tôn trọng
+    Retry-After) và circuit breaker theo model.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: float = 60,
+        max_retries: int = 4,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 60.0,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests_per_minute = requests_per_minute
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def _bucket(self, model: str) -> TokenBucket:
+        if model not in self._buckets:
+            self._buckets[model] = TokenBucket(self.requests_per_minute)
+        return self._buckets[model]
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return self._breakers[model]
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: ngẫu nhiên trong [0, base * 2^attempt]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def call(self, model: str, request: Callable[[], Awaitable[T]]) -> T:
+        breaker = self.breaker(model)
+        bucket = self._bucket(model)
+
+        for attempt in range(self.max_retries + 1):
+            probe = breaker.check(model)
+            retry_after = None
+            try:
+                await bucket.acquire()
+                async with self._semaphore:
+                    result = await request()
+                breaker.record_success()
+                return result
+            except aiohttp.ClientResponseError as e:
+                if e.status != 429 and e.status < 500:
+                    # Lỗi 4xx khác (sai key, payload...) không retry và không tính cho breaker
+                    raise
+                retry_after = _retry_after_seconds(e.headers)
+                # 429 là giới hạn tốc độ chứ không phải provider hỏng
+                if e.status >= 500:
+                    breaker.record_failure()
+                error = e
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                # ClientPayloadError: kết nối đứt giữa chừng khi đang stream response
+                breaker.record_failure()
+                error = e
+            finally:
+                if probe:
+                    breaker.end_probe()
+
+            if attempt == self.max_retries:
+                raise error
+            delay = retry_after if retry_after is not None else self._backoff(attempt)
+            delay = min(delay, self.backoff_max)
+            logger.warning(
+                "LLM request to %s failed (%s), retry %d/%d in %.1fs",
+                model, error, attempt + 1, self.max_retries, delay,
+            )
+            await asyncio.sleep(delay)
+
+        raise RuntimeError("unreachable")
+
+
+_governors: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LLMGovernor]" = weakref.WeakKeyDictionary()
+
+
+def get_llm_governor() -> LLMGovernor:
+    loop = asyncio.get_running_loop()
+    governor = _governors.get(loop)
+    if governor is None:
+        settings = get_fresh_settings()
+        governor = LLMGovernor(
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+            max_retries=settings.LLM_MAX_RETRIES,
+            backoff_base=settings.LLM_BACKOFF_BASE,
+            backoff_max=settings.LLM_BACKOFF_MAX,
+            breaker_threshold=settings.LLM_BREAKER_THRESHOLD,
+            breaker_reset=settings.LLM_BREAKER_RESET,
+        )
+        _governors[loop] = governor
+    return governor
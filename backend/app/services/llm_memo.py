@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.services.telemetry import LLM_MEMO_LOOKUPS
+from app.utils.config import get_fresh_settings
+
+
+def memo_key(payload: Dict) -> str:
+    """Hash chuẩn hoá của payload (model nằm trong payload nên cũng thuộc key)."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    digest = hashlib.sha256()
+    digest.update(str(payload.get("model", "")).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(canonical.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class MemoStore(ABC):
+    """
+    Interface lưu response của OpenRouter theo memo key. Số hit/miss có trong `stats()`
+    và metric Prometheus `llm_memo_lookups_total`.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Dict]:
+        value = await self._get(key)
+        if value is None:
+            self.misses += 1
+            LLM_MEMO_LOOKUPS.labels("miss").inc()
+        else:
+            self.hits += 1
+            LLM_MEMO_LOOKUPS.labels("hit").inc()
+        return value
+
+    async def set(self, key: str, value: Dict) -> None:
+        await self._set(key, value)
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def _set(self, key: str, value: Dict) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class InMemoryMemoStore(MemoStore):
+    def __init__(self, max_entries: int = 512):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[Dict]:
+        raw = self._entries.get(key)
+        if raw is None:
+            return None
+        self._entries.move_to_end(key)
+        # Lưu dạng chuỗi JSON để caller không sửa được bản trong cache
+        return json.loads(raw)
+
+    async def _set(self, key: str, value: Dict) -> None:
+        self._entries[key] = json.dumps(value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SQLiteMemoStore(MemoStore):
+    """Memo trên đĩa, dùng chung giữa các lần chạy và các worker trên cùng máy."""
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_memo ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def _get_sync(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_memo WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_memo SET used_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def _set_sync(self, key: str, value: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_memo (key, value, used_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+            # Xoá các entry ít dùng nhất khi vượt giới hạn (LRU theo used_at)
+            self._conn.execute(
+                "DELETE FROM llm_memo WHERE key IN ("
+                "SELECT key FROM llm_memo ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    async def _get(self, key: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def _set(self, key: str, value: Dict) -> None:
+        await asyncio.to_thread(self._set_sync, key, value)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_store: Optional[MemoStore] = None
+_store_lock = threading.Lock()
+
+
+def get_memo_store() -> Optional[MemoStore]:
+    """Memo store dùng chung trong process theo LLM_MEMO_BACKEND (memory|sqlite|none)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            settings = get_fresh_settings()
+            backend = settings.LLM_MEMO_BACKEND.lower()
+            if backend == "memory":
+                _store = InMemoryMemoStore(max_entries=settings.LLM_MEMO_MAX_ENTRIES)
+            elif backend == "sqlite":
+                _store = SQLiteMemoStore(settings.LLM_MEMO_PATH, max_entries=settings.LLM_MEMO_MAX_ENTRIES)
+            elif backend != "none":
+                raise ValueError(f"Unknown LLM_MEMO_BACKEND: {settings.LLM_MEMO_BACKEND}")
+        return _store
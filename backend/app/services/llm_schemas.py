@@ -0,0 +1,120 @@
+"""
+Schema output của từng agent.
+
+Chấp nhận trường thừa và kiểu lỏng (điểm dạng chuỗi "85"), chuẩn hoá severity và
+kẹp điểm về 0-100, để một response hơi lệch format không làm hỏng cả job.
+"""
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+SEVERITIES = ("critical", "high", "medium", "low")
+
+
+def _clamp_score(value: Any) -> Optional[float]:
+    try:
+        return max(0.0, min(100.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+class _AgentOutput(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    @model_validator(mode="before")
+    @classmethod
+    def _drop_nulls(cls, data: Any) -> Any:
+        # `"issues": null` thì dùng giá trị mặc định của field thay vì báo lỗi
+        if isinstance(data, dict):
+            return {key: value for key, value in data.items() if value is not None}
+        return data
+
+
+class Issue(_AgentOutput):
+    category: Optional[str] = None
+    severity: str = "medium"
+    title: str = ""
+    description: str = ""
+    recommendation: str = ""
+
+    @field_validator("severity", mode="before")
+    @classmethod
+    def _normalize_severity(cls, value: Any) -> str:
+        value = str(value or "").strip().lower()
+        return value if value in SEVERITIES else "medium"
+
+
+class BoundingBox(_AgentOutput):
+    x: float = 0
+    y: float = 0
+    width: float = 0
+    height: float = 0
+
+
+class UIIssue(Issue):
+    device: Optional[str] = None
+    location: Optional[BoundingBox] = None
+    # Số thứ tự ảnh chứa bbox (từ 1), dùng để đổi toạ độ về trang rồi bỏ đi
+    image: Optional[int] = None
+
+    @field_validator("location", mode="before")
+    @classmethod
+    def _drop_invalid_location(cls, value: Any) -> Any:
+        # Bbox sai dạng thì bỏ, vẫn giữ issue
+        return value if isinstance(value, dict) else None
+
+    @field_validator("image", mode="before")
+    @classmethod
+    def _drop_invalid_image(cls, value: Any) -> Optional[int]:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+
+class CodeAnalysis(_AgentOutput):
+    performance_score: Optional[float] = None
+    accessibility_score: Optional[float] = None
+    seo_score: Optional[float] = None
+    issues: List[Issue] = Field(default_factory=list)
+    metrics: Dict[str, Any] = Field(default_factory=dict)
+
+    @field_validator("performance_score", "accessibility_score", "seo_score", mode="before")
+    @classmethod
+    def _clamp(cls, value: Any) -> Optional[float]:
+        return _clamp_score(value)
+
+
+class VisionAnalysis(_AgentOutput):
+    overall_design_score: Optional[float] = None
+    responsive_quality: Optional[str] = None
+    ui_issues: List[UIIssue] = Field(default_factory=list)
+    positive_aspects: List[str] = Field(default_factory=list)
+
+    @field_validator("overall_design_score", mode="before")
+    @classmethod
+    def _clamp(cls, value: Any) -> Optional[float]:
+        return _clamp_score(value)
+
+
+class TileAnalysis(_AgentOutput):
+    """Output cho các tile phía dưới màn hình đầu: chỉ có issue."""
+
+    ui_issues: List[UIIssue] = Field(default_factory=list)
+
+
+class PriorityAction(_AgentOutput):
+    action: str
+    impact: Optional[str] = None
+    effort: Optional[str] = None
+
+
+class Synthesis(_AgentOutput):
+    executive_summary: str
+    priority_actions: List[PriorityAction] = Field(default_factory=list)
+    overall_score: Optional[float] = None
+
+    @field_validator("overall_score", mode="before")
+    @classmethod
+    def _clamp(cls, value: Any) -> Optional[float]:
+        return _clamp_score(value)
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+# Kênh Postgres LISTEN/NOTIFY cho sự kiện tiến độ job
+CHANNEL = "job_progress"
+
+# Các stage theo thứ tự; code_analysis và vision_analysis có thể chồng nhau
+STAGES = ("queued", "collecting", "code_analysis", "vision_analysis", "synthesis", "done", "failed")
+
+
+NOTIFY_SQL = text("SELECT pg_notify(:channel, :payload)")
+
+
+def notify_progress(db: Session, job_id: str, status: str, stage: Optional[str]) -> None:
+    """
+    Gửi sự kiện tiến độ trong cùng transaction với lần ghi status.
+
+    Postgres chỉ phát NOTIFY khi transaction commit, nên listener không bao giờ thấy
+    sự kiện của một thay đổi bị rollback. Với DB khác chỉ phát trong process.
+    """
+    event = {"job_id": job_id, "status": status, "stage": stage}
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(NOTIFY_SQL, {"channel": CHANNEL, "payload": json.dumps(event)})
+    else:
+        broker.publish(event)
+
+
+async def notify_progress_async(db: AsyncSession, job_id: str, status: str, stage: Optional[str]) -> None:
+    """Như notify_progress nhưng cho AsyncSession."""
+    event = {"job_id": job_id, "status": status, "stage": stage}
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(NOTIFY_SQL, {"channel": CHANNEL, "payload": json.dumps(event)})
+    else:
+        broker.publish(event)
+
+
+class ProgressBroker:
+    """Pub/sub trong process: mỗi subscriber một asyncio.Queue theo job_id."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @contextmanager
+    def subscribe(self, job_id: str) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                queues = self._subscribers.get(job_id)
+                if queues is not None:
+                    queues.discard(queue)
+                    if not queues:
+                        del self._subscribers[job_id]
+
+    def _deliver(self, event: Dict) -> None:
+        with self._lock:
+            queues = list(self._subscribers.get(str(event.get("job_id")), ()))
+        for queue in queues:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Subscriber chậm: bỏ sự kiện, lần đọc sau vẫn lấy được trạng thái mới nhất
+                pass
+
+    def publish(self, event: Dict) -> None:
+        """An toàn khi gọi từ thread khác (listener) hoặc từ event loop."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+
+broker = ProgressBroker()
+
+
+class PgProgressListener:
+    """
+    Thread LISTEN trên Postgres, chuyển NOTIFY từ worker (process khác) vào broker.
+
+    Một kết nối duy nhất cho cả API thay vì mỗi client poll bằng SELECT.
+    """
+
+    def __init__(self, poll_timeout: float = 1.0):
+        self.poll_timeout = poll_timeout
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if engine.dialect.name != "postgresql":
+            return
+        self._thread = threading.Thread(target=self._run, name="pg-progress-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Progress listener failed, reconnecting")
+                self._stop.wait(2.0)
+
+    def _listen(self) -> None:
+        raw = engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            while not self._stop.is_set():
+                if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        broker.publish(json.loads(notify.payload))
+                    except ValueError:
+                        logger.warning("Ignoring malformed progress payload: %s", notify.payload)
+        finally:
+            raw.invalidate()
@@ -0,0 +1,334 @@
+"""
+Rút gọn dữ liệu đưa vào prompt và giữ prompt trong ngân sách token của từng model.
+
+- `distill_lighthouse`: chỉ giữ điểm category, metric chính và các audit chưa đạt.
+- `summarize_html`: tóm tắt cấu trúc DOM (landmark, heading, form, ảnh thiếu alt,
+  khối lượng script/style) thay cho một lát HTML thô.
+- `distill_analyses`: rút gọn kết quả code/vision cho synthesizer.
+- `fit_to_budget`: cắt dần các danh sách dài nhất tới khi vừa ngân sách.
+"""
+import json
+import logging
+import math
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.lighthouse_cli import KEY_AUDITS
+from app.utils.config import get_fresh_settings
+
+try:
+    import tiktoken
+except ImportError:  # tokenizer là tuỳ chọn, không có thì ước lượng theo số ký tự
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Audit có điểm dưới ngưỡng này được coi là chưa đạt
+FAILING_SCORE = 0.9
+
+SEVERITY_ORDER = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+# Chuỗi dài hơn mức này bị cắt khi cắt danh sách vẫn chưa đủ
+MAX_STRING_CHARS = 200
+
+_encoding = None
+
+
+def compact_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token bằng tokenizer cục bộ (tiktoken nếu có, ngược lại ~3 ký tự/token)."""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # Chưa có file BPE trong cache và không tải được: dùng ước lượng
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # JSON/HTML nhiều ký hiệu nên tỷ lệ ký tự/token thấp hơn văn xuôi; ước lượng dư cho an toàn
+    return math.ceil(len(text) / 3)
+
+
+def token_budget(model: str) -> int:
+    """Ngân sách token đầu vào cho `model`: PROMPT_TOKEN_BUDGETS ("model=tokens,...") hoặc mặc định."""
+    settings = get_fresh_settings()
+    for entry in settings.PROMPT_TOKEN_BUDGETS.split(","):
+        name, _, value = entry.strip().partition("=")
+        if name.strip() == model and value.strip().isdigit():
+            return int(value)
+    return settings.PROMPT_TOKEN_BUDGET
+
+
+def distill_lighthouse(report: Dict) -> Dict:
+    """Giữ điểm category, metric chính và audit chưa đạt (điểm thấp nhất trước)."""
+    if not isinstance(report, dict):
+        return {}
+
+    def compact(audit: Dict) -> Dict:
+        return {
+            key: audit[key]
+            for key in ("title", "score", "numericValue", "displayValue", "element")
+            if audit.get(key) is not None
+        }
+
+    audits = report.get("audits") or {}
+    metrics = {audit_id: compact(audits[audit_id]) for audit_id in KEY_AUDITS if audit_id in audits}
+    failing = sorted(
+        (
+            {"id": audit_id, **compact(audit)}
+            for audit_id, audit in audits.items()
+            if audit_id not in metrics
+            and isinstance(audit.get("score"), (int, float))
+            and audit["score"] < FAILING_SCORE
+        ),
+        key=lambda audit: audit["score"],
+    )
+
+    distilled: Dict[str, Any] = {
+        "source": report.get("source"),
+        "categories": {
+            category_id: category.get("score")
+            for category_id, category in (report.get("categories") or {}).items()
+            if isinstance(category, dict)
+        },
+        "metrics": metrics,
+        "failing_audits": failing,
+    }
+    if report.get("timing"):
+        distilled["timing"] = report["timing"]
+    resources = report.get("resources")
+    if resources:
+        distilled["resources"] = {
+            "count": resources.get("count"),
+            "transferSize": resources.get("transferSize"),
+            "byType": resources.get("byType"),
+            "largest": list(resources.get("largest") or [])[:5],
+        }
+    return distilled
+
+
+class _StructureParser(HTMLParser):
+    LANDMARK_TAGS = {"header", "nav", "main", "footer", "aside"}
+    LANDMARK_ROLES = {"banner", "navigation", "main", "contentinfo", "complementary", "search", "form"}
+    HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+    FIELD_TAGS = {"input", "select", "textarea"}
+    UNLABELED_INPUT_TYPES = {"hidden", "submit", "button", "reset", "image"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.elements = 0
+        self.lang: Optional[str] = None
+        self.title = ""
+        self.meta: Dict[str, str] = {}
+        self.landmarks: Dict[str, int] = {}
+        self.headings: List[Dict] = []
+        self.forms = 0
+        self.fields: List[Tuple[Optional[str], bool]] = []
+        self.label_for: set = set()
+        self.images = 0
+        self.images_missing_alt: List[str] = []
+        self.links = 0
+        self.buttons = 0
+        self.scripts = {"external": 0, "inline": 0, "inline_bytes": 0, "blocking": 0}
+        self.styles = {"stylesheets": 0, "inline": 0, "inline_bytes": 0, "style_attributes": 0}
+        self._in_head = False
+        self._label_depth = 0
+        self._capture: Optional[str] = None
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        attrs = dict(attrs)
+        self.elements += 1
+        if attrs.get("style"):
+            self.styles["style_attributes"] += 1
+        role = (attrs.get("role") or "").lower()
+        if tag in self.LANDMARK_TAGS or role in self.LANDMARK_ROLES:
+            name = role or tag
+            self.landmarks[name] = self.landmarks.get(name, 0) + 1
+
+        if tag == "html":
+            self.lang = attrs.get("lang")
+        elif tag == "head":
+            self._in_head = True
+        elif tag == "body":
+            self._in_head = False
+        elif tag == "meta":
+            key = (attrs.get("name") or attrs.get("property") or "").lower()
+            if key in ("description", "viewport", "robots", "og:title"):
+                self.meta[key] = (attrs.get("content") or "")[:MAX_STRING_CHARS]
+            elif "charset" in attrs:
+                self.meta["charset"] = attrs["charset"] or ""
+        elif tag in ("title", "script", "style") or tag in self.HEADINGS:
+            self._capture = tag
+            self._text = []
+            if tag == "script":
+                if attrs.get("src"):
+                    self.scripts["external"] += 1
+                    # Script ngoài trong <head> không async/defer/module chặn render
+                    if self._in_head and not ({"async", "defer"} & set(attrs)) and attrs.get("type") != "module":
+                        self.scripts["blocking"] += 1
+                    self._capture = None
+                else:
+                    self.scripts["inline"] += 1
+            elif tag == "style":
+                self.styles["inline"] += 1
+        elif tag == "link" and "stylesheet" in (attrs.get("rel") or "").lower():
+            self.styles["stylesheets"] += 1
+        elif tag == "form":
+            self.forms += 1
+        elif tag == "label":
+            self._label_depth += 1
+            if attrs.get("for"):
+                self.label_for.add(attrs["for"])
+        elif tag in self.FIELD_TAGS:
+            if tag != "input" or (attrs.get("type") or "text").lower() not in self.UNLABELED_INPUT_TYPES:
+                labeled = bool(self._label_depth or attrs.get("aria-label") or attrs.get("aria-labelledby") or attrs.get("title"))
+                self.fields.append((attrs.get("id"), labeled))
+        elif tag == "img":
+            self.images += 1
+            if "alt" not in attrs and len(self.images_missing_alt) < 20:
+                self.images_missing_alt.append((attrs.get("src") or "")[:120])
+        elif tag == "a":
+            self.links += 1
+        elif tag == "button":
+            self.buttons += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "head":
+            self._in_head = False
+        elif tag == "label" and self._label_depth:
+            self._label_depth -= 1
+        if tag != self._capture:
+            return
+        text = "".join(self._text)
+        if tag == "title":
+            self.title = " ".join(text.split())[:MAX_STRING_CHARS]
+        elif tag == "script":
+            self.scripts["inline_bytes"] += len(text.encode("utf-8"))
+        elif tag == "style":
+            self.styles["inline_bytes"] += len(text.encode("utf-8"))
+        else:
+            self.headings.append({"level": int(tag[1]), "text": " ".join(text.split())[:80]})
+        self._capture = None
+
+    def handle_data(self, data: str) -> None:
+        if self._capture is not None:
+            self._text.append(data)
+
+
+def summarize_html(html: str) -> Dict:
+    """Tóm tắt cấu trúc trang thay cho HTML thô."""
+    parser = _StructureParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # HTMLParser chịu được hầu hết HTML lỗi; nếu vẫn lỗi thì dùng phần đã đọc được
+        logger.debug("HTML summary stopped early", exc_info=True)
+
+    unlabeled = sum(1 for field_id, labeled in parser.fields if not labeled and field_id not in parser.label_for)
+    return {
+        "html_bytes": len(html.encode("utf-8")),
+        "elements": parser.elements,
+        "lang": parser.lang,
+        "title": parser.title,
+        "meta": parser.meta,
+        "landmarks": parser.landmarks,
+        "headings": parser.headings,
+        "forms": {"count": parser.forms, "fields": len(parser.fields), "unlabeled_fields": unlabeled},
+        "images": {
+            "count": parser.images,
+            "missing_alt": len(parser.images_missing_alt),
+            "missing_alt_src": parser.images_missing_alt,
+        },
+        "links": parser.links,
+        "buttons": parser.buttons,
+        "scripts": parser.scripts,
+        "styles": parser.styles,
+    }
+
+
+def _compact_issue(issue: Dict) -> Dict:
+    compact = {
+        key: issue[key]
+        for key in ("severity", "category", "device", "title", "recommendation")
+        if isinstance(issue, dict) and issue.get(key) is not None
+    }
+    if isinstance(compact.get("recommendation"), str):
+        compact["recommendation"] = compact["recommendation"][:MAX_STRING_CHARS]
+    return compact
+
+
+def _by_severity(issues: Any) -> List[Dict]:
+    issues = [_compact_issue(issue) for issue in issues or [] if isinstance(issue, dict)]
+    return sorted(issues, key=lambda issue: SEVERITY_ORDER.get(str(issue.get("severity")).lower(), len(SEVERITY_ORDER)))
+
+
+def distill_analyses(code_analysis: Dict, vision_analysis: Dict) -> Dict:
+    """Đầu vào synthesizer: điểm, metric và issue đã rút gọn (nghiêm trọng nhất trước)."""
+    return {
+        "code": {
+            "performance_score": code_analysis.get("performance_score"),
+            "accessibility_score": code_analysis.get("accessibility_score"),
+            "seo_score": code_analysis.get("seo_score"),
+            "metrics": code_analysis.get("metrics"),
+            "issues": _by_severity(code_analysis.get("issues")),
+        },
+        "vision": {
+            "overall_design_score": vision_analysis.get("overall_design_score"),
+            "responsive_quality": vision_analysis.get("responsive_quality"),
+            "ui_issues": _by_severity(vision_analysis.get("ui_issues")),
+            "positive_aspects": list(vision_analysis.get("positive_aspects") or [])[:10],
+        },
+    }
+
+
+def _longest_list(value: Any) -> Optional[List]:
+    longest = None
+    stack = [value]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            if len(node) > 1 and (longest is None or len(node) > len(longest)):
+                longest = node
+            stack.extend(node)
+    return longest
+
+
+def _truncate_strings(value: Any) -> Any:
+    if isinstance(value, str):
+        return value[:MAX_STRING_CHARS]
+    if isinstance(value, dict):
+        return {key: _truncate_strings(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_truncate_strings(item) for item in value]
+    return value
+
+
+def fit_to_budget(data: Any, budget_tokens: int) -> Tuple[Any, int]:
+    """
+    Cắt đôi danh sách dài nhất (giữ phần đầu, đã xếp quan trọng trước) cho tới khi
+    JSON gọn của `data` nằm trong `budget_tokens`. Trả về (data, số token ước lượng).
+    """
+    tokens = estimate_tokens(compact_json(data))
+    if tokens <= budget_tokens:
+        return data, tokens
+    data = json.loads(compact_json(data))
+    while tokens > budget_tokens:
+        longest = _longest_list(data)
+        if longest is None:
+            break
+        del longest[max(1, len(longest) // 2):]
+        tokens = estimate_tokens(compact_json(data))
+    if tokens > budget_tokens:
+        data = _truncate_strings(data)
+        tokens = estimate_tokens(compact_json(data))
+    if tokens > budget_tokens:
+        logger.warning("Prompt data still ~%d tokens after trimming (budget %d)", tokens, budget_tokens)
+    return data, tokens
@@ -0,0 +1,184 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models.job import Job, JobStatus
+from app.utils.config import get_fresh_settings
+
+
+def normalize_url(url: str) -> str:
+    """Chuẩn hoá URL để các biến thể tương đương dùng chung cache."""
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or "http").lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    # Bỏ fragment vì không ảnh hưởng nội dung server trả về
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def html_digest(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8", errors="replace")).hexdigest()
+
+
+def content_key(normalized_url: str, html: str, screenshot_digests: Iterable[str]) -> str:
+    """Key theo URL + HTML + SHA-256 của từng screenshot (digest trong blob store)."""
+    digest = hashlib.sha256()
+    digest.update(normalized_url.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(html.encode("utf-8", errors="replace"))
+    for screenshot_digest in screenshot_digests:
+        digest.update(b"\0")
+        digest.update(screenshot_digest.encode("ascii"))
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("url", "result", "size", "expires_at", "html_digest")
+
+    def __init__(self, url: str, result: Dict, size: int, expires_at: float, html_digest: Optional[str]):
+        self.url = url
+        self.result = result
+        self.size = size
+        self.expires_at = expires_at
+        self.html_digest = html_digest
+
+
+class ResultCache:
+    """
+    Cache `final_result` theo content key với TTL và giới hạn dung lượng (LRU).
+
+    Cache nằm trong từng process worker, chỉ là lớp nhanh phía trước bảng jobs: miss
+    ở đây thì tra `find_completed_result`/`latest_html_digest`, là các kết quả do mọi
+    worker ghi (cột content_key, html_digest). Ngoài content key, cache giữ chỉ mục
+    URL -> key mới nhất để worker đoán trước khả năng hit (`may_hit`) khi HTML không đổi.
+    """
+
+    def __init__(self, ttl_seconds: int = 6 * 3600, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_url: Dict[str, str] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if self._by_url.get(entry.url) == key:
+            del self._by_url[entry.url]
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry.result)
+
+    def may_hit(self, normalized_url: str, digest: str) -> bool:
+        """
+        HTML trùng với lần phân tích gần nhất của URL => nhiều khả năng content key
+        cũng trùng khi có screenshot. Dùng để quyết định có nên chạy LLM sớm hay không.
+        """
+        with self._lock:
+            key = self._by_url.get(normalized_url)
+            entry = self._entries.get(key) if key else None
+            return (
+                entry is not None
+                and entry.expires_at >= time.monotonic()
+                and entry.html_digest == digest
+            )
+
+    def put(self, key: str, normalized_url: str, result: Dict, html_digest: Optional[str] = None) -> None:
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(
+                normalized_url, copy.deepcopy(result), size, time.monotonic() + self.ttl_seconds, html_digest
+            )
+            self._by_url[normalized_url] = key
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            settings = get_fresh_settings()
+            _cache = ResultCache(
+                ttl_seconds=settings.RESULT_CACHE_TTL,
+                max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+            )
+        return _cache
+
+
+async def find_completed_result(key: str, ttl_seconds: int) -> Optional[Dict]:
+    """Report của job COMPLETED gần nhất có cùng content key trong TTL, do bất kỳ worker nào chạy."""
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl_seconds)
+    async with AsyncSessionLocal() as db:
+        report = await db.scalar(
+            select(Job.report)
+            .where(
+                Job.content_key == key,
+                Job.status == JobStatus.COMPLETED,
+                Job.completed_at >= cutoff,
+                Job.report.isnot(None),
+            )
+            .order_by(Job.completed_at.desc())
+            .limit(1)
+        )
+    return dict(report) if report else None
+
+
+async def latest_html_digest(target_url: str, ttl_seconds: int) -> Optional[str]:
+    """Digest HTML của lần phân tích xong gần nhất cho URL trong TTL (bản dùng chung của `may_hit`)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl_seconds)
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(Job.html_digest)
+            .where(
+                Job.target_url == target_url,
+                Job.status == JobStatus.COMPLETED,
+                Job.created_at >= cutoff,
+                Job.html_digest.isnot(None),
+            )
+            .order_by(Job.created_at.desc())
+            .limit(1)
+        )
@@ -0,0 +1,266 @@
+import gzip
+import json
+import logging
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import undefer
+
+from app.database import SessionLocal, engine
+from app.models.job import Batch, Job, JobStatus
+from app.utils.config import get_fresh_settings
+
+logger = logging.getLogger(__name__)
+
+# Thư mục screenshot tạm của phiên bản trước khi có blob store
+LEGACY_SCREENSHOT_DIR = Path(tempfile.gettempdir()) / "uiux_analyzer"
+
+# Khoá advisory để chỉ một sweeper chạy tại một thời điểm dù có nhiều worker
+SWEEP_LOCK_KEY = 0x75697578
+
+TERMINAL_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED)
+
+
+class _Archive:
+    """File JSONL.gz cho một lần sweep, chỉ được tạo khi có dòng đầu tiên."""
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = Path(directory) if directory else None
+        self.path: Optional[Path] = None
+        self.count = 0
+        self._file: Optional[IO[str]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def write(self, records: List[Dict]) -> None:
+        if self.directory is None or not records:
+            return
+        if self._file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.path = self.directory / f"jobs-{datetime.utcnow():%Y%m%dT%H%M%S}.jsonl.gz"
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        for record in records:
+            self._file.write(json.dumps(record, default=str, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.count += len(records)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _archive_record(job: Job, kind: str) -> Dict:
+    return {
+        "archived": kind,
+        "job_id": str(job.id),
+        "url": job.target_url,
+        "status": job.status.value,
+        "batch_id": str(job.batch_id) if job.batch_id else None,
+        "created_at": job.created_at,
+        "completed_at": job.completed_at,
+        "overall_score": job.overall_score,
+        "performance_score": job.performance_score,
+        "accessibility_score": job.accessibility_score,
+        "design_score": job.design_score,
+        "code_issue_count": job.code_issue_count,
+        "ui_issue_count": job.ui_issue_count,
+        "error_message": job.error_message,
+        "report": job.report if job.report is not None else job.result,
+    }
+
+
+class RetentionSweeper:
+    """
+    Áp dụng chính sách lưu trữ cho bảng jobs.
+
+    - Sau `report_days`: bỏ report đầy đủ và screenshot, giữ các cột tóm tắt.
+    - Sau `job_days`: xoá hẳn job đã xong/lỗi và batch không còn job nào.
+    - Xoá thư mục screenshot cũ (`uiux_analyzer/<job_id>`) không còn job tương ứng.
+
+    Mỗi lô `batch_size` dòng là một transaction ngắn (SKIP LOCKED) để không khoá
+    bảng lâu. Giá trị 0 tắt bước tương ứng.
+    """
+
+    def __init__(
+        self,
+        report_days: int = 0,
+        job_days: int = 0,
+        batch_size: int = 500,
+        archive_dir: Optional[str] = None,
+        legacy_dir: Path = LEGACY_SCREENSHOT_DIR,
+        dir_grace_seconds: int = 3600,
+    ):
+        self.report_days = report_days
+        self.job_days = job_days
+        self.batch_size = max(1, batch_size)
+        self.archive_dir = archive_dir
+        self.legacy_dir = Path(legacy_dir)
+        self.dir_grace_seconds = dir_grace_seconds
+
+    @classmethod
+    def from_settings(cls) -> "RetentionSweeper":
+        settings = get_fresh_settings()
+        return cls(
+            report_days=settings.RETENTION_REPORT_DAYS,
+            job_days=settings.RETENTION_JOB_DAYS,
+            batch_size=settings.RETENTION_BATCH_SIZE,
+            archive_dir=settings.RETENTION_ARCHIVE_DIR or None,
+            dir_grace_seconds=settings.BLOB_GC_GRACE_SECONDS,
+        )
+
+    def sweep(self) -> Optional[Dict[str, int]]:
+        """Chạy một lần sweep; trả về số lượng đã thu hồi, None nếu sweeper khác đang chạy."""
+        with self._sweep_lock() as acquired:
+            if not acquired:
+                return None
+
+            archive = _Archive(self.archive_dir)
+            try:
+                reclaimed = {"reports_stripped": 0, "jobs_deleted": 0, "batches_deleted": 0, "archived": 0}
+                now = datetime.utcnow()
+                # Xoá job quá hạn trước để không phải export/cập nhật report của chúng hai lần
+                if self.job_days > 0:
+                    reclaimed["jobs_deleted"] = self._delete_jobs(now - timedelta(days=self.job_days), archive)
+                    reclaimed["batches_deleted"] = self._delete_empty_batches()
+                if self.report_days > 0:
+                    reclaimed["reports_stripped"] = self._strip_reports(now - timedelta(days=self.report_days), archive)
+                reclaimed["archived"] = archive.count
+            finally:
+                archive.close()
+
+            dirs_removed, bytes_freed = self._remove_orphan_dirs()
+            reclaimed["dirs_removed"] = dirs_removed
+            reclaimed["dir_bytes_freed"] = bytes_freed
+
+        logger.info("Retention sweep reclaimed %s", reclaimed)
+        return reclaimed
+
+    @contextmanager
+    def _sweep_lock(self) -> Iterator[bool]:
+        if engine.dialect.name != "postgresql":
+            yield True
+            return
+        with engine.connect() as conn:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SWEEP_LOCK_KEY}).scalar()
+            try:
+                yield bool(acquired)
+            finally:
+                if acquired:
+                    conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SWEEP_LOCK_KEY})
+                conn.commit()
+
+    def _strip_reports(self, cutoff: datetime, archive: _Archive) -> int:
+        stripped = 0
+        while True:
+            db = SessionLocal()
+            try:
+                query = (
+                    db.query(Job)
+                    .filter(
+                        Job.status == JobStatus.COMPLETED,
+                        Job.created_at < cutoff,
+                        (Job.report.isnot(None)) | (Job.result.isnot(None)) | (Job.screenshots.isnot(None)),
+                    )
+                    .with_for_update(skip_locked=True)
+                    .limit(self.batch_size)
+                )
+                if archive.enabled:
+                    # Export cần report; không export thì không đọc cột nặng nhất
+                    query = query.options(undefer(Job.report))
+                jobs = query.all()
+                if not jobs:
+                    return stripped
+                if archive.enabled:
+                    archive.write([_archive_record(job, "report") for job in jobs])
+                for job in jobs:
+                    job.report = None
+                    job.result = None
+                    # Blob không còn được tham chiếu bị xoá bởi blob GC chạy sau sweep của worker
+                    job.screenshots = None
+                db.commit()
+                stripped += len(jobs)
+            finally:
+                db.close()
+
+    def _delete_jobs(self, cutoff: datetime, archive: _Archive) -> int:
+        deleted = 0
+        while True:
+            db = SessionLocal()
+            try:
+                query = (
+                    db.query(Job)
+                    .filter(Job.status.in_(TERMINAL_STATUSES), Job.created_at < cutoff)
+                    .with_for_update(skip_locked=True)
+                    .limit(self.batch_size)
+                )
+                if archive.enabled:
+                    jobs = query.options(undefer(Job.report)).all()
+                    archive.write([_archive_record(job, "job") for job in jobs])
+                    ids = [job.id for job in jobs]
+                else:
+                    # Không export thì chỉ cần id, không đọc report
+                    ids = [job_id for (job_id,) in query.with_entities(Job.id).all()]
+                if not ids:
+                    return deleted
+                db.query(Job).filter(Job.id.in_(ids)).delete(synchronize_session=False)
+                db.commit()
+                deleted += len(ids)
+            finally:
+                db.close()
+
+    def _delete_empty_batches(self) -> int:
+        db = SessionLocal()
+        try:
+            has_jobs = select(Job.id).where(Job.batch_id == Batch.id).exists()
+            deleted = db.query(Batch).filter(~has_jobs).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def _remove_orphan_dirs(self) -> Tuple[int, int]:
+        if not self.legacy_dir.is_dir():
+            return 0, 0
+
+        cutoff = time.time() - self.dir_grace_seconds
+        candidates: Dict[uuid.UUID, Path] = {}
+        for path in self.legacy_dir.iterdir():
+            try:
+                job_id = uuid.UUID(path.name)
+            except ValueError:
+                continue
+            if path.is_dir() and path.stat().st_mtime < cutoff:
+                candidates[job_id] = path
+
+        removed = freed = 0
+        ids = list(candidates)
+        for start in range(0, len(ids), self.batch_size):
+            chunk = ids[start:start + self.batch_size]
+            db = SessionLocal()
+            try:
+                # Thư mục vẫn còn được job tham chiếu (screenshots là đường dẫn cũ) thì giữ lại
+                referenced = {
+                    job_id
+                    for job_id, screenshots in db.query(Job.id, Job.screenshots).filter(Job.id.in_(chunk)).all()
+                    if screenshots
+                }
+            finally:
+                db.close()
+            for job_id in chunk:
+                if job_id in referenced:
+                    continue
+                path = candidates[job_id]
+                freed += sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed, freed
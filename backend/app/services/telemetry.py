@@ -0,0 +1,131 @@
+"""
+Tracing và metrics cho pipeline phân tích.
+
+Span dùng OpenTelemetry API nếu được cài; SDK/exporter do người triển khai cấu hình
+(vd. chạy qua `opentelemetry-instrument` với biến OTEL_*). Không có thì span là no-op.
+Metrics là Prometheus, đọc qua `/metrics` của API hoặc cổng riêng của worker.
+"""
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+try:
+    from opentelemetry import trace
+except ImportError:  # tracing là tuỳ chọn
+    trace = None
+
+_tracer = trace.get_tracer("uiux_analyzer") if trace is not None else None
+
+STAGE_SECONDS = Histogram(
+    "analysis_stage_seconds",
+    "Duration of each analysis pipeline stage",
+    ["stage"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+STAGE_FAILURES = Counter(
+    "analysis_stage_failures_total",
+    "Analysis stages that raised an error",
+    ["stage"],
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "analysis_queue_wait_seconds",
+    "Time from job submission to the start of its first run",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+JOB_SECONDS = Histogram(
+    "analysis_job_seconds",
+    "End-to-end job run time by outcome (completed, cached, failed)",
+    ["outcome"],
+    buckets=(1, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+LLM_TOKENS = Histogram(
+    "llm_tokens",
+    "Tokens per OpenRouter call as reported in the response usage",
+    ["agent", "kind"],
+    buckets=(100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000),
+)
+LLM_MEMO_LOOKUPS = Counter(
+    "llm_memo_lookups_total",
+    "LLM response memo lookups by result (hit, miss)",
+    ["result"],
+)
+VISION_PAYLOAD_BYTES = Histogram(
+    "vision_payload_bytes",
+    "Encoded image bytes sent in one vision analyst request",
+    buckets=(50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000),
+)
+VISION_IMAGE_TOKENS = Histogram(
+    "vision_image_tokens_estimated",
+    "Estimated image tokens in one vision analyst request",
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000),
+)
+
+# Các trường trong `usage` của OpenRouter được cộng dồn vào kết quả job
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    """Mở một span OpenTelemetry (no-op khi không cài opentelemetry)."""
+    if _tracer is None:
+        yield
+        return
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        yield
+
+
+def observe_stage(stage: str, seconds: float, failed: bool = False) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if failed:
+        STAGE_FAILURES.labels(stage).inc()
+
+
+def record_usage(agent: str, usage: Optional[Dict]) -> Dict[str, int]:
+    """Ghi metrics token từ `usage` của response; trả về phần đã chuẩn hoá để lưu vào job."""
+    if not isinstance(usage, dict):
+        return {}
+    recorded = {}
+    for field in USAGE_FIELDS:
+        value = usage.get(field)
+        if isinstance(value, (int, float)):
+            recorded[field] = int(value)
+    if "prompt_tokens" in recorded:
+        LLM_TOKENS.labels(agent, "prompt").observe(recorded["prompt_tokens"])
+    if "completion_tokens" in recorded:
+        LLM_TOKENS.labels(agent, "completion").observe(recorded["completion_tokens"])
+    return recorded
+
+
+def record_vision_payload(report: Dict) -> None:
+    VISION_PAYLOAD_BYTES.observe(report["bytes"])
+    VISION_IMAGE_TOKENS.observe(report["estimated_tokens"])
+
+
+def metrics_payload() -> bytes:
+    # Khi chạy nhiều process (uvicorn --workers) thì gộp metrics qua PROMETHEUS_MULTIPROC_DIR
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def start_metrics_server(port: int) -> None:
+    """Worker chạy process riêng nên expose metrics trên cổng của nó."""
+    if port > 0:
+        start_http_server(port)
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
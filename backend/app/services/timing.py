@@ -0,0 +1,44 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from app.services.telemetry import observe_stage, span
+
+
+class StageTimer:
+    """
+    Ghi thời điểm bắt đầu (tính từ lúc tạo timer) và thời lượng của từng stage.
+
+    Các stage có thể chạy chồng nhau nên tổng thời lượng lớn hơn thời gian thực;
+    `start` cho phép dựng lại critical path. Mỗi stage đồng thời là một span và một
+    mẫu của histogram `analysis_stage_seconds`.
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        failed = False
+        try:
+            with span(f"analysis.{name}"):
+                yield
+        except Exception:
+            # Huỷ task (CancelledError) không tính là lỗi của stage
+            failed = True
+            raise
+        finally:
+            ended = time.perf_counter()
+            self.stages[name] = {
+                "start": round(started - self._origin, 3),
+                "duration": round(ended - started, 3),
+            }
+            observe_stage(name, ended - started, failed)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._origin
+
+    def as_dict(self) -> Dict:
+        return {"total": round(self.elapsed(), 3), "stages": dict(self.stages)}
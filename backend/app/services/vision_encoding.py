@@ -0,0 +1,116 @@
+"""
+Cách encode screenshot gửi cho vision model, theo từng model.
+
+Chi phí token của ảnh phụ thuộc kích thước (không phụ thuộc số byte), còn số byte
+quyết định thời gian upload; policy cho phép chọn độ phân giải, định dạng/chất lượng,
+grayscale và cắt tile cho ảnh cao. Giá trị mặc định lấy từ VISION_*, ghi đè theo model
+bằng VISION_ENCODING_POLICIES (JSON: {"model": {"max_dimension": 768, ...}}).
+"""
+import base64
+import math
+from typing import Dict, Iterable, List, NamedTuple
+
+from app.utils.config import get_fresh_settings
+
+MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+class VisionEncoding(NamedTuple):
+    # Cạnh dài tối đa của mỗi ảnh/tile sau khi thu nhỏ (px)
+    max_dimension: int = 1024
+    format: str = "jpeg"
+    quality: int = 80
+    grayscale: bool = False
+    # Ảnh cao hơn tile_height (CSS px) được cắt thành các tile chồng nhau tile_overlap px; 0 = không cắt
+    tile_height: int = 0
+    tile_overlap: int = 120
+
+
+class VisionImage(NamedTuple):
+    """Một ảnh (hoặc tile) đã encode, cùng vị trí của nó trên trang để đổi toạ độ bbox."""
+
+    data: bytes
+    media_type: str
+    width: int
+    height: int
+    # Số CSS px ứng với 1 px ảnh, và mép trên của tile trên trang (CSS px)
+    css_scale: float
+    css_top: int
+
+    def data_url(self) -> str:
+        return f"data:{self.media_type};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def vision_encoding(model: str) -> VisionEncoding:
+    settings = get_fresh_settings()
+    policy = VisionEncoding(
+        max_dimension=settings.VISION_MAX_DIMENSION,
+        format=settings.VISION_IMAGE_FORMAT.lower(),
+        quality=settings.VISION_IMAGE_QUALITY,
+        grayscale=settings.VISION_GRAYSCALE,
+        tile_height=settings.VISION_TILE_HEIGHT,
+        tile_overlap=settings.VISION_TILE_OVERLAP,
+    )
+    overrides = settings.VISION_ENCODING_POLICIES.get(model) or {}
+    unknown = set(overrides) - set(VisionEncoding._fields)
+    if unknown:
+        raise ValueError(f"Unknown vision encoding options for {model}: {', '.join(sorted(unknown))}")
+    policy = policy._replace(**overrides)
+    if policy.format not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported vision image format: {policy.format}")
+    check_tiling(policy, model)
+    return policy
+
+
+def check_tiling(policy: VisionEncoding, model: str) -> None:
+    """Vùng chồng phải nhỏ hơn chiều cao tile, nếu không tile sau không tiến xuống trang."""
+    if policy.tile_height < 0 or policy.tile_overlap < 0:
+        raise ValueError(f"Vision tile_height and tile_overlap for {model} must not be negative")
+    if policy.tile_height and policy.tile_overlap >= policy.tile_height:
+        raise ValueError(
+            f"Vision tile_overlap ({policy.tile_overlap}px) must be smaller than tile_height "
+            f"({policy.tile_height}px) for {model}; check VISION_TILE_OVERLAP, VISION_TILE_HEIGHT "
+            f"and VISION_ENCODING_POLICIES"
+        )
+
+
+def estimate_image_tokens(model: str, width: int, height: int) -> int:
+    """Ước lượng token cho một ảnh theo cách tính công bố của từng nhà cung cấp."""
+    provider = model.split("/", 1)[0]
+    if provider == "openai":
+        # Thu về trong 2048x2048, cạnh ngắn tối đa 768, rồi 170 token mỗi ô 512px + 85
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+    if provider == "google":
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    # Anthropic (và mặc định): ảnh bị thu về cạnh dài 1568, ~(w*h)/750 token
+    scale = min(1.0, 1568 / max(width, height))
+    return math.ceil(width * scale * height * scale / 750)
+
+
+def payload_report(model: str, images: Dict[str, Iterable[VisionImage]]) -> Dict:
+    """Số ảnh, byte (thô và base64) và token ước lượng của phần ảnh trong request vision."""
+    by_device: Dict[str, Dict] = {}
+    for device, device_images in images.items():
+        device_images: List[VisionImage] = list(device_images)
+        raw = sum(len(image.data) for image in device_images)
+        by_device[device] = {
+            "images": len(device_images),
+            "bytes": raw,
+            "estimated_tokens": sum(estimate_image_tokens(model, image.width, image.height) for image in device_images),
+        }
+    total_bytes = sum(entry["bytes"] for entry in by_device.values())
+    return {
+        "model": model,
+        "images": sum(entry["images"] for entry in by_device.values()),
+        "bytes": total_bytes,
+        # base64 tăng 4/3 kích thước
+        "base64_bytes": 4 * math.ceil(total_bytes / 3),
+        "estimated_tokens": sum(entry["estimated_tokens"] for entry in by_device.values()),
+        "by_device": by_device,
+    }
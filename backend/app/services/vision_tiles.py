@@ -0,0 +1,147 @@
+"""
+Chia ảnh full-page thành nhiều lần gọi vision và gộp kết quả.
+
+- Lần gọi chính: tile đầu (màn hình đầu) của mọi thiết bị -> điểm, đánh giá chung, issue.
+- Các tile còn lại được nhóm theo thiết bị thành batch, phần trên trang trước, để khi
+  hết ngân sách token/thời gian thì phần bị bỏ là cuối trang.
+- bbox model trả về (px trong ảnh được đánh số) được đổi sang CSS px trên trang;
+  khi có batch tile, issue trùng do vùng chồng nhau giữa hai tile bị gộp.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.services.llm_schemas import SEVERITIES
+from app.services.vision_encoding import VisionImage, estimate_image_tokens
+
+
+class ImageRef(NamedTuple):
+    device: str
+    # Thứ tự tile trong thiết bị (0 = màn hình đầu)
+    index: int
+    image: VisionImage
+
+
+# (thiết bị, thứ tự tile) của ảnh chứa một issue
+TileKey = Tuple[str, int]
+
+
+class TileBatch(NamedTuple):
+    images: List[ImageRef]
+    estimated_tokens: int
+
+
+def plan_tiles(
+    screenshots: Dict[str, List[VisionImage]], model: str, batch_size: int
+) -> Tuple[List[ImageRef], List[TileBatch]]:
+    """Trả về (ảnh cho lần gọi chính, các batch tile còn lại theo thứ tự ưu tiên)."""
+    overview = [ImageRef(device, 0, images[0]) for device, images in screenshots.items() if images]
+    batches: List[TileBatch] = []
+    batch_size = max(1, batch_size)
+    for device, images in screenshots.items():
+        rest = [ImageRef(device, index, image) for index, image in enumerate(images) if index > 0]
+        for start in range(0, len(rest), batch_size):
+            chunk = rest[start:start + batch_size]
+            tokens = sum(estimate_image_tokens(model, ref.image.width, ref.image.height) for ref in chunk)
+            batches.append(TileBatch(chunk, tokens))
+    batches.sort(key=lambda batch: batch.images[0].index)
+    return overview, batches
+
+
+def image_label(number: int, ref: ImageRef) -> str:
+    return (
+        f"Image {number}: {ref.device}, part {ref.index + 1} "
+        f"(starts {ref.image.css_top}px from the top of the page), {ref.image.width}x{ref.image.height}px"
+    )
+
+
+def resolve_image(issue: Dict, refs: Sequence[ImageRef]) -> Optional[ImageRef]:
+    """Ảnh chứa issue theo trường `image` (đánh số từ 1)."""
+    number = issue.get("image")
+    if isinstance(number, int) and 1 <= number <= len(refs):
+        return refs[number - 1]
+    # Model quên số ảnh: chỉ đoán được khi thiết bị đó có đúng một ảnh trong request
+    candidates = [r for r in refs if r.device == issue.get("device")] or list(refs)
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def tile_source(issue: Dict, refs: Sequence[ImageRef]) -> Optional[TileKey]:
+    ref = resolve_image(issue, refs)
+    return (ref.device, ref.index) if ref is not None else None
+
+
+def remap_issue(issue: Dict, refs: Sequence[ImageRef]) -> Dict:
+    """Đổi `location` từ px của ảnh số `image` sang CSS px tính từ đầu trang."""
+    ref = resolve_image(issue, refs)
+    issue = dict(issue)
+    issue.pop("image", None)
+    if ref is None:
+        issue["location"] = None
+        return issue
+
+    issue["device"] = ref.device
+    location = issue.get("location")
+    if isinstance(location, dict):
+        scale = ref.image.css_scale
+        try:
+            issue["location"] = {
+                "x": round(float(location.get("x", 0)) * scale),
+                "y": round(float(location.get("y", 0)) * scale + ref.image.css_top),
+                "width": round(float(location.get("width", 0)) * scale),
+                "height": round(float(location.get("height", 0)) * scale),
+            }
+        except (TypeError, ValueError):
+            issue["location"] = None
+    return issue
+
+
+def _normalize_title(title: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", str(title or "").lower()).strip()
+
+
+def _iou(a: Dict, b: Dict) -> float:
+    left, top = max(a["x"], b["x"]), max(a["y"], b["y"])
+    right = min(a["x"] + a["width"], b["x"] + b["width"])
+    bottom = min(a["y"] + a["height"], b["y"] + b["height"])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    union = a["width"] * a["height"] + b["width"] * b["height"] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def _same_issue(a: Dict, b: Dict) -> bool:
+    if a.get("device") != b.get("device"):
+        return False
+    same_title = _normalize_title(a.get("title")) == _normalize_title(b.get("title"))
+    loc_a, loc_b = a.get("location"), b.get("location")
+    if not loc_a or not loc_b:
+        return same_title and not loc_a and not loc_b
+    overlap = _iou(loc_a, loc_b)
+    # Cùng tiêu đề chỉ cần chồng một phần; khác tiêu đề phải cùng loại và gần như trùng vùng
+    if same_title:
+        return overlap >= 0.2
+    return a.get("category") == b.get("category") and overlap >= 0.5
+
+
+def dedupe_issues(tagged: List[Tuple[Optional[TileKey], Dict]]) -> List[Dict]:
+    """
+    Gộp issue bị báo hai lần do vùng chồng nhau giữa các tile: chỉ so issue đến từ hai
+    tile khác nhau (issue trong cùng một ảnh là các vấn đề riêng). Giữ thứ tự ban đầu,
+    bản trùng có mức độ nghiêm trọng cao hơn thay vào chỗ bản đã giữ.
+    """
+    rank = {severity: position for position, severity in enumerate(SEVERITIES)}
+    kept: List[Tuple[Optional[TileKey], Dict]] = []
+    for source, issue in tagged:
+        match = None
+        if source is not None:
+            match = next(
+                (
+                    position
+                    for position, (kept_source, existing) in enumerate(kept)
+                    if kept_source is not None and kept_source != source and _same_issue(existing, issue)
+                ),
+                None,
+            )
+        if match is None:
+            kept.append((source, issue))
+        elif rank.get(issue.get("severity"), len(rank)) < rank.get(kept[match][1].get("severity"), len(rank)):
+            kept[match] = (source, issue)
+    return [issue for _, issue in kept]
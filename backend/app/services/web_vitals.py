@@ -0,0 +1,163 @@
+"""
+Đo FCP, LCP, CLS, TBT và resource timing ngay trong Chromium bằng PerformanceObserver.
+
+Không tải script nào từ mạng: OBSERVER_SCRIPT được cài bằng `add_init_script` trước khi
+điều hướng, COLLECT_SCRIPT đọc kết quả sau khi trang load. Kết quả có dạng giống report
+Lighthouse (`categories`, `audits`) để phần còn lại của pipeline không phải đổi.
+"""
+import math
+from typing import Dict, Optional
+
+# Chạy trước mọi script của trang (chỉ ở frame chính) và gom entry từ đầu quá trình load
+OBSERVER_SCRIPT = """
+(() => {
+    if (window !== window.top || window.__uiuxVitals) return;
+    const vitals = window.__uiuxVitals = { fcp: null, lcp: null, lcpElement: null, shifts: [], longTasks: [] };
+    const observe = (type, callback) => {
+        try {
+            new PerformanceObserver((list) => list.getEntries().forEach(callback)).observe({ type, buffered: true });
+        } catch (e) {}
+    };
+    observe('paint', (entry) => {
+        if (entry.name === 'first-contentful-paint') vitals.fcp = entry.startTime;
+    });
+    observe('largest-contentful-paint', (entry) => {
+        vitals.lcp = entry.startTime;
+        vitals.lcpElement = entry.element ? entry.element.tagName.toLowerCase() : null;
+    });
+    observe('layout-shift', (entry) => {
+        if (!entry.hadRecentInput) vitals.shifts.push([entry.startTime, entry.value]);
+    });
+    observe('longtask', (entry) => vitals.longTasks.push([entry.startTime, entry.duration]));
+})();
+"""
+
+COLLECT_SCRIPT = """
+() => {
+    const vitals = window.__uiuxVitals || { fcp: null, lcp: null, lcpElement: null, shifts: [], longTasks: [] };
+    if (vitals.fcp === null) {
+        const paint = performance.getEntriesByName('first-contentful-paint')[0];
+        if (paint) vitals.fcp = paint.startTime;
+    }
+
+    // CLS: session window lớn nhất (các shift cách nhau < 1s, cửa sổ tối đa 5s)
+    let cls = 0, session = 0, first = 0, last = 0;
+    for (const [time, value] of vitals.shifts) {
+        if (session && time - last < 1000 && time - first < 5000) {
+            session += value;
+        } else {
+            session = value;
+            first = time;
+        }
+        last = time;
+        cls = Math.max(cls, session);
+    }
+
+    // TBT: phần vượt 50ms của các long task sau FCP
+    let tbt = 0;
+    for (const [time, duration] of vitals.longTasks) {
+        if (time >= (vitals.fcp || 0)) tbt += Math.max(0, duration - 50);
+    }
+
+    const nav = performance.getEntriesByType('navigation')[0];
+    const resources = performance.getEntriesByType('resource');
+    const byType = {};
+    let transferSize = 0;
+    for (const r of resources) {
+        const type = r.initiatorType || 'other';
+        const bucket = byType[type] || (byType[type] = { count: 0, transferSize: 0 });
+        bucket.count += 1;
+        bucket.transferSize += r.transferSize || 0;
+        transferSize += r.transferSize || 0;
+    }
+    const largest = resources
+        .slice()
+        .sort((a, b) => (b.transferSize || 0) - (a.transferSize || 0))
+        .slice(0, 10)
+        .map((r) => ({ url: r.name, type: r.initiatorType, transferSize: r.transferSize, duration: Math.round(r.duration) }));
+
+    return {
+        fcp: vitals.fcp,
+        lcp: vitals.lcp,
+        lcpElement: vitals.lcpElement,
+        cls,
+        tbt,
+        longTasks: vitals.longTasks.length,
+        ttfb: nav ? nav.responseStart : null,
+        domContentLoaded: nav ? nav.domContentLoadedEventEnd : null,
+        load: nav ? nav.loadEventEnd : null,
+        documentSize: nav ? nav.transferSize : null,
+        resources: { count: resources.length, transferSize, byType, largest },
+    };
+}
+"""
+
+# Điểm kiểm soát (p10, median) và trọng số theo Lighthouse 10, cấu hình desktop.
+# Speed Index không đo được bằng PerformanceObserver nên trọng số được chuẩn hoá lại
+SCORING = {
+    "first-contentful-paint": (934, 1600, 0.10),
+    "largest-contentful-paint": (1200, 2400, 0.25),
+    "total-blocking-time": (150, 350, 0.30),
+    "cumulative-layout-shift": (0.1, 0.25, 0.25),
+}
+
+_INVERSE_ERFC_ONE_FIFTH = 0.9061938024368232
+
+# Thời gian tối đa để đọc số đo từ page (chỉ là đọc buffer, không chờ thêm sự kiện)
+COLLECT_TIMEOUT_SECONDS = 5.0
+
+
+def log_normal_score(value: float, p10: float, median: float) -> float:
+    """Điểm 0..1 theo đường log-normal của Lighthouse: p10 -> 0.9, median -> 0.5."""
+    if value <= 0:
+        return 1.0
+    standardized = math.log(value / median) * _INVERSE_ERFC_ONE_FIFTH / -math.log(p10 / median)
+    return max(0.0, min(1.0, (1 - math.erf(standardized)) / 2))
+
+
+def performance_score(audits: Dict[str, Dict]) -> Optional[float]:
+    weighted = total_weight = 0.0
+    for audit_id, (p10, median, weight) in SCORING.items():
+        score = audits.get(audit_id, {}).get("score")
+        if score is None:
+            continue
+        weighted += score * weight
+        total_weight += weight
+    if not total_weight:
+        return None
+    return round(weighted / total_weight, 2)
+
+
+def to_report(raw: Dict) -> Dict:
+    """Chuyển số đo thô của COLLECT_SCRIPT thành report dạng Lighthouse."""
+    values = {
+        "first-contentful-paint": raw.get("fcp"),
+        "largest-contentful-paint": raw.get("lcp"),
+        "total-blocking-time": raw.get("tbt"),
+        "cumulative-layout-shift": raw.get("cls"),
+        "server-response-time": raw.get("ttfb"),
+    }
+    audits: Dict[str, Dict] = {}
+    for audit_id, value in values.items():
+        if value is None:
+            continue
+        audit = {"numericValue": round(value, 4 if audit_id == "cumulative-layout-shift" else 1)}
+        if audit_id in SCORING:
+            p10, median, _ = SCORING[audit_id]
+            audit["score"] = round(log_normal_score(value, p10, median), 2)
+        audits[audit_id] = audit
+    if raw.get("lcpElement") and "largest-contentful-paint" in audits:
+        audits["largest-contentful-paint"]["element"] = raw["lcpElement"]
+
+    return {
+        "source": "native",
+        "categories": {"performance": {"score": performance_score(audits)}},
+        "audits": audits,
+        "timing": {
+            "domContentLoaded": raw.get("domContentLoaded"),
+            "load": raw.get("load"),
+            "documentSize": raw.get("documentSize"),
+            "longTasks": raw.get("longTasks"),
+        },
+        "resources": raw.get("resources") or {},
+    }
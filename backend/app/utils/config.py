@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Any, Dict
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
@@ -20,6 +21,116 @@ class Settings(BaseSettings):
     VISION_ANALYST_MODEL: str = "anthropic/claude-3.5-sonnet"
     SYNTHESIZER_MODEL: str = "anthropic/claude-3.5-sonnet"
 
+    # Browser pool
+    # Số Chromium được khởi động sẵn khi worker (hoặc worker nhúng) bắt đầu
+    BROWSER_POOL_SIZE: int = 2
+    BROWSER_POOL_MAX_CONCURRENCY: int = 4
+    BROWSER_POOL_MAX_USES: int = 50
+    # Context dùng chung theo origin trong một batch được giữ lại bao lâu sau job cuối
+    BROWSER_POOL_SHARED_IDLE_SECONDS: float = 30.0
+
+    # Metrics hiệu năng: lệnh Lighthouse CLI cài sẵn (vd. "node_modules/.bin/lighthouse");
+    # rỗng = đo bằng PerformanceObserver trong page
+    LIGHTHOUSE_CLI: str = ""
+    LIGHTHOUSE_TIMEOUT_SECONDS: float = 60.0
+
+    # Screenshots: comma-separated device presets and settle detection
+    SCREENSHOT_DEVICES: str = "desktop,tablet,mobile"
+    SCREENSHOT_SETTLE_QUIET_MS: int = 500
+    SCREENSHOT_SETTLE_TIMEOUT_MS: int = 3000
+    # Biến thể tạo thêm ngoài PNG (webp, avif) và cạnh dài thumbnail (0 = không tạo)
+    SCREENSHOT_VARIANT_FORMATS: str = "webp"
+    SCREENSHOT_THUMB_SIZE: int = 256
+    # Chụp cả trang (giới hạn chiều cao, CSS px) và phân tích vision theo tile
+    SCREENSHOT_FULL_PAGE: bool = False
+    SCREENSHOT_MAX_PAGE_HEIGHT: int = 12000
+    # Số process xử lý ảnh (resize/encode) dùng chung cho mọi job
+    IMAGE_POOL_WORKERS: int = 2
+
+    # Ảnh gửi vision model (xem app/services/vision_encoding.py): jpeg | webp | png.
+    # Ghi đè theo model bằng JSON, vd. {"openai/gpt-4o": {"max_dimension": 768, "format": "webp"}}
+    VISION_MAX_DIMENSION: int = 1024
+    VISION_IMAGE_FORMAT: str = "jpeg"
+    VISION_IMAGE_QUALITY: int = 80
+    VISION_GRAYSCALE: bool = False
+    VISION_TILE_HEIGHT: int = 0
+    VISION_TILE_OVERLAP: int = 120
+    VISION_ENCODING_POLICIES: Dict[str, Dict[str, Any]] = {}
+    # Tile ngoài màn hình đầu: số ảnh mỗi request, số request song song và ngân sách mỗi job
+    # (token ảnh ước lượng, 0 = không giới hạn; giây tính từ lúc bắt đầu gọi vision)
+    VISION_TILE_BATCH_SIZE: int = 4
+    VISION_TILE_CONCURRENCY: int = 2
+    VISION_TOKEN_BUDGET: int = 24000
+    VISION_TIME_BUDGET_SECONDS: float = 150.0
+
+    # Screenshot blob store: local | s3
+    BLOB_STORE_BACKEND: str = "local"
+    BLOB_STORE_PATH: str = str(BACKEND_DIR / "data" / "blobs")
+    BLOB_STORE_S3_BUCKET: str = ""
+    BLOB_STORE_S3_PREFIX: str = "blobs/"
+    BLOB_STORE_S3_ENDPOINT_URL: str | None = None
+    # Blob mới hơn khoảng này không bị GC (job đang chạy chưa kịp lưu reference)
+    BLOB_GC_GRACE_SECONDS: int = 3600
+
+    # Job queue / worker
+    WORKER_CONCURRENCY: int = 4
+    WORKER_POLL_INTERVAL: float = 1.0
+    WORKER_HEARTBEAT_INTERVAL: float = 15.0
+    JOB_STALE_AFTER: int = 300
+    JOB_MAX_ATTEMPTS: int = 3
+    # > 0 để API tự chạy một worker trong cùng process (tiện khi dev)
+    EMBEDDED_WORKER_CONCURRENCY: int = 0
+    # Cổng Prometheus /metrics của worker chạy riêng (0 = tắt)
+    WORKER_METRICS_PORT: int = 0
+
+    # Batch API: số URL tối đa mỗi request
+    BATCH_MAX_URLS: int = 1000
+
+    # Retention (0 = giữ mãi): sau REPORT_DAYS bỏ report đầy đủ, giữ tóm tắt;
+    # sau JOB_DAYS xoá hẳn job. ARCHIVE_DIR khác rỗng thì export JSONL.gz trước khi xoá
+    RETENTION_REPORT_DAYS: int = 0
+    RETENTION_JOB_DAYS: int = 0
+    RETENTION_BATCH_SIZE: int = 500
+    RETENTION_ARCHIVE_DIR: str = ""
+    # Worker chạy sweeper mỗi khoảng này (giây), 0 = chỉ chạy qua app.maintenance
+    RETENTION_SWEEP_INTERVAL: int = 3600
+
+    # Result cache: tra theo content_key trong bảng jobs (dùng chung mọi worker);
+    # MAX_BYTES là giới hạn của bản sao trong từng process
+    RESULT_CACHE_TTL: int = 6 * 3600
+    RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    # > 0: POST /analyze trả luôn kết quả của job cùng URL hoàn thành trong khoảng này (giây),
+    # không kiểm tra trang có đổi không. 0 = tắt, mọi request đều qua worker
+    URL_RESULT_REUSE_SECONDS: int = 0
+
+    # Shared aiohttp connection pool
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 32
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_KEEPALIVE_TIMEOUT: float = 30.0
+
+    # LLM request governor
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_REQUESTS_PER_MINUTE: float = 60
+    LLM_MAX_RETRIES: int = 4
+    LLM_BACKOFF_BASE: float = 1.0
+    LLM_BACKOFF_MAX: float = 60.0
+    LLM_BREAKER_THRESHOLD: int = 5
+    LLM_BREAKER_RESET: float = 60.0
+
+    # Ngân sách token đầu vào của prompt (ước lượng bằng tokenizer cục bộ);
+    # PROMPT_TOKEN_BUDGETS ghi đè theo model: "model=tokens,model=tokens"
+    PROMPT_TOKEN_BUDGET: int = 12000
+    PROMPT_TOKEN_BUDGETS: str = ""
+
+    # Stream code/vision analyst responses (SSE) and save issues as they arrive
+    LLM_STREAMING: bool = True
+
+    # LLM response memo: memory | sqlite | none
+    LLM_MEMO_BACKEND: str = "memory"
+    LLM_MEMO_PATH: str = str(BACKEND_DIR / ".cache" / "llm_memo.sqlite3")
+    LLM_MEMO_MAX_ENTRIES: int = 1000
+
     class Config:
         env_file = str(ENV_FILE)
         env_file_encoding = "utf-8"
@@ -0,0 +1,189 @@
+"""
+Worker chạy job phân tích từ hàng đợi Postgres.
+
+    python -m app.worker --concurrency 8
+
+Mỗi worker chạy nhiều job đồng thời trên một event loop và có thể chạy nhiều
+worker trên nhiều máy, độc lập với API.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+ENV_FILE = Path(__file__).parent.parent / ".env"
+load_dotenv(ENV_FILE, override=True)
+
+from app import maintenance
+from app.database import async_engine
+from app.services import job_queue
+from app.services.analyzer import run_analysis_task
+from app.services.browser_pool import close_browser_pool, warm_up_browser_pool
+from app.services.http_client import close_http_session
+from app.services.image_processing import shutdown_image_executor
+from app.services.telemetry import start_metrics_server
+from app.utils.config import get_fresh_settings
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    def __init__(
+        self,
+        concurrency: int,
+        poll_interval: float = 1.0,
+        heartbeat_interval: float = 15.0,
+        stale_after: int = 300,
+        max_attempts: int = 3,
+        sweep_interval: float = 0,
+        worker_id: Optional[str] = None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.sweep_interval = sweep_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    @classmethod
+    def from_settings(cls, concurrency: Optional[int] = None) -> "Worker":
+        settings = get_fresh_settings()
+        return cls(
+            concurrency=concurrency or settings.WORKER_CONCURRENCY,
+            poll_interval=settings.WORKER_POLL_INTERVAL,
+            heartbeat_interval=settings.WORKER_HEARTBEAT_INTERVAL,
+            stale_after=settings.JOB_STALE_AFTER,
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+            sweep_interval=settings.RETENTION_SWEEP_INTERVAL,
+        )
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _spawn(self, job_id: str, target_url: str, batch_id: Optional[str] = None) -> None:
+        task = asyncio.create_task(run_analysis_task(job_id, target_url, self.worker_id, batch_id))
+        self._running[job_id] = task
+
+        def _done(_):
+            self._running.pop(job_id, None)
+            self._wakeup.set()
+
+        task.add_done_callback(_done)
+
+    async def _heartbeat_loop(self) -> None:
+        last_reclaim = 0.0
+        while not self._stopping.is_set():
+            try:
+                await asyncio.to_thread(job_queue.heartbeat, self.worker_id, list(self._running))
+                if time.monotonic() - last_reclaim >= self.stale_after / 2:
+                    last_reclaim = time.monotonic()
+                    reclaimed = await asyncio.to_thread(
+                        job_queue.reclaim_stale_jobs, self.stale_after, self.max_attempts
+                    )
+                    if reclaimed:
+                        logger.warning("Reclaimed %d stale jobs", reclaimed)
+                        self._wakeup.set()
+            except Exception:
+                logger.exception("Heartbeat failed")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sweep_loop(self) -> None:
+        """
+        Retention sweep định kỳ rồi xoá blob screenshot không còn job nào tham chiếu;
+        khoá advisory đảm bảo chỉ một worker sweep mỗi lúc.
+        """
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.sweep_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.to_thread(maintenance.sweep, with_gc=True)
+            except Exception:
+                logger.exception("Retention sweep failed")
+
+    async def run(self) -> None:
+        logger.info("Worker %s started (concurrency=%d)", self.worker_id, self.concurrency)
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        background = [heartbeat_task]
+        if self.sweep_interval > 0:
+            background.append(asyncio.create_task(self._sweep_loop()))
+        try:
+            while not self._stopping.is_set():
+                self._wakeup.clear()
+                free = self.concurrency - len(self._running)
+                claimed = []
+                if free > 0:
+                    try:
+                        claimed = await asyncio.to_thread(job_queue.claim_jobs, self.worker_id, free)
+                    except Exception:
+                        logger.exception("Failed to claim jobs")
+                    for job_id, target_url, batch_id in claimed:
+                        self._spawn(job_id, target_url, batch_id)
+
+                # Còn slot và vừa claim đủ thì claim tiếp ngay, ngược lại chờ
+                if claimed and len(claimed) == free:
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._running:
+                logger.info("Waiting for %d running jobs", len(self._running))
+                await asyncio.gather(*self._running.values(), return_exceptions=True)
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            logger.info("Worker %s stopped", self.worker_id)
+
+
+async def _main(concurrency: Optional[int]) -> None:
+    worker = Worker.from_settings(concurrency)
+    start_metrics_server(get_fresh_settings().WORKER_METRICS_PORT)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:
+            # Windows không hỗ trợ add_signal_handler
+            pass
+    try:
+        await warm_up_browser_pool()
+        await worker.run()
+    finally:
+        await close_browser_pool()
+        await close_http_session()
+        shutdown_image_executor()
+        await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run analysis jobs from the Postgres queue")
+    parser.add_argument("--concurrency", type=int, default=None, help="Max jobs running at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    asyncio.run(_main(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Kiểm tra AIAgentService._post_chat dùng lại kết nối keep-alive: chạy stub
+`/chat/completions` cục bộ, gọi nhiều lần (tuần tự rồi song song) và đếm số kết nối TCP
+(peername khác nhau) mà stub nhận được. So với cách cũ mở ClientSession mỗi request.
+
+    python -m benchmarks.bench_connection_reuse --calls 20 --concurrency 4
+
+Exit code 1 nếu gọi tuần tự dùng quá 2 kết nối hoặc gọi song song dùng nhiều kết nối
+hơn số request đồng thời.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+# Governor không được làm chậm phép đo
+os.environ["LLM_REQUESTS_PER_MINUTE"] = "100000"
+os.environ["LLM_MEMO_BACKEND"] = "none"
+
+import aiohttp
+from aiohttp import web
+
+from app.services.ai_agents import AIAgentService
+from app.services.http_client import close_http_session
+from benchmarks.bench_load import _free_port, start_site
+from benchmarks.stub_openrouter import StubConfig, create_stub_app
+
+PAYLOAD = {"model": "stub/model", "messages": [{"role": "user", "content": "ping"}], "temperature": 0.0}
+
+
+def counting_stub(config: StubConfig, peers: set) -> web.Application:
+    app = create_stub_app(config)
+
+    @web.middleware
+    async def record_peer(request: web.Request, handler):
+        peers.add(request.transport.get_extra_info("peername"))
+        return await handler(request)
+
+    app.middlewares.append(record_peer)
+    return app
+
+
+async def legacy_post(base_url: str) -> None:
+    """_post_chat trước khi có session dùng chung: một ClientSession (kết nối mới) mỗi request."""
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{base_url}/chat/completions", json=PAYLOAD) as response:
+            response.raise_for_status()
+            await response.json()
+
+
+async def measure(label: str, call, calls: int, concurrency: int, peers: set) -> dict:
+    peers.clear()
+    started = time.perf_counter()
+    for _ in range(calls):
+        await call()
+    sequential_seconds = time.perf_counter() - started
+    sequential_connections = len(peers)
+
+    peers.clear()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            await call()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(calls)))
+    return {
+        "client": label,
+        "sequential": {"connections": sequential_connections, "ms_per_call": round(sequential_seconds / calls * 1000, 2)},
+        "concurrent": {"connections": len(peers), "seconds": round(time.perf_counter() - started, 3)},
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    peers: set = set()
+    port = _free_port()
+    runner = await start_site(counting_stub(StubConfig(latency_ms=args.latency_ms, jitter=0, issues=1), peers), port)
+    base_url = f"http://127.0.0.1:{port}/api/v1"
+    os.environ["OPENROUTER_BASE_URL"] = base_url
+    service = AIAgentService(memo=None)
+    try:
+        shared = await measure(
+            "shared_session", lambda: service._post_chat("bench", PAYLOAD, 30), args.calls, args.concurrency, peers
+        )
+        legacy = await measure("session_per_call", lambda: legacy_post(base_url), args.calls, args.concurrency, peers)
+    finally:
+        await close_http_session()
+        await runner.cleanup()
+    return {"calls": args.calls, "concurrency": args.concurrency, "results": [shared, legacy]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Stub latency per call")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    shared = results["results"][0]
+    violations = []
+    if shared["sequential"]["connections"] > 2:
+        violations.append(f"sequential calls used {shared['sequential']['connections']} connections")
+    if shared["concurrent"]["connections"] > args.concurrency:
+        violations.append(f"concurrent calls used {shared['concurrent']['connections']} connections")
+    results["violations"] = violations
+    print(json.dumps(results, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
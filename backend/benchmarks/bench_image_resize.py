@@ -0,0 +1,143 @@
+"""
+So sánh xử lý screenshot 1920x1080: đường cũ (LANCZOS trên ảnh gốc, chạy trong
+event loop) với đường mới (reduce() + LANCZOS trong process pool).
+
+    python -m benchmarks.bench_image_resize --iterations 20 --concurrency 8
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+from PIL import Image, ImageDraw
+
+from app.services.image_processing import downscale_png
+
+MAX_DIMENSION = 512
+
+
+def make_capture(width: int = 1920, height: int = 1080, seed: int = 0) -> bytes:
+    """Ảnh giả lập trang web: nền gradient, khối màu, dòng 'chữ' và một vùng ảnh nhiễu."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(img)
+    for y in range(height):
+        shade = 230 + int(25 * y / height)
+        draw.line([(0, y), (width, y)], fill=(shade, shade, 255))
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(80, 600), rng.randrange(20, 300)
+        draw.rectangle([x, y, x + w, y + h], fill=tuple(rng.randrange(256) for _ in range(3)))
+    for row in range(0, height, 22):
+        x = 40
+        while x < width - 200:
+            word = rng.randrange(20, 90)
+            draw.rectangle([x, row + 6, x + word, row + 14], fill=(40, 40, 40))
+            x += word + 8
+    hero = Image.effect_noise((640, 360), 60).convert("RGB")
+    img.paste(hero, (1200, 120))
+
+    output = io.BytesIO()
+    img.save(output, "PNG")
+    return output.getvalue()
+
+
+def legacy_downscale(data: bytes, max_dimension: int) -> bytes:
+    """Đường xử lý trước đây trong DataCollector._capture_screenshots."""
+    img = Image.open(io.BytesIO(data))
+    if img.width > max_dimension or img.height > max_dimension:
+        ratio = min(max_dimension / img.width, max_dimension / img.height)
+        img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    img.save(output, "PNG", optimize=True)
+    return output.getvalue()
+
+
+def time_calls(func, data: bytes, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func(data, MAX_DIMENSION)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "mean_ms": round(statistics.mean(samples), 2),
+        "median_ms": round(statistics.median(samples), 2),
+        "min_ms": round(min(samples), 2),
+    }
+
+
+async def measure_loop(data: bytes, concurrency: int, executor) -> dict:
+    """Chạy `concurrency` lần xử lý cùng lúc và đo độ trễ tối đa của event loop."""
+    loop = asyncio.get_running_loop()
+    max_lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal max_lag
+        while not done.is_set():
+            expected = loop.time() + 0.005
+            await asyncio.sleep(0.005)
+            max_lag = max(max_lag, loop.time() - expected)
+
+    async def inline():
+        legacy_downscale(data, MAX_DIMENSION)
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)
+    started = time.perf_counter()
+    if executor is None:
+        await asyncio.gather(*(inline() for _ in range(concurrency)))
+    else:
+        await asyncio.gather(
+            *(loop.run_in_executor(executor, downscale_png, data, MAX_DIMENSION) for _ in range(concurrency))
+        )
+    wall = time.perf_counter() - started
+    done.set()
+    await tick_task
+    return {"wall_ms": round(wall * 1000, 1), "max_loop_lag_ms": round(max_lag * 1000, 1)}
+
+
+async def run(iterations: int, concurrency: int, workers: int) -> dict:
+    data = make_capture()
+    legacy_out = legacy_downscale(data, MAX_DIMENSION)
+    new_out = downscale_png(data, MAX_DIMENSION)
+
+    results = {
+        "capture": {"width": 1920, "height": 1080, "png_bytes": len(data)},
+        "per_call": {
+            "legacy": time_calls(legacy_downscale, data, iterations),
+            "reduce_lanczos": time_calls(downscale_png, data, iterations),
+        },
+        "output_bytes": {"legacy": len(legacy_out), "reduce_lanczos": len(new_out)},
+    }
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Khởi động process trước để không tính chi phí spawn
+        await asyncio.get_running_loop().run_in_executor(executor, downscale_png, data, MAX_DIMENSION)
+        results["event_loop"] = {
+            "concurrency": concurrency,
+            "legacy_inline": await measure_loop(data, concurrency, None),
+            "process_pool": await measure_loop(data, concurrency, executor),
+            "workers": workers,
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.iterations, args.concurrency, args.workers)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Fuzz và benchmark việc lấy JSON từ output model: parser cũ (json.loads -> regex fence
+-> đếm ngoặc từng ký tự) so với app.services.json_extract (có/không orjson).
+
+    python -m benchmarks.bench_json_extraction --issues 150 --iterations 50 --fuzz 2000
+
+Fuzz kiểm tra: không bao giờ ném lỗi ngoài JSONExtractionError; các biến thể bọc
+(fence, văn bản trước/sau, dấu phẩy thừa) cho lại đúng object gốc; response bị cắt
+cho object có danh sách issue là tiền tố của danh sách gốc. Exit code 1 nếu vi phạm.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+from app.services import json_extract
+from app.services.json_extract import JSONExtractionError, extract_json
+
+# Nội dung dễ làm parser lệch: ngoặc và fence trong chuỗi, escape, unicode
+TRICKY_TEXT = [
+    'Use `a { color: red }` instead of inline styles',
+    'Wrap the handler: `() => { return {} }`',
+    'Replace "click here" links with descriptive text',
+    'Path C:\\\\assets\\\\hero.png is 2.4 MB',
+    'Example:\n```css\n.btn { padding: 8px }\n```',
+    'Nút "Đăng ký" có độ tương phản 2.1:1 — cần ≥ 4.5:1',
+    'JSON-LD block {"@type": "Organization"} is missing a logo',
+    'Array syntax [1, 2, 3] in data attributes',
+]
+
+
+def make_response(issues: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {
+        "performance_score": rng.randrange(100),
+        "accessibility_score": rng.randrange(100),
+        "seo_score": rng.randrange(100),
+        "issues": [
+            {
+                "category": rng.choice(["performance", "accessibility", "seo", "code-quality"]),
+                "severity": rng.choice(["critical", "high", "medium", "low"]),
+                "title": f"Issue {i}: {rng.choice(TRICKY_TEXT)[:40]}",
+                "description": " ".join(rng.choice(TRICKY_TEXT) for _ in range(3)),
+                "recommendation": rng.choice(TRICKY_TEXT),
+            }
+            for i in range(issues)
+        ],
+        "metrics": {"fcp": 1200.5, "lcp": 2810.0, "cls": 0.08, "load_time": 3900},
+    }
+
+
+def _trailing_commas(text: str) -> str:
+    # Chỉ thêm sau dấu đóng nằm ngoài chuỗi (dùng chính tokenizer để khỏi chèn vào chuỗi)
+    return re.sub(r'("(?:[^"\\]|\\.)*")|([}\]])(?=\s*[}\]])', lambda m: m.group(1) or m.group(2) + ",", text)
+
+
+# (tên, hàm biến đổi, có khôi phục được nguyên vẹn không)
+VARIANTS = [
+    ("plain", lambda s, rng: s, True),
+    ("pretty", lambda s, rng: json.dumps(json.loads(s), indent=2, ensure_ascii=False), True),
+    ("fenced", lambda s, rng: f"```json\n{s}\n```", True),
+    ("fenced_no_lang", lambda s, rng: f"```\n{s}\n```", True),
+    ("prose_around", lambda s, rng: f"Here is the analysis you asked for:\n\n{s}\n\nLet me know if you need more.", True),
+    ("placeholder_before", lambda s, rng: f"Format {{score}} as requested. Result:\n{s}", True),
+    ("trailing_commas", lambda s, rng: _trailing_commas(json.dumps(json.loads(s), indent=2, ensure_ascii=False)), True),
+    ("truncated", lambda s, rng: s[: rng.randrange(len(s) // 4, len(s) - 1)], False),
+    ("fenced_truncated", lambda s, rng: "```json\n" + s[: rng.randrange(len(s) // 4, len(s) - 1)], False),
+]
+
+
+def legacy_parse(content: str) -> dict:
+    """AIAgentService._parse_json_content trước khi có json_extract."""
+
+    def try_load(s: str):
+        return json.loads(s.strip())
+
+    try:
+        return try_load(content)
+    except Exception:
+        pass
+    for block in re.findall(r"```(?:json|JSON)?\n([\s\S]*?)\n```", content):
+        try:
+            return try_load(block)
+        except Exception:
+            continue
+    start = content.find("{")
+    end = content.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        depth = 0
+        last = None
+        for i, ch in enumerate(content[start:end + 1], start):
+            if ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    last = i + 1
+                    break
+        if last:
+            try:
+                return try_load(content[start:last])
+            except Exception:
+                pass
+    raise ValueError("Cannot parse AI response as JSON")
+
+
+def _outcome(parse, content: str, original: dict, exact: bool) -> str:
+    try:
+        value = parse(content)
+    except (JSONExtractionError, ValueError):
+        return "failed"
+    if value == original:
+        return "exact"
+    if not exact and isinstance(value, dict):
+        issues = value.get("issues")
+        if issues is None or (isinstance(issues, list) and issues == original["issues"][: len(issues)]):
+            return "salvaged"
+    return "wrong"
+
+
+def fuzz(cases: int, issues: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    report = {name: {"new": {}, "legacy": {}} for name, _, _ in VARIANTS}
+    violations = []
+    for case in range(cases):
+        original = make_response(rng.randrange(1, issues + 1), seed=case)
+        text = json.dumps(original, ensure_ascii=False)
+        name, transform, exact = VARIANTS[case % len(VARIANTS)]
+        content = transform(text, rng)
+        for label, parse in (("new", extract_json), ("legacy", legacy_parse)):
+            try:
+                outcome = _outcome(parse, content, original, exact)
+            except Exception as e:  # bất kỳ lỗi nào khác là bug
+                outcome = f"crash:{type(e).__name__}"
+            counts = report[name][label]
+            counts[outcome] = counts.get(outcome, 0) + 1
+            if label == "new" and (outcome == "wrong" or outcome.startswith("crash") or (exact and outcome != "exact")):
+                violations.append({"case": case, "variant": name, "outcome": outcome})
+    return {"cases": cases, "by_variant": report, "violations": violations[:20], "violation_count": len(violations)}
+
+
+def time_parse(parse, content: str, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        try:
+            parse(content)
+        except ValueError:
+            pass
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "min_ms": round(min(samples), 3)}
+
+
+def benchmark(issues: int, iterations: int) -> dict:
+    text = json.dumps(make_response(issues), ensure_ascii=False)
+    rng = random.Random(1)
+    results = {"response_chars": len(text)}
+    orjson_module = json_extract.orjson
+    for name, transform, _ in VARIANTS:
+        content = transform(text, rng)
+        row = {"legacy": time_parse(legacy_parse, content, iterations)}
+        if orjson_module is not None:
+            row["new_orjson"] = time_parse(extract_json, content, iterations)
+        json_extract.orjson = None
+        try:
+            row["new_stdlib_json"] = time_parse(extract_json, content, iterations)
+        finally:
+            json_extract.orjson = orjson_module
+        results[name] = row
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--issues", type=int, default=150, help="Issues in the benchmark response (~20k tokens at 150)")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--fuzz", type=int, default=1000, help="Number of fuzz cases (0 = skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {"benchmark": benchmark(args.issues, args.iterations)}
+    if args.fuzz:
+        results["fuzz"] = fuzz(args.fuzz, 40, args.seed)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if results.get("fuzz", {}).get("violation_count"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
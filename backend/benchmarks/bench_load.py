@@ -0,0 +1,417 @@
+"""
+Load test toàn hệ thống không cần OpenRouter hay website thật: chạy stub
+`/chat/completions` (benchmarks/stub_openrouter.py) và phục vụ các site tĩnh trong
+benchmarks/sites, khởi động API (uvicorn, worker nhúng) trỏ vào stub, rồi gửi
+`POST /analyze` với số job đồng thời cho trước và chờ từng job xong.
+
+    python -m benchmarks.bench_load --jobs 40 --concurrency 8 --workers 4 --latency-ms 1500 \\
+        --output bench-results/$(git rev-parse --short HEAD).json --baseline bench-results/main.json
+
+DATABASE_URL phải trỏ tới database đã `alembic upgrade head`. Kết quả là JSON: p50/p95/p99
+theo stage (từ `timings` của job), queue wait, thời gian end-to-end phía client, jobs/phút,
+RSS đỉnh của cây process server và số process Chromium đỉnh. `--baseline` thêm phần
+so sánh với file kết quả của commit khác.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.stub_openrouter import add_stub_arguments, create_stub_app, stub_config
+
+try:
+    import psutil
+except ImportError:  # không có psutil thì đọc /proc (chỉ Linux)
+    psutil = None
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SITES_DIR = Path(__file__).resolve().parent / "sites"
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+PERCENTILES = (50, 95, 99)
+# Tên process của Chromium do Playwright chạy (bản đầy đủ và headless shell)
+CHROMIUM_NAMES = ("chrome", "chromium", "headless_shell")
+
+
+class JobSample(NamedTuple):
+    site: str
+    status: str
+    # Từ lúc POST /analyze tới khi client thấy trạng thái cuối
+    end_to_end: float
+    timings: Dict
+    error: Optional[str]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    summary = {"count": len(ordered), "mean": round(sum(ordered) / len(ordered), 3)}
+    for p in PERCENTILES:
+        # Nội suy tuyến tính giữa hai hạng gần nhất
+        rank = (len(ordered) - 1) * p / 100
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        summary[f"p{p}"] = round(ordered[low] + (ordered[high] - ordered[low]) * (rank - low), 3)
+    summary["max"] = round(ordered[-1], 3)
+    return summary
+
+
+def _proc_tree(root_pid: int) -> List[Dict]:
+    """Các process trong cây `root_pid`: pid, tên, RSS (byte)."""
+    if psutil is not None:
+        try:
+            root = psutil.Process(root_pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        tree = []
+        for process in processes:
+            try:
+                tree.append({"pid": process.pid, "name": process.name(), "rss": process.memory_info().rss})
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return tree
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    children: Dict[int, List[int]] = defaultdict(list)
+    info: Dict[int, Dict] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        # Tên nằm trong ngoặc và có thể chứa khoảng trắng: tách theo ngoặc đóng cuối cùng
+        name = stat[stat.find("(") + 1:stat.rfind(")")]
+        ppid = int(stat[stat.rfind(")") + 2:].split()[1])
+        pid = int(entry)
+        children[ppid].append(pid)
+        info[pid] = {"pid": pid, "name": name, "rss": rss_pages * page_size}
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        if pid in info:
+            tree.append(info[pid])
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+class ResourceSampler:
+    """Lấy mẫu RSS và số process Chromium của cây process server theo chu kỳ."""
+
+    def __init__(self, pid: int, interval: float):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_server_rss = 0
+        self.peak_chromium_rss = 0
+        self.peak_chromium_processes = 0
+        self.peak_processes = 0
+        self.samples = 0
+
+    def sample(self) -> None:
+        tree = _proc_tree(self.pid)
+        if not tree:
+            return
+        chromium = [p for p in tree if any(name in p["name"].lower() for name in CHROMIUM_NAMES)]
+        self.samples += 1
+        self.peak_rss = max(self.peak_rss, sum(p["rss"] for p in tree))
+        self.peak_server_rss = max(self.peak_server_rss, next((p["rss"] for p in tree if p["pid"] == self.pid), 0))
+        self.peak_chromium_rss = max(self.peak_chromium_rss, sum(p["rss"] for p in chromium))
+        self.peak_chromium_processes = max(self.peak_chromium_processes, len(chromium))
+        self.peak_processes = max(self.peak_processes, len(tree))
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.to_thread(self.sample)
+            await asyncio.sleep(self.interval)
+
+    def report(self) -> Dict:
+        mib = 1024 * 1024
+        return {
+            "samples": self.samples,
+            "peak_rss_mib": round(self.peak_rss / mib, 1),
+            "peak_server_rss_mib": round(self.peak_server_rss / mib, 1),
+            "peak_chromium_rss_mib": round(self.peak_chromium_rss / mib, 1),
+            "peak_chromium_processes": self.peak_chromium_processes,
+            "peak_processes": self.peak_processes,
+        }
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def sites_app() -> web.Application:
+    app = web.Application()
+    app.router.add_static("/", SITES_DIR, show_index=False)
+    return app
+
+
+def start_server(args: argparse.Namespace, port: int, stub_url: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OPENROUTER_BASE_URL": stub_url,
+        "OPENROUTER_API_KEY": os.environ.get("OPENROUTER_API_KEY", "benchmark"),
+        "EMBEDDED_WORKER_CONCURRENCY": str(args.workers),
+        # Mỗi job phải thực sự gọi stub, và governor không được thành nút thắt
+        "LLM_MEMO_BACKEND": "none",
+        "LLM_REQUESTS_PER_MINUTE": "100000",
+        "LLM_MAX_CONCURRENCY": "1000",
+        "LLM_BACKOFF_BASE": "0.1",
+        "LLM_BACKOFF_MAX": "1",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+async def wait_for_server(session: aiohttp.ClientSession, api_url: str, server: Optional[subprocess.Popen], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"API server exited with code {server.returncode}")
+        try:
+            async with session.get(f"{api_url}/") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"API server at {api_url} did not start within {timeout:.0f}s")
+
+
+async def run_job(session: aiohttp.ClientSession, api_url: str, site: str, url: str, args: argparse.Namespace) -> JobSample:
+    started = time.monotonic()
+    async with session.post(f"{api_url}/api/v1/analyze", json={"url": url, "force_refresh": True}) as response:
+        response.raise_for_status()
+        job_id = (await response.json())["job_id"]
+
+    while True:
+        await asyncio.sleep(args.poll_interval)
+        async with session.get(f"{api_url}/api/v1/status/{job_id}") as response:
+            status = await response.json()
+        if status["status"] in TERMINAL_STATUSES:
+            result = status.get("result") or {}
+            return JobSample(
+                site, status["status"], time.monotonic() - started, result.get("timings") or {}, status.get("error_message")
+            )
+        if time.monotonic() - started > args.job_timeout:
+            return JobSample(site, "TIMEOUT", time.monotonic() - started, {}, f"no result after {args.job_timeout}s")
+
+
+async def drive(session: aiohttp.ClientSession, api_url: str, site_url: str, args: argparse.Namespace) -> List[JobSample]:
+    sites = args.sites.split(",") if args.sites else sorted(p.name for p in SITES_DIR.iterdir() if p.is_dir())
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(args.jobs):
+        site = sites[index % len(sites)]
+        # Query khác nhau để không trúng result cache theo URL
+        queue.put_nowait((site, f"{site_url}/{site}/index.html?run={index}"))
+    samples: List[JobSample] = []
+
+    async def client() -> None:
+        while not queue.empty():
+            site, url = queue.get_nowait()
+            try:
+                samples.append(await run_job(session, api_url, site, url, args))
+            except aiohttp.ClientError as e:
+                samples.append(JobSample(site, "CLIENT_ERROR", 0.0, {}, repr(e)))
+
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    return samples
+
+
+def summarize(samples: List[JobSample], wall_seconds: float) -> Dict:
+    completed = [s for s in samples if s.status == "COMPLETED"]
+    stages: Dict[str, List[float]] = defaultdict(list)
+    for sample in completed:
+        for name, stage in (sample.timings.get("stages") or {}).items():
+            stages[name].append(stage["duration"])
+    errors: Dict[str, int] = defaultdict(int)
+    for sample in samples:
+        if sample.error:
+            errors[sample.error[:120]] += 1
+
+    return {
+        "jobs": {
+            "submitted": len(samples),
+            "by_status": {status: sum(1 for s in samples if s.status == status) for status in sorted({s.status for s in samples})},
+            "top_errors": dict(sorted(errors.items(), key=lambda item: -item[1])[:5]),
+        },
+        "throughput": {
+            "wall_seconds": round(wall_seconds, 2),
+            "jobs_per_minute": round(len(completed) / wall_seconds * 60, 2) if wall_seconds else 0.0,
+        },
+        "latency_seconds": {
+            "end_to_end": percentiles([s.end_to_end for s in completed]),
+            "job_total": percentiles([s.timings["total"] for s in completed if "total" in s.timings]),
+            "queue_wait": percentiles([s.timings["queue_wait"] for s in completed if s.timings.get("queue_wait") is not None]),
+        },
+        "stages_seconds": {name: percentiles(values) for name, values in sorted(stages.items())},
+    }
+
+
+def compare(current: Dict, baseline: Dict) -> Dict:
+    """Thay đổi tương đối (%) của các chỉ số chính so với baseline; âm là tốt hơn trừ jobs/phút."""
+
+    def change(new: Optional[float], old: Optional[float]) -> Optional[float]:
+        if new is None or not old:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    diff = {
+        "baseline_commit": baseline.get("meta", {}).get("commit"),
+        "jobs_per_minute_pct": change(
+            current["throughput"]["jobs_per_minute"], baseline.get("throughput", {}).get("jobs_per_minute")
+        ),
+        "peak_rss_pct": change(
+            current.get("resources", {}).get("peak_rss_mib"), baseline.get("resources", {}).get("peak_rss_mib")
+        ),
+        "latency_pct": {},
+    }
+    sections = [("end_to_end", "latency_seconds"), ("queue_wait", "latency_seconds")]
+    sections += [(name, "stages_seconds") for name in current["stages_seconds"]]
+    for name, section in sections:
+        new, old = current[section].get(name, {}), baseline.get(section, {}).get(name, {})
+        diff["latency_pct"][name] = {f"p{p}": change(new.get(f"p{p}"), old.get(f"p{p}")) for p in PERCENTILES}
+    return diff
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    stub_port, site_port = _free_port(), _free_port()
+    stub_runner = await start_site(create_stub_app(stub_config(args)), stub_port)
+    site_runner = await start_site(sites_app(), site_port)
+    stub_url = f"http://127.0.0.1:{stub_port}/api/v1"
+
+    server = None
+    api_url = args.api_url
+    server_pid = args.server_pid
+    if api_url is None:
+        if (BACKEND_DIR / ".env").exists():
+            # config.py nạp .env với override=True nên giá trị trong .env thắng biến môi trường
+            print("warning: backend/.env overrides the benchmark environment; move it aside for clean runs", file=sys.stderr)
+        api_port = _free_port()
+        api_url = f"http://127.0.0.1:{api_port}"
+        server = start_server(args, api_port, stub_url)
+        server_pid = server.pid
+    else:
+        print(f"Point the server at the stub: OPENROUTER_BASE_URL={stub_url}", file=sys.stderr)
+
+    sampler = ResourceSampler(server_pid, args.sample_interval) if server_pid else None
+    sampler_task = None
+    try:
+        timeout = aiohttp.ClientTimeout(total=60)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await wait_for_server(session, api_url, server, args.startup_timeout)
+            if sampler is not None:
+                sampler_task = asyncio.create_task(sampler.run())
+            started = time.monotonic()
+            samples = await drive(session, api_url, f"http://127.0.0.1:{site_port}", args)
+            wall_seconds = time.monotonic() - started
+            async with session.get(f"http://127.0.0.1:{stub_port}/stats") as response:
+                stub_stats = await response.json()
+    finally:
+        if sampler_task is not None:
+            sampler_task.cancel()
+            await asyncio.gather(sampler_task, return_exceptions=True)
+        if server is not None:
+            server.send_signal(signal.SIGINT)
+            try:
+                await asyncio.to_thread(server.wait, 30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        await stub_runner.cleanup()
+        await site_runner.cleanup()
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "jobs": args.jobs,
+                "concurrency": args.concurrency,
+                "workers": args.workers,
+                "stub": stub_config(args)._asdict(),
+                "env": args.env,
+            },
+        },
+        **summarize(samples, wall_seconds),
+        "resources": sampler.report() if sampler is not None else None,
+        "llm_stub": stub_stats,
+    }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=20, help="Total jobs to submit")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs in flight from the client")
+    parser.add_argument("--workers", type=int, default=4, help="EMBEDDED_WORKER_CONCURRENCY of the started server")
+    parser.add_argument("--sites", default="", help="Comma-separated subset of benchmarks/sites (default: all)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra server setting (repeatable)")
+    parser.add_argument("--api-url", default=None, help="Use a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID to sample RSS from with --api-url")
+    parser.add_argument("--job-timeout", type=float, default=300.0)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--output", default=None, help="Also write the JSON results to this file")
+    parser.add_argument("--baseline", default=None, help="Results file of another commit to compare against")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.baseline:
+        results["comparison"] = compare(results, json.loads(Path(args.baseline).read_text()))
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(text + "\n")
+    print(text)
+    if not results["jobs"]["by_status"].get("COMPLETED"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
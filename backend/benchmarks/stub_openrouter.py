@@ -0,0 +1,191 @@
+"""
+Stub `/chat/completions` cục bộ thay cho OpenRouter khi benchmark/load test.
+
+    python -m benchmarks.stub_openrouter --port 8788 --latency-ms 1500 --error-rate 0.05
+
+Rồi chạy backend với OPENROUTER_BASE_URL=http://127.0.0.1:8788/api/v1. Response có
+đúng dạng mỗi agent mong đợi (nhận ra qua prompt), hỗ trợ cả `stream: true` (SSE, có
+`usage` ở chunk cuối). Độ trễ theo phân phối log-normal quanh `latency_ms`, lỗi
+`error_status` được trả ngẫu nhiên theo `error_rate`, kích thước response theo số issue
+và độ dài mô tả. `GET /stats` trả số request/lỗi/byte theo agent.
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Dict, NamedTuple, Optional
+
+from aiohttp import web
+
+# Số ký tự mỗi chunk SSE
+STREAM_CHUNK_CHARS = 64
+
+
+class StubConfig(NamedTuple):
+    # Trung vị độ trễ tới token đầu tiên (ms) và độ lệch (sigma của log-normal, 0 = cố định)
+    latency_ms: float = 1500.0
+    jitter: float = 0.3
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Kích thước response: số issue mỗi agent và độ dài mô tả mỗi issue
+    issues: int = 8
+    description_chars: int = 240
+    # Thời gian giữa các chunk khi stream (ms)
+    chunk_interval_ms: float = 5.0
+    seed: Optional[int] = None
+
+
+def prompt_text(payload: Dict) -> str:
+    """Phần chữ của các message (bỏ ảnh)."""
+    texts = []
+    for message in payload.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+        else:
+            texts.append(str(content or ""))
+    return "\n".join(texts)
+
+
+def detect_agent(payload: Dict) -> str:
+    content = prompt_text(payload)
+    if "executive_summary" in content:
+        return "synthesizer"
+    if "overall_design_score" in content:
+        return "vision_analyst"
+    if "ui_issues" in content:
+        return "vision_tiles"
+    return "code_analyst"
+
+
+def _issue(rng: random.Random, index: int, config: StubConfig, ui: bool) -> Dict:
+    words = "contrast spacing hierarchy payload render blocking layout shift image font cache".split()
+    description = " ".join(rng.choice(words) for _ in range(config.description_chars // 6))
+    issue = {
+        "category": rng.choice(["layout", "typography", "spacing"] if ui else ["performance", "accessibility", "seo"]),
+        "severity": rng.choice(["critical", "high", "medium", "low"]),
+        "title": f"Stub issue {index}",
+        "description": description[: config.description_chars],
+        "recommendation": "Fix it.",
+    }
+    if ui:
+        issue.update(
+            device="desktop",
+            image=1,
+            location={"x": rng.randrange(800), "y": rng.randrange(500), "width": 120, "height": 40},
+        )
+    return issue
+
+
+def make_content(agent: str, rng: random.Random, config: StubConfig) -> Dict:
+    if agent == "synthesizer":
+        return {
+            "executive_summary": "Stub summary. " * 20,
+            "priority_actions": [{"action": "Optimize images", "impact": "high", "effort": "easy"}],
+            "overall_score": rng.randrange(40, 95),
+        }
+    if agent == "code_analyst":
+        return {
+            "performance_score": rng.randrange(100),
+            "accessibility_score": rng.randrange(100),
+            "seo_score": rng.randrange(100),
+            "issues": [_issue(rng, i, config, ui=False) for i in range(config.issues)],
+            "metrics": {"fcp": 1200, "lcp": 2400, "cls": 0.05, "load_time": 3100},
+        }
+    content = {"ui_issues": [_issue(rng, i, config, ui=True) for i in range(config.issues)]}
+    if agent == "vision_analyst":
+        content.update(overall_design_score=rng.randrange(100), responsive_quality="good", positive_aspects=["stub"])
+    return content
+
+
+def create_stub_app(config: StubConfig) -> web.Application:
+    rng = random.Random(config.seed)
+    stats: Dict[str, Dict[str, int]] = {}
+
+    def count(agent: str, field: str, value: int = 1) -> None:
+        entry = stats.setdefault(agent, {"requests": 0, "errors": 0, "bytes": 0})
+        entry[field] += value
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        agent = detect_agent(payload)
+        count(agent, "requests")
+
+        delay = config.latency_ms / 1000
+        if config.jitter > 0:
+            delay *= rng.lognormvariate(0, config.jitter)
+        await asyncio.sleep(delay)
+        if rng.random() < config.error_rate:
+            count(agent, "errors")
+            return web.json_response({"error": {"message": "stub error"}}, status=config.error_status)
+
+        text = json.dumps(make_content(agent, rng, config))
+        prompt_chars = len(prompt_text(payload))
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(text) // 4,
+            "total_tokens": prompt_chars // 4 + len(text) // 4,
+        }
+        count(agent, "bytes", len(text))
+
+        if not payload.get("stream"):
+            return web.json_response(
+                {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": usage}
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            chunk = {"choices": [{"delta": {"content": text[start:start + STREAM_CHUNK_CHARS]}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            if config.chunk_interval_ms:
+                await asyncio.sleep(config.chunk_interval_ms / 1000)
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/api/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = StubConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="Median LLM latency")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="Log-normal sigma of the latency")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Fraction of failed calls")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--issues", type=int, default=defaults.issues, help="Issues per analyst response")
+    parser.add_argument("--description-chars", type=int, default=defaults.description_chars)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def stub_config(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        latency_ms=args.latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        issues=args.issues,
+        description_chars=args.description_chars,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8788)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(create_stub_app(stub_config(args)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
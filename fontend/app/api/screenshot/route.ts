@@ -23,7 +23,24 @@ export async function GET(request: NextRequest) {
     const backendUrl = `${BACKEND_URL}/api/v1/screenshot/${jobId}/${device}`;
     console.log('Proxying screenshot request to:', backendUrl);
 
-    const response = await fetch(backendUrl);
+    // Forward format negotiation and conditional headers so the backend can pick WebP and answer 304
+    const forwardHeaders: Record<string, string> = {};
+    for (const name of ["accept", "if-none-match", "range", "if-range"]) {
+      const value = request.headers.get(name);
+      if (value) forwardHeaders[name] = value;
+    }
+
+    const response = await fetch(backendUrl, { headers: forwardHeaders });
+
+    if (response.status === 304) {
+      return new NextResponse(null, {
+        status: 304,
+        headers: {
+          ETag: response.headers.get("etag") || "",
+          "Cache-Control": response.headers.get("cache-control") || "public, max-age=3600",
+        },
+      });
+    }
 
     if (!response.ok) {
       console.log('Backend returned error:', response.status, response.statusText);
@@ -38,13 +55,17 @@ export async function GET(request: NextRequest) {
     // Get the image data
     const imageBuffer = await response.arrayBuffer();
 
-    // Return the image with proper headers
-    return new NextResponse(imageBuffer, {
-      headers: {
-        "Content-Type": "image/png",
-        "Cache-Control": "public, max-age=3600", // Cache for 1 hour
-      },
-    });
+    // Return the image with the backend's caching headers (content-addressed, immutable)
+    const headers: Record<string, string> = {
+      "Content-Type": response.headers.get("content-type") || "image/png",
+      "Cache-Control": response.headers.get("cache-control") || "public, max-age=3600",
+      Vary: "Accept",
+    };
+    for (const name of ["etag", "content-range", "accept-ranges"]) {
+      const value = response.headers.get(name);
+      if (value) headers[name] = value;
+    }
+    return new NextResponse(imageBuffer, { status: response.status, headers });
   } catch (error) {
     console.error("Screenshot fetch error:", error);
     // Return placeholder on any error
@@ -80,8 +80,8 @@ export async function GET(request: NextRequest) {
   }
 
   try {
-    // Poll backend API for job status
-    const response = await fetch(`${BACKEND_URL}/api/v1/status/${job_id}`);
+    // Endpoint nhẹ: chỉ status/stage, result chỉ trả về khi job đã xong
+    const response = await fetch(`${BACKEND_URL}/api/v1/status/${job_id}/progress`);
 
     if (!response.ok) {
       return NextResponse.json(